@@ -158,6 +158,22 @@ class AccessDemultiplexerInterface(metaclass=ABCMeta):
     async def read(self, length=None, *, flush=True):
         pass
 
+    async def read_into(self, buffer, *, flush=True):
+        """
+        Read at least one byte, and at most ``len(buffer)`` bytes, into ``buffer``. Returns
+        the amount of bytes read.
+        """
+        # Implementations that buffer data should override this method to return early.
+        return await self.readexactly_into(buffer, flush=flush)
+
+    async def readexactly_into(self, buffer, *, flush=True):
+        """
+        Read exactly ``len(buffer)`` bytes into ``buffer``. Returns ``len(buffer)``.
+        """
+        buffer = memoryview(buffer).cast("B")
+        buffer[:] = await self.read(len(buffer), flush=flush)
+        return len(buffer)
+
     @abstractmethod
     async def write(self, data):
         pass
@@ -1,4 +1,5 @@
 import math
+import time
 import usb1
 import asyncio
 
@@ -50,14 +51,107 @@ _max_packets_per_ep = 1024
 # a read of dozens of megabytes, this can take seconds.
 #
 # To try and balance these effects, we choose a medium buffer size that should work well with most
-# applications. It's possible that this will need to become customizable later, but for now
-# a single fixed value works.
+# applications by default. Applets with unusual requirements (e.g. bulk capture, which benefits
+# from large transfers, or JTAG, which benefits from small ones) can override the transfer size and
+# queue depth for each direction when claiming the interface, or request that they be adjusted
+# automatically at runtime.
 _packets_per_xfer = 32
 
 # Queue as many transfers as we can, but no more than 16, as the returns beyond that point
 # are diminishing.
 _xfers_per_queue = min(16, _max_packets_per_ep // _packets_per_xfer)
 
+# When automatic tuning is enabled, transfers that are serviced faster than this are considered
+# cheap enough to grow, and transfers that take longer than twice this to service are considered
+# to hold data back for too long. The service time of a transfer is the time between its completion
+# and either its submission or the completion of the previous transfer, whichever is later; unlike
+# the time between submission and completion, it does not include the time the transfer spent
+# queued behind the other transfers in flight.
+_auto_tune_latency = 0.005
+
+
+class _TransferSizing:
+    """
+    Transfer size and queue depth for one direction of a pipe.
+
+    If ``auto_tune`` is enabled, :meth:`observe` adjusts ``packets_per_xfer`` and
+    ``xfers_per_queue`` based on how full the completed transfers were and how long they took to
+    service, without ever exceeding the ``_max_packets_per_ep`` budget. The queue depth is never
+    reduced below its initial value.
+    """
+    def __init__(self, packet_size, packets_per_xfer=None, xfers_per_queue=None, *,
+                 auto_tune=False):
+        if packets_per_xfer is None:
+            packets_per_xfer = _packets_per_xfer
+        if xfers_per_queue is None:
+            xfers_per_queue = min(_xfers_per_queue, _max_packets_per_ep // packets_per_xfer)
+        if packets_per_xfer < 1 or xfers_per_queue < 1:
+            raise ValueError("transfer size and queue depth must be positive")
+        if packets_per_xfer * xfers_per_queue > _max_packets_per_ep:
+            raise ValueError("transfer size of {} packets and queue depth of {} transfers exceed "
+                             "the budget of {} packets per endpoint"
+                             .format(packets_per_xfer, xfers_per_queue, _max_packets_per_ep))
+
+        self.packet_size      = packet_size
+        self.packets_per_xfer = packets_per_xfer
+        self.xfers_per_queue  = xfers_per_queue
+        self.auto_tune        = auto_tune
+
+        self._min_xfers_per_queue = xfers_per_queue
+        self._last_completed_at   = None
+
+        self.grow_count   = 0
+        self.shrink_count = 0
+
+    @property
+    def xfer_size(self):
+        return self.packet_size * self.packets_per_xfer
+
+    def _can_grow(self, packets_per_xfer, xfers_per_queue):
+        return packets_per_xfer * xfers_per_queue <= _max_packets_per_ep
+
+    def observe(self, submitted_at, completed_at, *, full, backlog):
+        """
+        Adjust sizing after a transfer submitted at ``submitted_at`` completed at ``completed_at``
+        (both in seconds, as returned by :func:`time.monotonic`).
+
+        ``full`` indicates whether the transfer was as large as requested. ``backlog`` indicates
+        whether more data was waiting to be transferred when the transfer completed, i.e. whether
+        a larger transfer or a deeper queue would have been filled.
+        """
+        if self._last_completed_at is None:
+            service_time = completed_at - submitted_at
+        else:
+            service_time = completed_at - max(submitted_at, self._last_completed_at)
+        self._last_completed_at = completed_at
+        if not self.auto_tune:
+            return
+
+        if backlog and service_time < _auto_tune_latency:
+            # The pipe is saturated and transfers are cheap; amortize per-transfer overhead over
+            # more packets, or keep more transfers in flight once transfers are as large as the
+            # budget allows.
+            if self._can_grow(self.packets_per_xfer * 2, self.xfers_per_queue):
+                self.packets_per_xfer *= 2
+                self.grow_count += 1
+            elif self._can_grow(self.packets_per_xfer, self.xfers_per_queue + 1):
+                self.xfers_per_queue += 1
+                self.grow_count += 1
+        elif full and service_time > 2 * _auto_tune_latency:
+            # Data is trickling in (or out) steadily, and large transfers hold it back; trade
+            # throughput for latency, first by keeping fewer transfers in flight, and then by
+            # making them smaller.
+            if self.xfers_per_queue > self._min_xfers_per_queue:
+                self.xfers_per_queue -= 1
+                self.shrink_count += 1
+            elif self.packets_per_xfer > 1:
+                self.packets_per_xfer //= 2
+                self.shrink_count += 1
+        elif not full and not backlog and self.xfers_per_queue > self._min_xfers_per_queue:
+            # The pipe has gone idle; the extra transfers in flight are no longer needed.
+            self.xfers_per_queue -= 1
+            self.shrink_count += 1
+
 
 class DirectDemultiplexer(AccessDemultiplexer):
     def __init__(self, device, pipe_count):
@@ -140,7 +234,10 @@ class DirectDemultiplexer(AccessDemultiplexer):
 
 class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
     def __init__(self, device, applet, mux_interface,
-                 read_buffer_size=None, write_buffer_size=None):
+                 read_buffer_size=None, write_buffer_size=None,
+                 read_packets_per_xfer=None, read_xfers_per_queue=None,
+                 write_packets_per_xfer=None, write_xfers_per_queue=None,
+                 auto_tune=False):
         super().__init__(device, applet)
 
         self._write_buffer_size = write_buffer_size
@@ -173,6 +270,11 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
                 self._out_packet_size = packet_size
         assert self._endpoint_in != None and self._endpoint_out != None
 
+        self._in_sizing  = _TransferSizing(self._in_packet_size,
+            read_packets_per_xfer, read_xfers_per_queue, auto_tune=auto_tune)
+        self._out_sizing = _TransferSizing(self._out_packet_size,
+            write_packets_per_xfer, write_xfers_per_queue, auto_tune=auto_tune)
+
         self._interface  = self.device.usb_handle.claimInterface(self._pipe_num)
         self._in_tasks   = TaskQueue()
         self._in_buffer  = ChunkedFIFO()
@@ -193,6 +295,8 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
 
         self.logger.trace("asserting reset")
         await self.device.write_register(self._addr_reset, 1)
+        # Applet registers may be reset together with the interface.
+        self.device.forget_registers()
 
         self.logger.trace("FIFO: synchronizing buffers")
         self.device.usb_handle.setInterfaceAltSetting(self._pipe_num, 1)
@@ -203,7 +307,7 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
         # streaming data, there are no overflows. (This is perhaps not the best way to implement
         # an applet, but we can support it easily enough, and it avoids surprise overflows.)
         self.logger.trace("FIFO: pipelining reads")
-        for _ in range(_xfers_per_queue):
+        for _ in range(self._in_sizing.xfers_per_queue):
             self._in_tasks.submit(self._in_task())
         # Give the IN tasks a chance to submit their transfers before deasserting reset.
         await asyncio.sleep(0)
@@ -218,11 +322,18 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
                     self.logger.trace("FIFO: read pushback")
                     await self._in_pushback.wait()
 
-        size = self._in_packet_size * _packets_per_xfer
+        size = self._in_sizing.xfer_size
+        submitted_at = time.monotonic()
         data = await self.device.bulk_read(self._endpoint_in, size)
-        self._in_buffer.write(data)
-
-        self._in_tasks.submit(self._in_task())
+        self._in_sizing.observe(submitted_at, time.monotonic(),
+            full=len(data) == size, backlog=len(data) == size)
+        self._in_buffer.write(data, release=self.device.release_buffer)
+
+        # Resubmit this transfer, and if the queue depth has been changed by automatic tuning,
+        # fill the queue up or let it drain by one transfer. (This task is still counted in
+        # the queue.)
+        while len(self._in_tasks) <= self._in_sizing.xfers_per_queue:
+            self._in_tasks.submit(self._in_task())
 
     async def read(self, length=None, *, flush=True):
         if flush and len(self._out_buffer) > 0:
@@ -250,51 +361,98 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
             result = self._in_buffer.read(length)
             self._in_pushback.notify_all()
         if len(result) < length:
-            chunks  = [result]
-            length -= len(result)
-            while length > 0:
-                async with self._in_pushback:
-                    chunk = self._in_buffer.read(length)
-                    self._in_pushback.notify_all()
-                chunks.append(chunk)
-                length -= len(chunk)
+            # The data spans several chunks; gather it into a single buffer, copying it only once.
             # Always return a memoryview object, to avoid hard to detect edge cases downstream.
-            result = memoryview(b"".join(chunks))
+            buffer = memoryview(bytearray(length))
+            buffer[:len(result)] = result
+            await self._in_readinto(buffer[len(result):])
+            result = buffer
 
         self.logger.trace("FIFO: read <%s>", dump_hex(result))
         return result
 
+    async def _in_readinto(self, buffer):
+        async with self._in_pushback:
+            length = self._in_buffer.readinto(buffer)
+            self._in_pushback.notify_all()
+        return length
+
+    async def read_into(self, buffer, *, flush=True):
+        if flush and len(self._out_buffer) > 0:
+            # Flush the buffer, so that everything written before the read reaches the device.
+            await self.flush(wait=False)
+
+        buffer = memoryview(buffer).cast("B")
+        if len(buffer) == 0:
+            return 0
+        if not self._in_buffer:
+            self._in_stalls += 1
+            while not self._in_buffer:
+                await self._in_tasks.wait_one()
+
+        length = await self._in_readinto(buffer)
+        self.logger.trace("FIFO: read <%s>", dump_hex(buffer[:length]))
+        return length
+
+    async def readexactly_into(self, buffer, *, flush=True):
+        if flush and len(self._out_buffer) > 0:
+            # Flush the buffer, so that everything written before the read reaches the device.
+            await self.flush(wait=False)
+
+        # Unlike `read(length)`, this consumes data as it arrives, so the read buffer size limit
+        # does not need to accommodate the entire request.
+        buffer = memoryview(buffer).cast("B")
+        offset = await self._in_readinto(buffer)
+        if offset < len(buffer):
+            self._in_stalls += 1
+        while offset < len(buffer):
+            self.logger.trace("FIFO: need %d bytes", len(buffer) - offset)
+            await self._in_tasks.wait_one()
+            offset += await self._in_readinto(buffer[offset:])
+
+        self.logger.trace("FIFO: read <%s>", dump_hex(buffer))
+        return offset
+
     def _out_slice(self):
+        # The slice is returned as a list of FIFO chunks, which `bulk_write` gathers directly into
+        # a transfer buffer, so that the data is only copied once.
+        #
         # Fast path: read as much contiguous data as possible, up to our transfer size.
-        size = self._out_packet_size * _packets_per_xfer
-        data = self._out_buffer.read(size)
+        size = self._out_sizing.xfer_size
+        chunks = [self._out_buffer.read(size)]
+        length = len(chunks[0])
 
-        if len(data) < self._out_packet_size:
+        if length < self._out_packet_size:
             # Slow path: USB is very inefficient with small packets, so if we only got a few
-            # bytes from the FIFO, and there is more in it, spend CPU time to aggregate that
-            # into a larger transfer, as this is likely to result in overall speedup.
-            data = bytearray(data)
-            while len(data) < self._out_packet_size and self._out_buffer:
-                data += self._out_buffer.read(self._out_packet_size - len(data))
+            # bytes from the FIFO, and there is more in it, aggregate that into a larger transfer,
+            # as this is likely to result in overall speedup.
+            while length < self._out_packet_size and self._out_buffer:
+                chunks.append(self._out_buffer.read(self._out_packet_size - length))
+                length += len(chunks[-1])
 
-        self._out_inflight += len(data)
-        return data
+        self._out_inflight += length
+        return chunks
 
     @property
     def _out_threshold(self):
-        out_xfer_size = self._out_packet_size * _packets_per_xfer
+        out_xfer_size = self._out_sizing.xfer_size
         if self._write_buffer_size is None:
             return out_xfer_size
         else:
             return min(self._write_buffer_size, out_xfer_size)
 
-    async def _out_task(self, data):
-        assert len(data) > 0
+    async def _out_task(self, chunks):
+        length = sum(map(len, chunks))
+        assert length > 0
 
+        size = self._out_sizing.xfer_size
+        submitted_at = time.monotonic()
         try:
-            await self.device.bulk_write(self._endpoint_out, data)
+            await self.device.bulk_write(self._endpoint_out, chunks)
         finally:
-            self._out_inflight -= len(data)
+            self._out_inflight -= length
+        self._out_sizing.observe(submitted_at, time.monotonic(),
+            full=length >= size, backlog=len(self._out_buffer) >= size)
 
         # See the comment in `write` below for an explanation of the following code.
         if len(self._out_buffer) >= self._out_threshold:
@@ -319,7 +477,7 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
         # The write scheduling algorithm attempts to satisfy several partially conflicting goals:
         #  * We want to schedule writes as early as possible, because this reduces buffer bloat and
         #    can dramatically improve responsiveness of the system.
-        #  * We want to schedule writes that are as large as possible, up to _packets_per_xfer,
+        #  * We want to schedule writes that are as large as possible, up to packets_per_xfer,
         #    because this reduces CPU utilization and improves latency.
         #  * We never want to automatically schedule writes smaller than _out_packet_size,
         #    because they occupy a whole microframe anyway.
@@ -327,17 +485,17 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
         # We use an approach that performs well when fed with a steady sequence of very large
         # FIFO chunks, yet scales down to packet-size and byte-size FIFO chunks as well.
         #  * We only submit a write automatically once the buffer level crosses the threshold of
-        #    `_out_packet_size * _packets_per_xfer`. In this case, _slice_packet always returns
-        #    `_out_packet_size * n` bytes, where n is between 1 and _packet_per_xfer.
+        #    `_out_packet_size * packets_per_xfer`. In this case, _slice_packet always returns
+        #    `_out_packet_size * n` bytes, where n is between 1 and packets_per_xfer.
         #  * We submit enough writes that there is at least one write for each transfer worth
-        #    of data in the buffer, up to _xfers_per_queue outstanding writes.
+        #    of data in the buffer, up to xfers_per_queue outstanding writes.
         #  * We submit another write once one finishes, if the buffer level is still above
         #    the threshold, even if no more explicit write calls are performed.
         #
-        # This provides predictable write behavior; only _packets_per_xfer packet writes are
+        # This provides predictable write behavior; only packets_per_xfer packet writes are
         # automatically submitted, and only the minimum necessary number of tasks are scheduled on
         # calls to `write`.
-        while len(self._out_tasks) < _xfers_per_queue and \
+        while len(self._out_tasks) < self._out_sizing.xfers_per_queue and \
                     len(self._out_buffer) >= self._out_threshold:
             self._out_tasks.submit(self._out_task(self._out_slice()))
 
@@ -345,23 +503,24 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
         self.logger.trace("FIFO: flush")
 
         # First, we ensure we can submit one more task. (There can be more tasks than
-        # _xfers_per_queue because a task may spawn another one just before it terminates.)
-        if len(self._out_tasks) >= _xfers_per_queue:
+        # xfers_per_queue because a task may spawn another one just before it terminates.)
+        if len(self._out_tasks) >= self._out_sizing.xfers_per_queue:
             self._out_stalls += 1
-        while len(self._out_tasks) >= _xfers_per_queue:
+        while len(self._out_tasks) >= self._out_sizing.xfers_per_queue:
             await self._out_tasks.wait_one()
 
-        # At this point, the buffer can contain at most _packets_per_xfer packets worth
+        # At this point, the buffer usually contains at most packets_per_xfer packets worth
         # of data, as anything beyond that crosses the threshold of automatic submission.
-        # So, we can simply submit the rest of data, which by definition fits into a single
-        # transfer.
-        assert len(self._out_buffer) <= self._out_packet_size * _packets_per_xfer
-        if self._out_buffer:
-            data = bytearray()
-            while self._out_buffer:
-                data += self._out_buffer.read()
-            self._out_inflight += len(data)
-            self._out_tasks.submit(self._out_task(data))
+        # (Automatic tuning can shrink the transfer size below the amount that is already
+        # buffered, in which case the rest is submitted as several transfers.)
+        while self._out_buffer:
+            chunks = []
+            length = 0
+            while self._out_buffer and length < self._out_sizing.xfer_size:
+                chunks.append(self._out_buffer.read(self._out_sizing.xfer_size - length))
+                length += len(chunks[-1])
+            self._out_inflight += length
+            self._out_tasks.submit(self._out_task(chunks))
 
         if wait:
             self.logger.trace("FIFO: wait for flush")
@@ -388,3 +547,16 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
                          self._in_tasks.total_wait_count)
         self.logger.info("  write wakeups : %d",
                          self._out_tasks.total_wait_count)
+        self.logger.info("  USB wakeups   : %d for %d completions (%d coalesced, shared)",
+                         self.device.usb_poller.wakeup_count,
+                         self.device.usb_poller.completion_count,
+                         self.device.usb_poller.coalesced_count)
+        self.logger.info("  USB buffers   : %d allocated, %d reused (shared)",
+                         self.device._transfer_pool.buffers_allocated,
+                         self.device._transfer_pool.buffers_reused)
+        self.logger.info("  read xfers    : %d x %d B (%d grown, %d shrunk)",
+                         self._in_sizing.xfers_per_queue, self._in_sizing.xfer_size,
+                         self._in_sizing.grow_count, self._in_sizing.shrink_count)
+        self.logger.info("  write xfers   : %d x %d B (%d grown, %d shrunk)",
+                         self._out_sizing.xfers_per_queue, self._out_sizing.xfer_size,
+                         self._out_sizing.grow_count, self._out_sizing.shrink_count)
@@ -14,6 +14,23 @@ __all__ = ["GlasgowAppletMetadata", "GlasgowAppletError", "GlasgowApplet", "Glas
 class GlasgowAppletMetadata(PluginMetadata):
     GROUP_NAME = "glasgow.applet"
 
+    @classmethod
+    def _describe(cls, applet_cls):
+        metadata = super()._describe(applet_cls)
+        metadata.update({
+            "preview": applet_cls.preview,
+            "required_revision": applet_cls.required_revision,
+            # Calling `applet_cls.tests()` would import the test module.
+            "has_tests": applet_cls.tests.__func__ is not GlasgowApplet.tests.__func__,
+            "tool": None,
+        })
+        if hasattr(applet_cls, "tool_cls"):
+            metadata["tool"] = {
+                "synopsis": applet_cls.tool_cls.help,
+                "description": applet_cls.tool_cls.description,
+            }
+        return metadata
+
     @property
     def applet_cls(self):
         return self.load()
@@ -22,6 +39,30 @@ class GlasgowAppletMetadata(PluginMetadata):
     def tool_cls(self):
         return self.load().tool_cls
 
+    @property
+    def preview(self):
+        return self._metadata["preview"]
+
+    @property
+    def required_revision(self):
+        return self._metadata["required_revision"]
+
+    @property
+    def has_tests(self):
+        return self._metadata["has_tests"]
+
+    @property
+    def has_tool(self):
+        return self._metadata["tool"] is not None
+
+    @property
+    def tool_synopsis(self):
+        return self._metadata["tool"]["synopsis"]
+
+    @property
+    def tool_description(self):
+        return self._metadata["tool"]["description"]
+
 
 class GlasgowAppletError(Exception):
     """An exception raised when an applet encounters an error."""
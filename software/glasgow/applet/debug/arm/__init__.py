@@ -51,6 +51,11 @@ class ARMDPInterface(metaclass=ABCMeta):
     async def read_ap_reg(self, index, addr):
         """Select AP ``index`` and read ``value`` from the AP register at ``addr``."""
 
+    async def flush(self):
+        """Make sure every transaction issued so far has completed successfully.
+
+        Data links that report failures of some transactions lazily must check them here."""
+
     # Data link independent interface
 
     async def set_debug_power(self, enabled):
@@ -118,3 +123,5 @@ class DebugARMAppletMixin:
                              ap_idr.TYPE, "unknown",
                              ap_idr.VARIANT,
                              ap_idr.REVISION)
+
+        await dp_iface.flush()
@@ -26,6 +26,7 @@ class ARMJTAGDPInterface(ARMDPInterface, aobject):
         self._logger = logger
         self._level  = logging.DEBUG if self._logger.name == __name__ else logging.TRACE
         self._select = DP_SELECT()
+        self._unchecked = False
 
         await self.reset()
 
@@ -34,24 +35,48 @@ class ARMJTAGDPInterface(ARMDPInterface, aobject):
 
     # Low-level xPACC operations
 
+    _ACK_OK_FAULT = DR_xPACC_capture(ACK=DR_xPACC_ACK.OK_FAULT).to_bits()
+    _ACK_MASK     = DR_xPACC_capture(ACK=0b111).to_bits()
+
+    async def _compare_xpacc(self, dr_update):
+        # The ACK is checked by the probe; a mismatch is reported by the next `_exchange_xpacc`,
+        # or by `flush` if there is none.
+        await self.lower.compare_dr(dr_update.to_bits(), self._ACK_OK_FAULT, self._ACK_MASK)
+        self._unchecked = True
+
+    async def _exchange_xpacc(self, dr_update_bits, count=None):
+        # If `count` is given, the transaction is repeated `count` times in one round trip, and
+        # a list of the captured values is returned.
+        async with self.lower.batch():
+            mismatch = await self.lower.get_compare()
+            dr_captures = [await self.lower.exchange_dr(dr_update_bits)
+                           for _ in range(1 if count is None else count)]
+        self._unchecked = False
+        assert mismatch.result() is None, "unexpected ACK in a previous xPACC transaction"
+        dr_captures = [DR_xPACC_capture.from_bits(dr_capture.result())
+                       for dr_capture in dr_captures]
+        return dr_captures[0] if count is None else dr_captures
+
+    async def flush(self):
+        if self._unchecked:
+            mismatch = await self.lower.get_compare()
+            self._unchecked = False
+            assert mismatch is None, "unexpected ACK in a previous xPACC transaction"
+
     async def _write_dpacc(self, addr, value):
         await self.lower.write_ir(IR_DPACC)
 
         dr_update = DR_xPACC_update(RnW=0, A=(addr & 0xf) >> 2, DATAIN=value)
-        # TODO: use JTAG masked compare when implemented
-        dr_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dr_update.to_bits()))
-        assert dr_capture.ACK == DR_xPACC_ACK.OK_FAULT
+        await self._compare_xpacc(dr_update)
 
     async def _read_dpacc(self, addr):
         await self.lower.write_ir(IR_DPACC)
 
         dr_update = DR_xPACC_update(RnW=1, A=(addr & 0xf) >> 2)
-        # TODO: use JTAG masked compare when implemented
-        dr_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dr_update.to_bits()))
-        assert dr_capture.ACK == DR_xPACC_ACK.OK_FAULT
+        await self._compare_xpacc(dr_update)
 
         # TODO: pick a better nop than repeated read?
-        dr_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dr_update.to_bits()))
+        dr_capture = await self._exchange_xpacc(dr_update.to_bits())
         assert dr_capture.ACK == DR_xPACC_ACK.OK_FAULT
 
         return dr_capture.ReadResult
@@ -59,15 +84,21 @@ class ARMJTAGDPInterface(ARMDPInterface, aobject):
     async def _poll_apacc(self):
         await self.lower.write_ir(IR_DPACC)
 
+        # The AP transaction result and CTRL/STAT are read in one round trip, by queueing two DP
+        # CTRL/STAT reads; if the AP transaction is still in progress, the second read is simply
+        # the next attempt to get its result.
         dp_update_bits = DR_xPACC_update(RnW=1, A=DP_CTRL_STAT_addr >> 2).to_bits()
+        captures = []
         while True:
-            ap_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dp_update_bits))
+            if len(captures) < 2:
+                captures += await self._exchange_xpacc(dp_update_bits, count=2 - len(captures))
+            ap_capture = captures.pop(0)
             if ap_capture.ACK != DR_xPACC_ACK.WAIT:
                 break
             self._log("ap wait")
         assert ap_capture.ACK == DR_xPACC_ACK.OK_FAULT
 
-        dp_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dp_update_bits))
+        dp_capture, = captures
         assert dp_capture.ACK == DR_xPACC_ACK.OK_FAULT
 
         dp_ctrl_stat = DP_CTRL_STAT.from_int(dp_capture.ReadResult)
@@ -86,9 +117,7 @@ class ARMJTAGDPInterface(ARMDPInterface, aobject):
         await self.lower.write_ir(IR_APACC)
 
         dr_update = DR_xPACC_update(RnW=0, A=(addr & 0xf) >> 2, DATAIN=value)
-        # TODO: use JTAG masked compare when implemented
-        dr_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dr_update.to_bits()))
-        assert dr_capture.ACK == DR_xPACC_ACK.OK_FAULT
+        await self._compare_xpacc(dr_update)
 
         await self._poll_apacc()
 
@@ -96,9 +125,7 @@ class ARMJTAGDPInterface(ARMDPInterface, aobject):
         await self.lower.write_ir(IR_APACC)
 
         dr_update = DR_xPACC_update(RnW=1, A=(addr & 0xf) >> 2)
-        # TODO: use JTAG masked compare when implemented
-        dr_capture = DR_xPACC_capture.from_bits(await self.lower.exchange_dr(dr_update.to_bits()))
-        assert dr_capture.ACK == DR_xPACC_ACK.OK_FAULT
+        await self._compare_xpacc(dr_update)
 
         return await self._poll_apacc()
 
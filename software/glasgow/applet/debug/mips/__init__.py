@@ -57,7 +57,9 @@ class EJTAGDebugInterface(aobject, GDBRemote):
         self._impcode = DR_IMPCODE.from_bits(impcode_bits)
         self._log("read IMPCODE %s", self._impcode.bits_repr())
 
-    async def _exchange_control(self, **fields):
+    async def _queue_control(self, **fields):
+        # Must be called within a batch; returns a function that checks and returns the new
+        # CONTROL value once the batch has ended.
         control = self._control.copy()
         control.PrAcc = 1
         if self._impcode.EJTAGver > 0:
@@ -71,15 +73,22 @@ class EJTAGDebugInterface(aobject, GDBRemote):
         self._log("write CONTROL %s", control.bits_repr(omit_zero=True))
         control_bits = control.to_bits()
         await self.lower.write_ir(IR_CONTROL)
-
         control_bits = await self.lower.exchange_dr(control_bits)
-        new_control = DR_CONTROL.from_bits(control_bits)
-        self._log("read CONTROL %s", new_control.bits_repr(omit_zero=True))
 
-        if self._impcode.EJTAGver > 0 and control.Rocc and new_control.Rocc:
-            raise EJTAGError("target has been unexpectedly reset")
+        def result():
+            new_control = DR_CONTROL.from_bits(control_bits.result())
+            self._log("read CONTROL %s", new_control.bits_repr(omit_zero=True))
+
+            if self._impcode.EJTAGver > 0 and control.Rocc and new_control.Rocc:
+                raise EJTAGError("target has been unexpectedly reset")
+
+            return new_control
+        return result
 
-        return new_control
+    async def _exchange_control(self, **fields):
+        async with self.lower.batch():
+            new_control = await self._queue_control(**fields)
+        return new_control()
 
     async def _enable_probe(self):
         self._control.ProbEn   = 1
@@ -96,13 +105,23 @@ class EJTAGDebugInterface(aobject, GDBRemote):
         assert self._address_length is not None
         self._log("scan ADDRESS length=%d", self._address_length)
 
-    async def _read_address(self):
+    async def _queue_read_address(self):
+        # See _queue_control.
         await self.lower.write_ir(IR_ADDRESS)
         address_bits = await self.lower.read_dr(self._address_length)
-        address_bits = address_bits + address_bits[-1:] * (64 - self._address_length)
-        address = int(address_bits) & self._mask
-        self._log("read ADDRESS %#0.*x", self._prec, address)
-        return address
+
+        def result():
+            value_bits = address_bits.result()
+            value_bits = value_bits + value_bits[-1:] * (64 - self._address_length)
+            address = int(value_bits) & self._mask
+            self._log("read ADDRESS %#0.*x", self._prec, address)
+            return address
+        return result
+
+    async def _read_address(self):
+        async with self.lower.batch():
+            address = await self._queue_read_address()
+        return address()
 
     async def _write_address(self, address):
         # See _read_address. NB: ADDRESS is only writable in EJTAG v1.x/2.0 with DMAAcc.
@@ -111,12 +130,21 @@ class EJTAGDebugInterface(aobject, GDBRemote):
         await self.lower.write_ir(IR_ADDRESS)
         await self.lower.write_dr(address_bits)
 
-    async def _read_data(self):
+    async def _queue_read_data(self):
+        # See _queue_control.
         await self.lower.write_ir(IR_DATA)
         data_bits = await self.lower.read_dr(self.bits)
-        data = int(data_bits)
-        self._log("read DATA %#0.*x", self._prec, data)
-        return data
+
+        def result():
+            data = int(data_bits.result())
+            self._log("read DATA %#0.*x", self._prec, data)
+            return data
+        return result
+
+    async def _read_data(self):
+        async with self.lower.batch():
+            data = await self._queue_read_data()
+        return data()
 
     async def _write_data(self, data):
         self._log("write DATA %#0.*x", self._prec, data)
@@ -251,7 +279,12 @@ class EJTAGDebugInterface(aobject, GDBRemote):
 
         for step in range(max_steps):
             for _ in range(3):
-                control = await self._exchange_control()
+                # ADDRESS is read together with CONTROL to avoid a round trip; it is only used if
+                # the processor is waiting for a processor access.
+                async with self.lower.batch():
+                    control = await self._queue_control()
+                    address = await self._queue_read_address()
+                control = control()
                 if step == 0 and not control.DM:
                     raise EJTAGError("Exec_PrAcc: DM low on entry")
                 elif not control.DM:
@@ -263,7 +296,7 @@ class EJTAGDebugInterface(aobject, GDBRemote):
             else:
                 raise EJTAGError("Exec_PrAcc: PrAcc stuck low")
 
-            address = await self._read_address()
+            address = address()
             if step > 0 and address == code_beg:
                 self._log("Exec_PrAcc: debug suspend")
                 self._change_state(suspend_state)
@@ -285,16 +318,20 @@ class EJTAGDebugInterface(aobject, GDBRemote):
                     raise EJTAGError("Exec_PrAcc: write access to %s at %#0.*x" %
                                      (area_name, self._prec, address))
 
-                word = await self._read_data()
+                # The processor access is completed together with reading the data.
+                async with self.lower.batch():
+                    word    = await self._queue_read_data()
+                    control = await self._queue_control(PrAcc=0)
+                word = word()
                 self._log("Exec_PrAcc: write %s [%#06x] = %#0.*x",
                           area_name, address & 0xffff, self._prec, word)
                 area[area_off] = word
+                control()
             else:
                 self._log("Exec_PrAcc: read %s [%#06x] = %#0.*x",
                           area_name, address & 0xffff, self._prec, area[area_off])
                 await self._write_data(area[area_off])
-
-            await self._exchange_control(PrAcc=0)
+                await self._exchange_control(PrAcc=0)
 
         else:
             raise EJTAGError("Exec_PrAcc: step limit exceeded")
@@ -3,33 +3,204 @@ import argparse
 from vcd import VCDWriter
 from amaranth import *
 from amaranth.lib.cdc import FFSynchronizer
+from amaranth.lib.fifo import SyncFIFOBuffered
 
 from ....gateware.pads import *
 from ....gateware.analyzer import *
 from ... import *
+from .capture import *
+from .protocol import *
+
+
+TRIGGER_EDGE_NONE    = 0
+TRIGGER_EDGE_RISING  = 1
+TRIGGER_EDGE_FALLING = 2
+TRIGGER_EDGE_BOTH    = 3
+
+CONTROL_ARM          = 0b01
+CONTROL_TRIGGERED    = 0b10
+
+STATUS_TRIGGERED     = 0b001
+STATUS_COMPLETE      = 0b010
+STATUS_OVERFLOW      = 0b100
+
+
+class AnalyzerTrigger(Elaboratable):
+    """
+    Pin change trigger with a pre-trigger buffer.
+
+    Pin changes are recorded in a block RAM FIFO together with the number of cycles since the
+    previous change. Until the trigger fires, the FIFO is used as a ring buffer holding the last
+    ``pre_count`` changes. Once it fires, the recorded changes are replayed into the event analyzer
+    with their original spacing (i.e. time-shifted by the length of the pre-trigger window),
+    followed by the changes after the trigger, until ``post_count`` changes (if non-zero) have been
+    recorded; then the event analyzer is stopped.
+
+    The trigger fires on the ``count``-th pin change where the pins masked with ``mask`` equal
+    ``value``, and, unless ``edge_mode`` is ``TRIGGER_EDGE_NONE``, pin ``edge_pin`` has the edge
+    selected by ``edge_mode``. If ``control`` does not include ``CONTROL_TRIGGERED``, the trigger
+    fires as soon as ``CONTROL_ARM`` is set.
+    """
+    DELAY_WIDTH = 16
+
+    def __init__(self, pins, event_source, done, *, depth, registers):
+        self.pins         = pins
+        self.event_source = event_source
+        self.done         = done
+        self.depth        = depth
+
+        width = len(pins)
+        self.mask,       self.addr_mask       = registers.add_rw(width)
+        self.value,      self.addr_value      = registers.add_rw(width)
+        self.edge_mode,  self.addr_edge_mode  = registers.add_rw(2)
+        self.edge_pin,   self.addr_edge_pin   = registers.add_rw(4)
+        self.count,      self.addr_count      = registers.add_rw(16)
+        self.pre_count,  self.addr_pre_count  = registers.add_rw(range(depth + 1))
+        self.post_count, self.addr_post_count = registers.add_rw(32)
+        self.control,    self.addr_control    = registers.add_rw(2)
+        self.status,     self.addr_status     = registers.add_ro(3)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        width  = len(self.pins)
+        pins_r = Signal.like(self.pins)
+        m.d.sync += pins_r.eq(self.pins)
+        changed = Signal()
+        m.d.comb += changed.eq(self.pins != pins_r)
+
+        # Each entry is the new state of the pins, the number of cycles since the previous entry,
+        # and a flag for entries that only record the passage of time (when the number of cycles
+        # would otherwise overflow).
+        m.submodules.fifo = fifo = \
+            SyncFIFOBuffered(width=width + self.DELAY_WIDTH + 1, depth=self.depth)
+        w_pins, w_delay, w_idle = fifo.w_data[:width], \
+            fifo.w_data[width:-1], fifo.w_data[-1]
+        r_pins, r_delay, r_idle = fifo.r_data[:width], \
+            fifo.r_data[width:-1], fifo.r_data[-1]
+
+        armed      = Signal()
+        triggered  = Signal()
+        stopped    = Signal()
+        overflow   = Signal()
+        m.d.comb += [
+            armed.eq(self.control & CONTROL_ARM),
+            self.status.eq(Cat(triggered, self.done, overflow)),
+        ]
+
+        # Trigger condition.
+        edge_i = self.pins.bit_select(self.edge_pin, 1)
+        edge_r = pins_r.bit_select(self.edge_pin, 1)
+        edge_ok = Signal()
+        with m.Switch(self.edge_mode):
+            with m.Case(TRIGGER_EDGE_NONE):
+                m.d.comb += edge_ok.eq(1)
+            with m.Case(TRIGGER_EDGE_RISING):
+                m.d.comb += edge_ok.eq(~edge_r & edge_i)
+            with m.Case(TRIGGER_EDGE_FALLING):
+                m.d.comb += edge_ok.eq(edge_r & ~edge_i)
+            with m.Case(TRIGGER_EDGE_BOTH):
+                m.d.comb += edge_ok.eq(edge_r != edge_i)
+        matched = Signal()
+        m.d.comb += matched.eq(changed & edge_ok &
+                               ((self.pins & self.mask) == (self.value & self.mask)))
+
+        matches = Signal.like(self.count)
+        with m.If(~armed):
+            m.d.sync += [
+                triggered.eq(0),
+                matches.eq(0),
+            ]
+        with m.Elif(~triggered):
+            with m.If((self.control & CONTROL_TRIGGERED) == 0):
+                m.d.sync += triggered.eq(1)
+            with m.Elif(matched):
+                m.d.sync += matches.eq(matches + 1)
+                with m.If(matches + 1 >= self.count):
+                    m.d.sync += triggered.eq(1)
+
+        # Recording side.
+        since      = Signal(self.DELAY_WIDTH)
+        post_count = Signal.like(self.post_count)
+        idle       = Signal()
+        m.d.comb += [
+            idle.eq(since == (1 << self.DELAY_WIDTH) - 2),
+            w_pins.eq(self.pins),
+            w_delay.eq(since + 1),
+            w_idle.eq(~changed),
+            fifo.w_en.eq(armed & ~stopped & (changed | idle)),
+        ]
+        with m.If(fifo.w_en):
+            m.d.sync += since.eq(0)
+            with m.If(~fifo.w_rdy):
+                m.d.sync += overflow.eq(1)
+        with m.Else():
+            m.d.sync += since.eq(since + 1)
+        with m.If(~armed):
+            m.d.sync += [
+                since.eq(0),
+                stopped.eq(0),
+                overflow.eq(0),
+                post_count.eq(0),
+            ]
+        with m.Elif(triggered & changed & ~stopped):
+            m.d.sync += post_count.eq(post_count + 1)
+            with m.If((self.post_count != 0) & (post_count + 1 >= self.post_count)):
+                m.d.sync += stopped.eq(1)
+
+        # Replaying side.
+        elapsed = Signal(self.DELAY_WIDTH)
+        with m.If(~triggered):
+            m.d.sync += elapsed.eq((1 << self.DELAY_WIDTH) - 1)
+            # Keep only the last `pre_count` entries.
+            with m.If(fifo.r_rdy & (fifo.level > self.pre_count)):
+                m.d.comb += fifo.r_en.eq(1)
+        with m.Elif(fifo.r_rdy & (elapsed + 1 >= r_delay)):
+            m.d.comb += [
+                fifo.r_en.eq(1),
+                self.event_source.data.eq(r_pins),
+                self.event_source.trigger.eq(~r_idle),
+            ]
+            m.d.sync += elapsed.eq(0)
+        with m.Elif(elapsed != (1 << self.DELAY_WIDTH) - 1):
+            m.d.sync += elapsed.eq(elapsed + 1)
+
+        m.d.comb += self.done.eq(stopped & (fifo.level == 0))
+
+        return m
 
 
 class AnalyzerSubtarget(Elaboratable):
-    def __init__(self, pads, in_fifo):
+    def __init__(self, pads, in_fifo, *, trigger_depth=0, registers=None):
         self.pads    = pads
         self.in_fifo = in_fifo
 
         self.analyzer = EventAnalyzer(in_fifo)
         self.event_source = self.analyzer.add_event_source("pin", "change", len(pads.i_t.i))
 
+        self.pins_i  = Signal.like(self.pads.i_t.i)
+        # The trigger uses block RAM for the pre-trigger buffer, so it is only built if requested.
+        if trigger_depth > 0:
+            self.trigger = AnalyzerTrigger(self.pins_i, self.event_source, self.analyzer.done,
+                                           depth=trigger_depth, registers=registers)
+        else:
+            self.trigger = None
+
     def elaborate(self, platform):
         m = Module()
-        m.submodules += self.analyzer
+        m.submodules.analyzer = self.analyzer
 
-        pins_i = Signal.like(self.pads.i_t.i)
-        pins_r = Signal.like(self.pads.i_t.i)
-        m.submodules += FFSynchronizer(self.pads.i_t.i, pins_i)
+        m.submodules += FFSynchronizer(self.pads.i_t.i, self.pins_i)
 
-        m.d.sync += pins_r.eq(pins_i)
-        m.d.comb += [
-            self.event_source.data.eq(pins_i),
-            self.event_source.trigger.eq(pins_i != pins_r)
-        ]
+        if self.trigger is not None:
+            m.submodules.trigger = self.trigger
+        else:
+            pins_r = Signal.like(self.pins_i)
+            m.d.sync += pins_r.eq(self.pins_i)
+            m.d.comb += [
+                self.event_source.data.eq(self.pins_i),
+                self.event_source.trigger.eq(self.pins_i != pins_r)
+            ]
 
         return m
 
@@ -43,12 +214,59 @@ class AnalyzerInterface:
         self.decoder.process(await self.lower.read())
         return self.decoder.flush()
 
+    async def read_columns(self):
+        self.decoder.process(await self.lower.read())
+        return self.decoder.flush_columns()
+
+    async def read_raw(self):
+        """
+        Read a chunk of the analyzer byte stream as-is, without decoding the events in it.
+        Cannot be used together with :meth:`read` or :meth:`read_columns`.
+        """
+        data = await self.lower.read()
+        self.decoder.skip(data)
+        return data
+
+    @property
+    def done(self):
+        return self.decoder.is_done()
+
+    @property
+    def overrun(self):
+        return self.decoder.is_overrun()
+
+
+def _protocol_pipeline(specs, sys_clk_freq):
+    try:
+        return ProtocolPipeline(parse_protocol_decoder(spec, sys_clk_freq=sys_clk_freq)
+                                for spec in specs)
+    except ValueError as e:
+        raise GlasgowAppletError(f"invalid decoder: {e}")
+
 
 class AnalyzerApplet(GlasgowApplet):
     logger = logging.getLogger(__name__)
     help = "capture logic waveforms"
     description = """
     Capture waveforms, similar to a logic analyzer.
+
+    Instead of waveforms, the capture can also be reduced to UART, SPI, or I2C transactions
+    while it is running, using `--decode`; the waveforms are then not stored at all. A decoder
+    is specified as the name of the protocol, followed by a colon and a comma-separated list of
+    arguments, where pins are specified by their index in the pin set:
+
+    ::
+        uart:rx=PIN,baud=RATE[,data-bits=8][,parity=none|zero|one|odd|even][,stop-bits=1]
+        spi:sck=PIN[,copi=PIN][,cipo=PIN][,cs=PIN][,mode=0][,lsb-first=0]
+        i2c:scl=PIN,sda=PIN
+
+    By default, every pin change is captured from the moment the applet starts. If the applet is
+    built with a trigger (using `--trigger-depth`) and a trigger is specified (a pin pattern, an
+    edge on a pin, or both), the changes are captured only once the trigger fires (optionally,
+    after it fires several times); a number of changes before the trigger are kept in a buffer
+    in the FPGA and captured too, and the capture can end after a number of changes following
+    the trigger. The trigger is configured when the applet starts, and changing it does not
+    require rebuilding the bitstream.
     """
     required_revision = "C0" # iCE40UP5K isn't quite fast enoughs
 
@@ -58,15 +276,23 @@ class AnalyzerApplet(GlasgowApplet):
 
         access.add_pin_set_argument(parser, "i", width=range(1, 17), default=1)
 
+        parser.add_argument(
+            "--trigger-depth", metavar="COUNT", type=int, default=0,
+            help="build a trigger that keeps up to COUNT pin changes before it fires, e.g. 512 "
+                 "(default: no trigger)")
+
     def build(self, target, args):
         self.mux_interface = iface = target.multiplexer.claim_interface(self, args)
         subtarget = iface.add_subtarget(AnalyzerSubtarget(
             pads=iface.get_deprecated_pads(args, pin_sets=("i",)),
             in_fifo=iface.get_in_fifo(),
+            trigger_depth=args.trigger_depth,
+            registers=target.registers,
         ))
 
         self._sample_freq = target.sys_clk_freq
         self._event_sources = subtarget.analyzer.event_sources
+        self._trigger = subtarget.trigger
 
     @classmethod
     def add_run_arguments(cls, parser, access):
@@ -80,7 +306,90 @@ class AnalyzerApplet(GlasgowApplet):
             "--pull-downs", default=False, action="store_true",
             help="enable pull-downs on all pins")
 
+        parser.add_argument(
+            "--trigger-pattern", metavar="PATTERN", type=str,
+            help="trigger when the pins match PATTERN, which has one of '0', '1', or 'x' "
+                 "(any value) for each pin, starting with the first pin")
+        parser.add_argument(
+            "--trigger-edge", metavar="EDGE", choices=("rising", "falling", "both"),
+            help="trigger on EDGE (one of: rising falling both) of the pin selected with "
+                 "--trigger-pin")
+        parser.add_argument(
+            "--trigger-pin", metavar="INDEX", type=int, default=0,
+            help="use pin INDEX of the pin set for --trigger-edge (default: %(default)s)")
+        parser.add_argument(
+            "--trigger-count", metavar="COUNT", type=int, default=1,
+            help="trigger the COUNT-th time the trigger condition is met (default: %(default)s)")
+        parser.add_argument(
+            "--pre-trigger", metavar="COUNT", type=int, default=None,
+            help="capture COUNT pin changes before the trigger (default: half of the trigger "
+                 "buffer depth)")
+        parser.add_argument(
+            "--post-trigger", metavar="COUNT", type=int, default=0,
+            help="stop capturing COUNT pin changes after the trigger (default: never)")
+
+    async def _configure_trigger(self, device, args):
+        trigger = self._trigger
+        pin_count = len(args.pin_set_i)
+        if trigger is None:
+            if (args.trigger_pattern is not None or args.trigger_edge is not None or
+                    args.pre_trigger is not None or args.post_trigger != 0):
+                raise GlasgowAppletError("the applet was built without a trigger; rebuild it "
+                                         "with --trigger-depth")
+            return None
+
+        mask = value = 0
+        if args.trigger_pattern is not None:
+            if len(args.trigger_pattern) != pin_count or \
+                    not set(args.trigger_pattern.lower()) <= set("01x"):
+                raise GlasgowAppletError(f"trigger pattern must consist of {pin_count} "
+                                         f"characters '0', '1', or 'x'")
+            for index, char in enumerate(args.trigger_pattern.lower()):
+                if char != "x":
+                    mask  |= 1 << index
+                if char == "1":
+                    value |= 1 << index
+        if not 0 <= args.trigger_pin < pin_count:
+            raise GlasgowAppletError(f"trigger pin index must be less than {pin_count}")
+        if not 0 <= args.trigger_count < 1 << len(trigger.count):
+            raise GlasgowAppletError(f"trigger count must be less than {1 << len(trigger.count)}")
+        pre_count = trigger.depth // 2 if args.pre_trigger is None else args.pre_trigger
+        if not 0 <= pre_count <= trigger.depth:
+            raise GlasgowAppletError(f"pre-trigger count must be at most {trigger.depth}; "
+                                     f"rebuild the applet with a larger --trigger-depth")
+        if not 0 <= args.post_trigger < 1 << len(trigger.post_count):
+            raise GlasgowAppletError(f"post-trigger count must be less than "
+                                     f"{1 << len(trigger.post_count)}")
+        edge_mode = {
+            None:      TRIGGER_EDGE_NONE,
+            "rising":  TRIGGER_EDGE_RISING,
+            "falling": TRIGGER_EDGE_FALLING,
+            "both":    TRIGGER_EDGE_BOTH,
+        }[args.trigger_edge]
+
+        def width(reg):
+            return (len(reg) + 7) // 8
+        await device.write_registers({
+            trigger.addr_mask:       (mask,              width(trigger.mask)),
+            trigger.addr_value:      (value,             width(trigger.value)),
+            trigger.addr_edge_mode:  (edge_mode,         width(trigger.edge_mode)),
+            trigger.addr_edge_pin:   (args.trigger_pin,  width(trigger.edge_pin)),
+            trigger.addr_count:      (args.trigger_count, width(trigger.count)),
+            trigger.addr_pre_count:  (pre_count,         width(trigger.pre_count)),
+            trigger.addr_post_count: (args.post_trigger, width(trigger.post_count)),
+        })
+        if args.trigger_pattern is not None or args.trigger_edge is not None:
+            self.logger.info("waiting for trigger")
+            return CONTROL_ARM | CONTROL_TRIGGERED
+        else:
+            return CONTROL_ARM
+
     async def run(self, device, args):
+        if self._trigger is not None:
+            # Disarm the trigger while it is being configured.
+            await device.write_register(self._trigger.addr_control, 0)
+        control = await self._configure_trigger(device, args)
+
         pull_low  = set()
         pull_high = set()
         if args.pull_ups:
@@ -89,16 +398,49 @@ class AnalyzerApplet(GlasgowApplet):
             pull_low = set(args.pin_set_i)
         iface = await device.demultiplexer.claim_interface(self, self.mux_interface, args,
                                                            pull_low=pull_low, pull_high=pull_high)
+        if self._trigger is not None:
+            await device.write_register(self._trigger.addr_control, control)
         return AnalyzerInterface(iface, self._event_sources)
 
+    async def _check_status(self, device):
+        if self._trigger is None:
+            return 0
+        status = await device.read_register(self._trigger.addr_status)
+        if status & STATUS_OVERFLOW:
+            self.logger.warning("trigger buffer overflow; some pin changes were not captured")
+        return status
+
     @classmethod
     def add_interact_arguments(cls, parser):
         parser.add_argument(
-            "file", metavar="VCD-FILE", type=argparse.FileType("w"),
-            help="write VCD waveforms to VCD-FILE")
+            "--raw", default=False, action="store_true",
+            help="write the undecoded analyzer stream instead of VCD waveforms; use "
+                 "`glasgow tool analyzer convert` to convert it afterwards")
+        parser.add_argument(
+            "--decode", metavar="SPEC", action="append", default=[],
+            help="write transactions decoded as specified by SPEC instead of VCD waveforms "
+                 "(may be specified several times)")
+        parser.add_argument(
+            "--decode-format", metavar="FORMAT", choices=tuple(RECORD_WRITERS), default="jsonl",
+            help="write decoded transactions as FORMAT (one of: %(choices)s; "
+                 "default: %(default)s)")
+        # The file is opened in `interact`, since the raw capture is written in binary mode.
+        parser.add_argument(
+            "file", metavar="VCD-FILE",
+            help="write VCD waveforms (or the raw capture, with --raw, or the decoded "
+                 "transactions, with --decode) to VCD-FILE")
 
     async def interact(self, device, args, iface):
-        vcd_writer = VCDWriter(args.file, timescale="1 ns", check_values=False)
+        try:
+            file = argparse.FileType("wb" if args.raw else "w")(args.file)
+        except argparse.ArgumentTypeError as e:
+            raise GlasgowAppletError(str(e))
+        if args.raw:
+            return await self._interact_raw(device, args, iface, file)
+        if args.decode:
+            return await self._interact_decode(device, args, iface, file)
+
+        vcd_writer = VCDWriter(file, timescale="1 ns", check_values=False)
         signals = []
         for index in range(self._event_sources[0].width):
             signals.append(vcd_writer.register_var(scope="", name=f"pin[{index}]",
@@ -107,7 +449,7 @@ class AnalyzerApplet(GlasgowApplet):
         try:
             overrun = False
             timestamp = 0
-            while not overrun:
+            while not (overrun or iface.done):
                 for cycle, events in await iface.read():
                     timestamp = cycle * 1_000_000_000 // self._sample_freq
 
@@ -123,10 +465,132 @@ class AnalyzerApplet(GlasgowApplet):
                         for bit, signal in enumerate(signals):
                             vcd_writer.change(signal, timestamp, (value >> bit) & 1)
 
+            await self._check_status(device)
+
         finally:
             vcd_writer.close(timestamp)
 
+    async def _interact_decode(self, device, args, iface, file):
+        pipeline = _protocol_pipeline(args.decode, self._sample_freq)
+        record_writer = RECORD_WRITERS[args.decode_format](file, pipeline.decoders)
+        count = 0
+        try:
+            while not iface.done:
+                trace = await iface.read_columns()
+                records = pipeline.process(trace)
+                record_writer.write(records)
+                count += len(records)
+                if trace.overrun is not None:
+                    self.logger.error("FIFO overrun, shutting down")
+                    break
+
+            await self._check_status(device)
+
+        finally:
+            records = pipeline.finish()
+            record_writer.write(records)
+            count += len(records)
+            file.flush()
+            self.logger.info("decoded %d transactions", count)
+
+    async def _interact_raw(self, device, args, iface, file):
+        # The stream is only split into records during capture, to find where it ends; the events
+        # are decoded afterwards, when the capture is converted.
+        capture_writer = CaptureWriter(file,
+            event_sources=self._event_sources, sys_clk_freq=self._sample_freq,
+            bitstream_id=await device.bitstream_id())
+        try:
+            while not iface.done:
+                await capture_writer.write(await iface.read_raw())
+            if iface.overrun:
+                self.logger.error("FIFO overrun, shutting down")
+
+            await self._check_status(device)
+
+        finally:
+            capture_writer.close()
+            self.logger.info("captured %d bytes", capture_writer.length)
+
     @classmethod
     def tests(cls):
         from . import test
         return test.AnalyzerAppletTestCase
+
+# -------------------------------------------------------------------------------------------------
+
+class AnalyzerAppletTool(GlasgowAppletTool, applet=AnalyzerApplet):
+    help = "convert logic analyzer captures"
+    description = """
+    Convert raw captures made with `glasgow run analyzer --raw` to VCD waveforms, or to columns
+    of event timestamps and values stored as NumPy arrays, or decode UART, SPI, or I2C
+    transactions from them (see `glasgow run analyzer --help` for the decoder specifications).
+    """
+
+    @classmethod
+    def add_arguments(cls, parser):
+        p_operation = parser.add_subparsers(dest="operation", metavar="OPERATION", required=True)
+
+        p_convert = p_operation.add_parser(
+            "convert", help="convert a raw capture")
+        p_convert.add_argument(
+            "-f", "--format", metavar="FORMAT", choices=("vcd", "columns"), default="vcd",
+            help="output format: 'vcd' for a VCD file, 'columns' for a directory with a NumPy "
+                 "array for timestamps and for the rows and values of each event "
+                 "(default: %(default)s)")
+        p_convert.add_argument(
+            "capture_file", metavar="CAPTURE-FILE", type=argparse.FileType("rb"),
+            help="read raw capture from CAPTURE-FILE")
+        p_convert.add_argument(
+            "output", metavar="OUTPUT",
+            help="write converted capture to OUTPUT (a file or a directory, depending on format)")
+
+        p_decode = p_operation.add_parser(
+            "decode", help="decode transactions from a raw capture")
+        p_decode.add_argument(
+            "-p", "--protocol", metavar="SPEC", dest="decode", action="append", required=True,
+            help="decode transactions as specified by SPEC (may be specified several times)")
+        p_decode.add_argument(
+            "-f", "--format", metavar="FORMAT", choices=tuple(RECORD_WRITERS), default="jsonl",
+            help="write decoded transactions as FORMAT (one of: %(choices)s; "
+                 "default: %(default)s)")
+        p_decode.add_argument(
+            "capture_file", metavar="CAPTURE-FILE", type=argparse.FileType("rb"),
+            help="read raw capture from CAPTURE-FILE")
+        p_decode.add_argument(
+            "output", metavar="OUTPUT", type=argparse.FileType("w"),
+            help="write decoded transactions to OUTPUT")
+
+    async def run(self, args):
+        if args.operation == "convert":
+            with args.capture_file:
+                try:
+                    reader = CaptureReader(args.capture_file)
+                    if args.format == "vcd":
+                        with open(args.output, "w") as file:
+                            count = convert_to_vcd(reader, file)
+                    if args.format == "columns":
+                        count = convert_to_columns(reader, args.output)
+                except (CaptureFormatError, TraceDecodingError) as e:
+                    raise GlasgowAppletError(f"cannot convert capture: {e}")
+            self.logger.info("converted %d cycles with events from bitstream ID %s",
+                             count, reader.bitstream_id.hex())
+
+        if args.operation == "decode":
+            with args.capture_file, args.output:
+                try:
+                    reader = CaptureReader(args.capture_file)
+                    pipeline = _protocol_pipeline(args.decode, reader.sys_clk_freq)
+                    record_writer = RECORD_WRITERS[args.format](args.output, pipeline.decoders)
+                    count = 0
+                    for trace in reader.decode():
+                        records = pipeline.process(trace)
+                        record_writer.write(records)
+                        count += len(records)
+                        if trace.overrun is not None:
+                            self.logger.warning("capture ends with a FIFO overrun")
+                    records = pipeline.finish()
+                    record_writer.write(records)
+                    count += len(records)
+                except (CaptureFormatError, TraceDecodingError) as e:
+                    raise GlasgowAppletError(f"cannot decode capture: {e}")
+            self.logger.info("decoded %d transactions", count)
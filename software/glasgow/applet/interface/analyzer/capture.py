@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import asyncio
+import concurrent.futures
+from collections import namedtuple
+from vcd import VCDWriter
+
+from ....gateware.analyzer import TraceDecoder
+
+
+__all__ = ["CaptureFormatError", "CaptureEventSource", "CaptureWriter", "CaptureReader",
+           "convert_to_vcd", "convert_to_columns"]
+
+
+# A capture file consists of a header followed by the analyzer byte stream exactly as it was
+# received from the device. The header is the magic string, the length of the metadata as
+# a little-endian 32-bit integer, and the metadata itself, which is a JSON object with the keys
+# `event_sources` (a list of objects with the keys `name`, `kind`, `width`, `fields`),
+# `sys_clk_freq`, and `bitstream_id` (hexadecimal).
+CAPTURE_MAGIC   = b"Glasgow analyzer capture\x00"
+CAPTURE_VERSION = 1
+
+
+class CaptureFormatError(Exception):
+    pass
+
+
+# The trace decoder only needs the description of each event source, not the gateware.
+CaptureEventSource = namedtuple("CaptureEventSource", ("name", "kind", "width", "fields"))
+
+
+class CaptureWriter:
+    """
+    Analyzer capture writer.
+
+    Collects the analyzer byte stream in a buffer, and writes it to ``file`` in large blocks from
+    a separate thread, so that capturing never waits for the file to be written unless the disk is
+    slower than the analyzer for a sustained period.
+    """
+    def __init__(self, file, *, event_sources, sys_clk_freq, bitstream_id, buffer_size=1 << 20):
+        self._file        = file
+        self._buffer      = bytearray()
+        self._buffer_size = buffer_size
+        self._executor    = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending     = None
+
+        metadata = json.dumps({
+            "version": CAPTURE_VERSION,
+            "event_sources": [
+                {"name": event_src.name, "kind": event_src.kind, "width": event_src.width,
+                 "fields": [list(field) for field in event_src.fields]}
+                for event_src in event_sources
+            ],
+            "sys_clk_freq": sys_clk_freq,
+            "bitstream_id": bitstream_id.hex(),
+        }).encode("utf-8")
+        self._file.write(CAPTURE_MAGIC + struct.pack("<L", len(metadata)) + metadata)
+
+        self.length = 0
+
+    async def write(self, data):
+        self._buffer.extend(data)
+        self.length += len(data)
+        if len(self._buffer) >= self._buffer_size:
+            if self._pending is not None:
+                await asyncio.wrap_future(self._pending)
+            self._pending = self._executor.submit(self._file.write, self._buffer)
+            self._buffer = bytearray()
+
+    def close(self):
+        # Writes are submitted to a single thread, so they complete in order.
+        final = self._executor.submit(self._file.write, self._buffer)
+        self._executor.shutdown(wait=True)
+        for future in (self._pending, final):
+            if future is not None:
+                future.result() # re-raise any errors
+        self._file.flush()
+
+
+class CaptureReader:
+    """
+    Analyzer capture reader.
+
+    Reads the header of the capture in ``file``, and maps the rest of the file into memory (if
+    possible) to read the analyzer byte stream in chunks.
+    """
+    def __init__(self, file):
+        self._file = file
+
+        magic = file.read(len(CAPTURE_MAGIC))
+        if magic != CAPTURE_MAGIC:
+            raise CaptureFormatError("not an analyzer capture")
+        metadata_length = file.read(4)
+        if len(metadata_length) != 4:
+            raise CaptureFormatError("truncated capture header")
+        metadata_length, = struct.unpack("<L", metadata_length)
+        try:
+            metadata = json.loads(file.read(metadata_length))
+        except ValueError as error:
+            raise CaptureFormatError(f"invalid capture metadata: {error}")
+        if metadata.get("version") != CAPTURE_VERSION:
+            raise CaptureFormatError(f"unsupported capture version {metadata.get('version')}")
+
+        self.event_sources = [
+            CaptureEventSource(event_src["name"], event_src["kind"], event_src["width"],
+                               tuple(map(tuple, event_src["fields"])))
+            for event_src in metadata["event_sources"]
+        ]
+        self.sys_clk_freq  = metadata["sys_clk_freq"]
+        self.bitstream_id  = bytes.fromhex(metadata["bitstream_id"])
+        self._data_offset  = file.tell()
+
+    def chunks(self, chunk_size=1 << 20):
+        """Yield chunks of the analyzer byte stream."""
+        try:
+            data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, AttributeError):
+            # Not a regular file (e.g. a pipe), or an empty capture.
+            self._file.seek(self._data_offset)
+            while chunk := self._file.read(chunk_size):
+                yield chunk
+            return
+        with data:
+            for offset in range(self._data_offset, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+
+    def decode(self, chunk_size=1 << 20):
+        """Decode the capture, yielding :class:`TraceColumns` for each chunk."""
+        decoder = TraceDecoder(self.event_sources)
+        for chunk in self.chunks(chunk_size):
+            decoder.process(chunk)
+            yield decoder.flush_columns()
+            if decoder.is_done():
+                break
+        if not decoder.is_done():
+            yield decoder.flush_columns(pending=True)
+
+
+def convert_to_vcd(reader, file):
+    """
+    Convert the capture from ``reader`` to a VCD file. Returns the number of cycles with events.
+    """
+    vcd_writer = VCDWriter(file, timescale="1 ns", check_values=False,
+        comment="Generated by Glasgow for bitstream ID %s" % reader.bitstream_id.hex())
+    signals = {}
+    strobes = set()
+    for event_name, event_kind, event_width in TraceDecoder(reader.event_sources).events():
+        if event_kind == "throttle":
+            var_type, var_init = "wire", 0
+        elif event_kind == "change":
+            var_type, var_init = "wire", "x" * event_width
+        elif event_width > 0: # strobe
+            var_type, var_init = "tri", "z"
+        else:
+            var_type, var_init = "event", None
+        signals[event_name] = vcd_writer.register_var(scope="", name=event_name,
+            var_type=var_type, size=event_width, init=var_init)
+        if event_kind == "strobe" and event_width > 0:
+            strobes.add(event_name)
+
+    def to_ns(cycle):
+        return cycle * 1_000_000_000 // reader.sys_clk_freq
+
+    count = 0
+    timestamp = 0
+    for trace in reader.decode():
+        for cycle, events in trace.rows():
+            timestamp = to_ns(cycle)
+            for name, value in events.items():
+                vcd_writer.change(signals[name], timestamp, True if value is None else value)
+            for name in events:
+                if name in strobes:
+                    vcd_writer.change(signals[name], to_ns(cycle + 1), "z")
+            count += 1
+        if trace.overrun is not None:
+            timestamp = to_ns(trace.overrun)
+            for signal in signals.values():
+                vcd_writer.change(signal, timestamp, "x")
+    vcd_writer.close(timestamp)
+    return count
+
+
+class _NpyWriter:
+    # Writes a one-dimensional array in the NumPy `.npy` format incrementally. The header has
+    # a fixed size, so that it can be rewritten with the final length once all data is written.
+    HEADER_SIZE = 128
+
+    def __init__(self, filename, typecode):
+        self._file     = open(filename, "wb")
+        self._typecode = typecode
+        self._length   = 0
+        self._write_header()
+
+    def _write_header(self):
+        itemsize  = array.array(self._typecode).itemsize
+        byteorder = "<" if sys.byteorder == "little" else ">"
+        header = ("{'descr': '%su%d', 'fortran_order': False, 'shape': (%d,), }" %
+                  (byteorder, itemsize, self._length)).encode("ascii")
+        prefix = b"\x93NUMPY\x01\x00" + struct.pack("<H", self.HEADER_SIZE - 10)
+        self._file.write(prefix + header.ljust(self.HEADER_SIZE - len(prefix) - 1) + b"\n")
+
+    def write(self, values):
+        values.tofile(self._file)
+        self._length += len(values)
+
+    def close(self):
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+
+def convert_to_columns(reader, directory):
+    """
+    Convert the capture from ``reader`` to a directory with NumPy ``.npy`` files: ``timestamps``
+    (in cycles), and for each event, ``<event>.rows`` (indexes into ``timestamps``) and, for
+    events that carry data, ``<event>.values``. The file ``trace.json`` describes the events.
+    Returns the number of cycles with events.
+    """
+    events = list(TraceDecoder(reader.event_sources).events())
+    for event_name, _event_kind, event_width in events:
+        if event_width > 64:
+            raise CaptureFormatError(f"event {event_name!r} is {event_width} bits wide, "
+                                     f"which does not fit in a column")
+    os.makedirs(directory, exist_ok=True)
+    timestamps_writer = _NpyWriter(os.path.join(directory, "timestamps.npy"), "Q")
+    column_writers = {}
+    for event_name, _event_kind, event_width in events:
+        rows_writer = _NpyWriter(os.path.join(directory, f"{event_name}.rows.npy"), "Q")
+        if event_width > 0:
+            values_writer = _NpyWriter(os.path.join(directory, f"{event_name}.values.npy"), "Q")
+        else:
+            values_writer = None
+        column_writers[event_name] = (rows_writer, values_writer)
+
+    count = 0
+    overrun = None
+    try:
+        for trace in reader.decode():
+            timestamps_writer.write(trace.timestamps)
+            for name, (rows, values) in trace.columns.items():
+                rows_writer, values_writer = column_writers[name]
+                rows_writer.write(array.array("Q", (row + count for row in rows)))
+                if values_writer is not None:
+                    values_writer.write(values)
+            count += len(trace)
+            if trace.overrun is not None:
+                overrun = trace.overrun
+    finally:
+        timestamps_writer.close()
+        for rows_writer, values_writer in column_writers.values():
+            rows_writer.close()
+            if values_writer is not None:
+                values_writer.close()
+
+    with open(os.path.join(directory, "trace.json"), "w") as file:
+        json.dump({
+            "sys_clk_freq": reader.sys_clk_freq,
+            "bitstream_id": reader.bitstream_id.hex(),
+            "events": [
+                {"name": event_name, "kind": event_kind, "width": event_width}
+                for event_name, event_kind, event_width in events
+            ],
+            "overrun": overrun,
+        }, file, indent=2)
+    return count
@@ -0,0 +1,384 @@
+import csv
+import json
+import bisect
+
+
+__all__ = ["ProtocolDecoder", "UARTDecoder", "SPIDecoder", "I2CDecoder", "PROTOCOL_DECODERS",
+           "parse_protocol_decoder", "ProtocolPipeline",
+           "JSONLinesRecordWriter", "CSVRecordWriter", "RECORD_WRITERS"]
+
+
+class ProtocolDecoder:
+    """
+    Streaming protocol decoder.
+
+    Consumes the changes of the pins captured as the event ``event`` (in the form of
+    :class:`TraceColumns`, as returned by :meth:`TraceDecoder.flush_columns`) as the trace is
+    being captured, and produces transaction records. Each record is a dictionary with the keys
+    listed in ``fields``; ``protocol`` is the name of the decoder, and ``time`` is the time in
+    nanoseconds since the start of the capture at which the transaction started.
+
+    Subclasses implement :meth:`_change`, which is called for every change of the pins with
+    the cycle at which it happened and the new state of all pins, and :meth:`_finish`, which is
+    called at the end of the trace, and call :meth:`_emit` to produce records. While a transaction
+    is in progress, ``_start`` must be the cycle at which it started (and the time of the record
+    that it will produce); otherwise, ``_start`` must be ``None``.
+    """
+    name   = None
+    fields = ("protocol", "time")
+
+    # Arguments accepted in a decoder specification, and their types.
+    arguments = {}
+
+    def __init__(self, *, sys_clk_freq, event="pin"):
+        self.sys_clk_freq = sys_clk_freq
+        self.event        = event
+        self._records     = []
+        self._start       = None
+        self._last_cycle  = 0
+
+    def _time(self, cycle):
+        return int(cycle * 1_000_000_000 // self.sys_clk_freq)
+
+    def _emit(self, cycle, **fields):
+        self._records.append({"protocol": self.name, "time": self._time(cycle), **fields})
+
+    @property
+    def horizon(self):
+        """
+        Time in nanoseconds such that every record the decoder produces from now on will have
+        the same or a later time.
+        """
+        if self._start is not None:
+            return self._time(self._start)
+        return self._time(self._last_cycle)
+
+    def _change(self, cycle, pins):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def process(self, trace):
+        """Decode the pin changes in ``trace``. Returns the list of completed records."""
+        if self.event in trace.columns:
+            timestamps = trace.timestamps
+            rows, values = trace.columns[self.event]
+            for row, value in zip(rows, values):
+                self._change(timestamps[row], value)
+        if len(trace.timestamps) > 0:
+            # Any later changes of the pins will happen at this cycle or after it.
+            self._last_cycle = trace.timestamps[-1]
+        records, self._records = self._records, []
+        return records
+
+    def finish(self):
+        """Finish decoding at the end of the trace. Returns the list of completed records."""
+        self._finish()
+        records, self._records = self._records, []
+        return records
+
+
+class UARTDecoder(ProtocolDecoder):
+    """
+    UART decoder. Produces a record for every frame received on pin ``rx``, with the received
+    ``data``, and the ``error`` (``"parity"`` or ``"frame"``) if there was one.
+    """
+    name      = "uart"
+    fields    = ProtocolDecoder.fields + ("data", "error")
+    arguments = {"rx": int, "baud": int, "data_bits": int, "parity": str, "stop_bits": int}
+
+    def __init__(self, *, rx, baud, data_bits=8, parity="none", stop_bits=1, **kwargs):
+        super().__init__(**kwargs)
+        if parity not in ("none", "zero", "one", "odd", "even"):
+            raise ValueError(f"unknown parity {parity!r}")
+        self._rx        = rx
+        self._bit_time  = self.sys_clk_freq / baud
+        self._data_bits = data_bits
+        self._parity    = parity
+        self._stop_bits = stop_bits
+        self._frame     = 1 + data_bits + (parity != "none") + stop_bits
+
+        self._level     = None
+        self._start     = None # cycle of the start bit edge, if receiving a frame
+        self._bits      = []
+
+    def _advance(self, cycle):
+        # Sample every bit whose midpoint is before `cycle`; the line did not change until then.
+        while self._start is not None:
+            if self._start + self._bit_time * (len(self._bits) + 0.5) >= cycle:
+                break
+            self._bits.append(self._level)
+            if self._bits[0] != 0:
+                self._start = None # glitch, not a start bit
+            elif len(self._bits) == self._frame:
+                self._frame_done()
+
+    def _frame_done(self):
+        data_bits = self._bits[1:1 + self._data_bits]
+        data = sum(bit << index for index, bit in enumerate(data_bits))
+        error = None
+        if self._parity != "none":
+            parity = self._bits[1 + self._data_bits]
+            expected = {
+                "zero": 0,
+                "one":  1,
+                "odd":  (sum(data_bits) + 1) & 1,
+                "even": sum(data_bits) & 1,
+            }[self._parity]
+            if parity != expected:
+                error = "parity"
+        if not all(self._bits[-self._stop_bits:]):
+            error = "frame"
+        self._emit(self._start, data=data, error=error)
+        self._start = None
+
+    def _change(self, cycle, pins):
+        level = (pins >> self._rx) & 1
+        if level == self._level:
+            return
+        self._advance(cycle)
+        if self._start is None and self._level == 1 and level == 0:
+            self._start = cycle
+            self._bits  = []
+        self._level = level
+
+    def _finish(self):
+        self._advance(float("inf"))
+
+
+class SPIDecoder(ProtocolDecoder):
+    """
+    SPI decoder. Produces a record for every transaction (while pin ``cs`` is low) or, if there
+    is no ``cs`` pin, for every byte, with the data on ``copi`` and ``cipo`` as hexadecimal
+    strings, the number of ``bits`` transferred, and the ``end`` time of the transaction.
+    """
+    name      = "spi"
+    fields    = ProtocolDecoder.fields + ("end", "copi", "cipo", "bits")
+    arguments = {"sck": int, "copi": int, "cipo": int, "cs": int, "mode": int, "lsb_first": int}
+
+    def __init__(self, *, sck, copi=None, cipo=None, cs=None, mode=0, lsb_first=False,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if mode not in range(4):
+            raise ValueError(f"unknown SPI mode {mode}")
+        self._sck       = sck
+        self._copi      = copi
+        self._cipo      = cipo
+        self._cs        = cs
+        # Data is sampled on the rising edge of SCK in modes 0 and 3, and on the falling edge
+        # in modes 1 and 2.
+        self._sample_on = 1 if mode in (0, 3) else 0
+        self._lsb_first = bool(lsb_first)
+
+        self._pins      = None
+        self._start     = None
+        self._end       = None
+        self._count     = 0
+        self._copi_data = bytearray()
+        self._cipo_data = bytearray()
+
+    def _bit(self, data, pins, pin):
+        if pin is None:
+            return
+        bit = (pins >> pin) & 1
+        if self._count % 8 == 0:
+            data.append(0)
+        if self._lsb_first:
+            data[-1] |= bit << (self._count % 8)
+        else:
+            data[-1] |= bit << (7 - self._count % 8)
+
+    def _transaction_done(self):
+        if self._count > 0:
+            self._emit(self._start, end=self._time(self._end),
+                       copi=self._copi_data.hex() if self._copi is not None else None,
+                       cipo=self._cipo_data.hex() if self._cipo is not None else None,
+                       bits=self._count)
+        self._start     = None
+        self._count     = 0
+        self._copi_data = bytearray()
+        self._cipo_data = bytearray()
+
+    def _change(self, cycle, pins):
+        prev_pins, self._pins = self._pins, pins
+        if prev_pins is None:
+            return
+        if self._cs is not None:
+            cs = (pins >> self._cs) & 1
+            if cs and not (prev_pins >> self._cs) & 1:
+                self._transaction_done()
+            if cs:
+                return
+        sck = (pins >> self._sck) & 1
+        if sck == (prev_pins >> self._sck) & 1 or sck != self._sample_on:
+            return
+        if self._start is None:
+            self._start = cycle
+        self._end = cycle
+        self._bit(self._copi_data, pins, self._copi)
+        self._bit(self._cipo_data, pins, self._cipo)
+        self._count += 1
+        if self._cs is None and self._count == 8:
+            self._transaction_done()
+
+    def _finish(self):
+        self._transaction_done()
+
+
+class I2CDecoder(ProtocolDecoder):
+    """
+    I²C decoder. Produces a record for every transaction (from a start condition to a stop or
+    repeated start condition) on pins ``scl`` and ``sda``, with the 7-bit ``address``, whether it
+    was a ``read``, the ``data`` as a hexadecimal string, ``ack`` with ``A`` or ``N`` for every
+    byte including the address, and the ``end`` time of the transaction.
+    """
+    name      = "i2c"
+    fields    = ProtocolDecoder.fields + ("end", "address", "read", "data", "ack")
+    arguments = {"scl": int, "sda": int}
+
+    def __init__(self, *, scl, sda, **kwargs):
+        super().__init__(**kwargs)
+        self._scl   = scl
+        self._sda   = sda
+
+        self._pins  = None
+        self._cycle = None
+        self._start = None # cycle of the start condition, if in a transaction
+        self._bits  = 0
+        self._count = 0
+        self._bytes = bytearray()
+        self._acks  = []
+
+    def _transaction_done(self, cycle):
+        if self._bytes:
+            address = self._bytes[0]
+            self._emit(self._start, end=self._time(cycle), address=address >> 1,
+                       read=bool(address & 1), data=self._bytes[1:].hex(),
+                       ack="".join(self._acks))
+        self._start = None
+
+    def _change(self, cycle, pins):
+        prev_pins, self._pins = self._pins, pins
+        self._cycle = cycle
+        if prev_pins is None:
+            return
+        scl,      sda      = (pins >> self._scl) & 1,      (pins >> self._sda) & 1
+        prev_scl, prev_sda = (prev_pins >> self._scl) & 1, (prev_pins >> self._sda) & 1
+        if scl and prev_scl and sda != prev_sda:
+            if self._start is not None:
+                self._transaction_done(cycle)
+            if not sda: # start condition
+                self._start = cycle
+                self._bits  = 0
+                self._count = 0
+                self._bytes = bytearray()
+                self._acks  = []
+        elif scl and not prev_scl and self._start is not None:
+            if self._count == 8:
+                self._acks.append("N" if sda else "A")
+                self._count = 0
+            else:
+                self._bits  = (self._bits << 1) | sda
+                self._count += 1
+                if self._count == 8:
+                    self._bytes.append(self._bits & 0xff)
+
+    def _finish(self):
+        if self._start is not None:
+            self._transaction_done(self._cycle)
+
+
+PROTOCOL_DECODERS = {decoder.name: decoder for decoder in (UARTDecoder, SPIDecoder, I2CDecoder)}
+
+
+def parse_protocol_decoder(spec, *, sys_clk_freq, event="pin"):
+    """
+    Create a protocol decoder from a specification such as ``uart:rx=0,baud=115200``: the name
+    of the protocol, optionally followed by a colon and a comma-separated list of arguments.
+    Raises :exc:`ValueError` if the specification is invalid.
+    """
+    name, _, arguments = spec.partition(":")
+    if name not in PROTOCOL_DECODERS:
+        raise ValueError(f"unknown protocol {name!r}; must be one of: "
+                         f"{' '.join(PROTOCOL_DECODERS)}")
+    decoder_cls = PROTOCOL_DECODERS[name]
+    kwargs = {}
+    for argument in filter(None, arguments.split(",")):
+        key, sep, value = argument.partition("=")
+        key = key.strip().replace("-", "_")
+        if not sep or key not in decoder_cls.arguments:
+            raise ValueError(f"invalid argument {argument!r} for protocol {name!r}; arguments "
+                             f"are: {' '.join(decoder_cls.arguments)}")
+        try:
+            if decoder_cls.arguments[key] is int:
+                kwargs[key] = int(value.strip(), 0)
+            else:
+                kwargs[key] = decoder_cls.arguments[key](value.strip())
+        except ValueError:
+            raise ValueError(f"invalid value {value!r} for argument {key!r} of protocol {name!r}")
+    try:
+        return decoder_cls(sys_clk_freq=sys_clk_freq, event=event, **kwargs)
+    except TypeError as error:
+        raise ValueError(f"invalid arguments for protocol {name!r}: {error}")
+
+
+class ProtocolPipeline:
+    """
+    Runs several protocol decoders over the same trace, merging their records in time order.
+
+    A record is held back until every decoder has passed its time (see
+    :attr:`ProtocolDecoder.horizon`), so that the records returned by all calls to
+    :meth:`process` and :meth:`finish` are in time order, not only the records returned by
+    each call.
+    """
+    def __init__(self, decoders):
+        self.decoders = list(decoders)
+        self._pending = []
+
+    def _merge(self, records, horizon):
+        self._pending += records
+        self._pending.sort(key=lambda record: record["time"])
+        index = bisect.bisect_right([record["time"] for record in self._pending], horizon)
+        records, self._pending = self._pending[:index], self._pending[index:]
+        return records
+
+    def process(self, trace):
+        """Decode ``trace``, a :class:`TraceColumns`. Returns the list of completed records."""
+        records = [record for decoder in self.decoders for record in decoder.process(trace)]
+        return self._merge(records, min((decoder.horizon for decoder in self.decoders),
+                                        default=float("inf")))
+
+    def finish(self):
+        """Finish decoding at the end of the trace. Returns the list of completed records."""
+        records = [record for decoder in self.decoders for record in decoder.finish()]
+        return self._merge(records, float("inf"))
+
+
+class JSONLinesRecordWriter:
+    """Writes records to ``file`` as JSON objects, one per line."""
+    format = "jsonl"
+
+    def __init__(self, file, decoders):
+        self._file = file
+
+    def write(self, records):
+        self._file.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+class CSVRecordWriter:
+    """Writes records to ``file`` as CSV, with a column for every field of any of ``decoders``."""
+    format = "csv"
+
+    def __init__(self, file, decoders):
+        fields = []
+        for decoder in decoders:
+            fields += [field for field in decoder.fields if field not in fields]
+        self._writer = csv.DictWriter(file, fields)
+        self._writer.writeheader()
+
+    def write(self, records):
+        self._writer.writerows(records)
+
+
+RECORD_WRITERS = {writer.format: writer for writer in (JSONLinesRecordWriter, CSVRecordWriter)}
@@ -1,8 +1,332 @@
+import io
+import json
+import array
+import asyncio
+import tempfile
+import unittest
+from types import SimpleNamespace
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFOBuffered
+
+from ....gateware import simulation_test
+from ....gateware.registers import Registers
+from ....gateware.analyzer import TraceColumns, REPORT_DELAY, REPORT_EVENT, REPORT_SPECIAL, SPECIAL_DONE
 from ... import *
-from . import AnalyzerApplet
+from .capture import *
+from .protocol import *
+from . import *
+
+
+class AnalyzerCaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.event_sources = [
+            CaptureEventSource("pin", "change", 4, ()),
+            CaptureEventSource("sync", "strobe", 0, ()),
+        ]
+        self.trace = bytes([
+            REPORT_DELAY|2, REPORT_EVENT|0, 0b1010, REPORT_EVENT|1,
+            REPORT_DELAY|3, REPORT_EVENT|0, 0b0101,
+            REPORT_DELAY|1, REPORT_SPECIAL|SPECIAL_DONE,
+        ])
+
+    def write_capture(self, file):
+        async def write():
+            writer = CaptureWriter(file, event_sources=self.event_sources, sys_clk_freq=1_000_000,
+                                   bitstream_id=b"\xaa" * 16, buffer_size=4)
+            for octet in self.trace:
+                await writer.write([octet])
+            writer.close()
+        asyncio.get_event_loop().run_until_complete(write())
+
+    def test_roundtrip(self):
+        with tempfile.TemporaryFile() as file:
+            self.write_capture(file)
+            file.seek(0)
+            reader = CaptureReader(file)
+            self.assertEqual(reader.event_sources, self.event_sources)
+            self.assertEqual(reader.sys_clk_freq, 1_000_000)
+            self.assertEqual(reader.bitstream_id, b"\xaa" * 16)
+            self.assertEqual(b"".join(reader.chunks(chunk_size=4)), self.trace)
+            self.assertEqual([row for trace in reader.decode() for row in trace.rows()], [
+                (2, {"pin": 0b1010, "sync": None}),
+                (5, {"pin": 0b0101}),
+                (6, {}),
+            ])
+
+    def test_convert_to_vcd(self):
+        with tempfile.TemporaryFile() as file:
+            self.write_capture(file)
+            file.seek(0)
+            output = io.StringIO()
+            self.assertEqual(convert_to_vcd(CaptureReader(file), output), 3)
+            self.assertIn("#2000\nb1010 ", output.getvalue())
+            self.assertIn("#5000\nb101 ", output.getvalue())
+
+    def test_convert_to_columns(self):
+        with tempfile.TemporaryFile() as file, tempfile.TemporaryDirectory() as directory:
+            self.write_capture(file)
+            file.seek(0)
+            self.assertEqual(convert_to_columns(CaptureReader(file), directory), 3)
+            with open(f"{directory}/pin.values.npy", "rb") as npy_file:
+                self.assertEqual(npy_file.read(6), b"\x93NUMPY")
+                npy_file.seek(128)
+                self.assertEqual(len(npy_file.read()), 2 * 8)
+            with open(f"{directory}/trace.json") as json_file:
+                self.assertEqual(json.load(json_file)["overrun"], None)
+
+    def test_read_raw(self):
+        class MockInterface:
+            def __init__(self, chunks):
+                self.chunks = list(chunks)
+            async def read(self):
+                return self.chunks.pop(0)
+        # The end of the stream is found even if the records are split between chunks, and
+        # nothing is read after it.
+        chunks = [self.trace[:2], self.trace[2:6], self.trace[6:], b"unreachable"]
+        iface = AnalyzerInterface(MockInterface(chunks), self.event_sources)
+        async def read_all():
+            data = bytearray()
+            while not iface.done:
+                data += await iface.read_raw()
+            return data
+        self.assertEqual(asyncio.get_event_loop().run_until_complete(read_all()), self.trace)
+        self.assertFalse(iface.overrun)
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(CaptureFormatError, r"^not an analyzer capture$"):
+            CaptureReader(io.BytesIO(b"not a capture"))
+
+
+class _EventSource:
+    def __init__(self, width):
+        self.data    = Signal(width)
+        self.trigger = Signal()
+
+
+class AnalyzerTriggerTestbench(Elaboratable):
+    def __init__(self):
+        self.pins = Signal(4)
+        self.event_source = _EventSource(4)
+        self.done = Signal()
+        self.registers = Registers()
+        self.dut = AnalyzerTrigger(self.pins, self.event_source, self.done,
+                                   depth=8, registers=self.registers)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.registers = self.registers
+        m.submodules.dut = self.dut
+        return m
+
+
+class AnalyzerTriggerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tb = AnalyzerTriggerTestbench()
+
+    def run_trigger(self, tb, changes, cycles):
+        # Apply pin changes at the given cycles, and collect the events emitted by the trigger.
+        changes = dict(changes)
+        events  = []
+        for cycle in range(cycles):
+            if cycle in changes:
+                yield tb.pins.eq(changes[cycle])
+            yield
+            if (yield tb.event_source.trigger):
+                events.append((cycle, (yield tb.event_source.data)))
+        return events
+
+    @simulation_test
+    def test_free_running(self, tb):
+        yield tb.dut.pre_count.eq(4)
+        yield tb.dut.control.eq(CONTROL_ARM)
+        events = yield from self.run_trigger(tb, [(2, 1), (3, 2), (7, 3)], 20)
+        self.assertEqual([data for _, data in events], [1, 2, 3])
+        self.assertEqual(events[1][0] - events[0][0], 1)
+        self.assertEqual(events[2][0] - events[1][0], 4)
+        self.assertFalse((yield tb.done))
+
+    @simulation_test
+    def test_pattern(self, tb):
+        yield tb.dut.mask.eq(0b1111)
+        yield tb.dut.value.eq(0b0101)
+        yield tb.dut.count.eq(1)
+        yield tb.dut.pre_count.eq(2)
+        yield tb.dut.post_count.eq(2)
+        yield tb.dut.control.eq(CONTROL_ARM | CONTROL_TRIGGERED)
+        events = yield from self.run_trigger(tb, [
+            (2, 1), (5, 2), (6, 3), (9, 4), (12, 5), (14, 6), (17, 7), (19, 8),
+        ], 40)
+        self.assertEqual([data for _, data in events], [3, 4, 5, 6, 7])
+        self.assertEqual([cycle - events[0][0] for cycle, _ in events], [0, 3, 6, 8, 11])
+        self.assertEqual((yield tb.dut.status) & STATUS_COMPLETE, STATUS_COMPLETE)
+
+    @simulation_test
+    def test_edge_count(self, tb):
+        yield tb.dut.edge_mode.eq(TRIGGER_EDGE_RISING)
+        yield tb.dut.edge_pin.eq(1)
+        yield tb.dut.count.eq(2)
+        yield tb.dut.pre_count.eq(0)
+        yield tb.dut.post_count.eq(1)
+        yield tb.dut.control.eq(CONTROL_ARM | CONTROL_TRIGGERED)
+        events = yield from self.run_trigger(tb, [
+            (2, 0b10), (4, 0b00), (6, 0b01), (8, 0b11), (10, 0b01), (12, 0b00),
+        ], 30)
+        self.assertEqual([data for _, data in events], [0b11, 0b01])
+        self.assertTrue((yield tb.done))
+
+
+def _pin_trace(changes):
+    # Build a trace from a list of `(cycle, pins)` changes of the "pin" event.
+    return TraceColumns(array.array("Q", (cycle for cycle, _ in changes)), {
+        "pin": (array.array("L", range(len(changes))),
+                array.array("Q", (pins for _, pins in changes))),
+    }, None)
+
+
+class AnalyzerSubtargetTestbench(Elaboratable):
+    def __init__(self):
+        self.pins = Signal(4)
+        self.fifo = SyncFIFOBuffered(width=8, depth=16)
+        self.dut  = AnalyzerSubtarget(SimpleNamespace(i_t=SimpleNamespace(i=self.pins)),
+                                      self.fifo)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.fifo = self.fifo
+        m.submodules.dut  = self.dut
+        return m
+
+
+class AnalyzerSubtargetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tb = AnalyzerSubtargetTestbench()
+
+    @simulation_test
+    def test_untriggered(self, tb):
+        # Without a trigger, the pins are wired directly to the event source, as they were before
+        # the trigger was added: every change of the synchronized pins is an event right away.
+        self.assertIsNone(tb.dut.trigger)
+        changes = {2: 1, 3: 2, 7: 3, 8: 3, 12: 0}
+        events  = []
+        for cycle in range(20):
+            if cycle in changes:
+                yield tb.pins.eq(changes[cycle])
+            yield
+            if (yield tb.dut.event_source.trigger):
+                events.append((cycle, (yield tb.dut.event_source.data)))
+        self.assertEqual(events, [(4, 1), (5, 2), (9, 3), (14, 0)])
+
+
+class AnalyzerProtocolTestCase(unittest.TestCase):
+    def decode(self, decoder, changes, split=None):
+        # Decode the changes in two parts, to check that decoding is incremental.
+        split = len(changes) // 2 if split is None else split
+        pipeline = ProtocolPipeline([decoder])
+        return (pipeline.process(_pin_trace(changes[:split])) +
+                pipeline.process(_pin_trace(changes[split:])) +
+                pipeline.finish())
+
+    def uart_changes(self, start, bits, bit_time=10):
+        changes = [(0, 1)]
+        for index, bit in enumerate(bits):
+            if bit != changes[-1][1]:
+                changes.append((start + index * bit_time, bit))
+        return changes
+
+    def test_uart(self):
+        decoder = parse_protocol_decoder("uart:rx=0,baud=100", sys_clk_freq=1000)
+        #                                 start  0x35 LSB first           stop
+        changes = self.uart_changes(100, [0,     1, 0, 1, 0, 1, 1, 0, 0, 1])
+        changes += [(cycle + 200, level) for cycle, level in self.uart_changes(100,
+                                          [0,     1, 1, 1, 1, 0, 0, 0, 0, 0])][1:]
+        changes.append((450, 1))
+        self.assertEqual(self.decode(decoder, changes), [
+            {"protocol": "uart", "time": 100_000_000, "data": 0x35, "error": None},
+            {"protocol": "uart", "time": 300_000_000, "data": 0x0f, "error": "frame"},
+        ])
+
+    def test_uart_parity(self):
+        decoder = parse_protocol_decoder("uart:rx=0,baud=100,parity=even", sys_clk_freq=1000)
+        changes = self.uart_changes(100, [0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(self.decode(decoder, changes), [
+            {"protocol": "uart", "time": 100_000_000, "data": 0x01, "error": "parity"},
+        ])
+
+    def test_spi(self):
+        decoder = parse_protocol_decoder("spi:sck=0,copi=1,cipo=2,cs=3", sys_clk_freq=1000)
+        changes = [(0, 0b1000), (10, 0b0000)]
+        cycle = 20
+        for copi, cipo in zip([1, 0, 1, 0, 0, 1, 0, 1, 1, 1], [0, 1, 1, 1, 1, 1, 1, 0, 0, 1]):
+            data = (cipo << 2) | (copi << 1)
+            changes += [(cycle, data), (cycle + 5, data | 1)]
+            cycle += 10
+        changes.append((cycle, 0b1000))
+        self.assertEqual(self.decode(decoder, changes), [
+            {"protocol": "spi", "time": 25_000_000, "end": 115_000_000,
+             "copi": "a5c0", "cipo": "7e40", "bits": 10},
+        ])
+
+    def test_i2c(self):
+        decoder = parse_protocol_decoder("i2c:scl=0,sda=1", sys_clk_freq=1000)
+        changes = [(0, 0b11), (10, 0b01)] # start
+        cycle = 20
+        # Address 0x50, write, ACK; data 0xa5, NAK.
+        for bit in [1, 0, 1, 0, 0, 0, 0, 0, 0] + [1, 0, 1, 0, 0, 1, 0, 1, 1]:
+            changes += [(cycle, bit << 1), (cycle + 5, (bit << 1) | 1)]
+            cycle += 10
+        changes += [(cycle, 0b00), (cycle + 5, 0b01), (cycle + 10, 0b11)] # stop
+        self.assertEqual(self.decode(decoder, changes), [
+            {"protocol": "i2c", "time": 10_000_000, "end": 210_000_000, "address": 0x50,
+             "read": False, "data": "a5", "ack": "AN"},
+        ])
+
+    def test_pipeline_order(self):
+        decoders = [parse_protocol_decoder("uart:rx=0,baud=100", sys_clk_freq=1000),
+                    parse_protocol_decoder("spi:sck=1,copi=2", sys_clk_freq=1000)]
+        # A UART frame from cycle 100 to 200, and an SPI byte from cycle 125 to 195.
+        pins = dict(self.uart_changes(100, [0] + [1] * 9))
+        for index in range(8):
+            pins[120 + index * 10] = 0b101
+            pins[125 + index * 10] = 0b111
+        pins[210] = 0b001
+        changes = sorted(pins.items())
+        pipeline = ProtocolPipeline(decoders)
+        split = next(index for index, (cycle, _) in enumerate(changes) if cycle > 195)
+        # The SPI byte is complete in the first part of the trace, but the UART frame that
+        # started before it is not, so it is held back.
+        self.assertEqual(pipeline.process(_pin_trace(changes[:split])), [])
+        records = pipeline.process(_pin_trace(changes[split:])) + pipeline.finish()
+        self.assertEqual([(record["protocol"], record["time"]) for record in records], [
+            ("uart", 100_000_000),
+            ("spi",  125_000_000),
+        ])
+
+    def test_invalid_spec(self):
+        for spec in ["can:rx=0", "uart:rx=0", "uart:rx=0,baud=x", "uart:rx=0,baud=1,foo=1",
+                     "uart:rx=0,baud=1,parity=wrong", "spi"]:
+            with self.assertRaises(ValueError, msg=spec):
+                parse_protocol_decoder(spec, sys_clk_freq=1000)
+
+    def test_writers(self):
+        decoders = [UARTDecoder(rx=0, baud=100, sys_clk_freq=1000),
+                    I2CDecoder(scl=0, sda=1, sys_clk_freq=1000)]
+        records = [{"protocol": "uart", "time": 1, "data": 2, "error": None}]
+        output = io.StringIO()
+        JSONLinesRecordWriter(output, decoders).write(records)
+        self.assertEqual(json.loads(output.getvalue()), records[0])
+        output = io.StringIO()
+        CSVRecordWriter(output, decoders).write(records)
+        self.assertEqual(output.getvalue().splitlines(), [
+            "protocol,time,data,error,end,address,read,ack",
+            "uart,1,2,,,,,",
+        ])
 
 
 class AnalyzerAppletTestCase(GlasgowAppletTestCase, applet=AnalyzerApplet):
     @synthesis_test
     def test_build(self):
         self.assertBuilds()
+
+    @synthesis_test
+    def test_build_trigger(self):
+        self.assertBuilds(args=["--trigger-depth", "512"])
@@ -22,6 +22,8 @@
 import struct
 import logging
 import argparse
+import asyncio
+import contextlib
 import enum
 from amaranth import *
 from amaranth.lib import io, cdc
@@ -160,12 +162,15 @@ CMD_SHIFT_TMS  = 0b00000000
 CMD_SHIFT_TDIO = 0b00010000
 CMD_GET_AUX    = 0b10000000
 CMD_SET_AUX    = 0b10010000
+CMD_GET_CMP    = 0b10100000
 # CMD_SHIFT_{TMS,TDIO}
 BIT_DATA_OUT   =     0b0001
 BIT_DATA_IN    =     0b0010
 BIT_LAST       =     0b0100
 # CMD_SHIFT_TMS
 BIT_TDI        =     0b1000
+# CMD_SHIFT_TDIO
+BIT_COMPARE    =     0b1000
 
 
 class JTAGProbeDriver(Elaboratable):
@@ -183,6 +188,31 @@ class JTAGProbeDriver(Elaboratable):
         shreg_o = Signal(8)
         shreg_i = Signal(8)
 
+        # Masked TDO comparison. Every byte of a CMD_SHIFT_TDIO|BIT_COMPARE command is followed by
+        # a byte of expected TDO data and a byte of mask. The first mismatch since the last
+        # CMD_GET_CMP latches the number of bits compared before it; CMD_GET_CMP returns a byte
+        # with the mismatch flag, followed by that offset, and restarts the comparison.
+        cmp_data     = Signal(8)
+        cmp_mask     = Signal(8)
+        cmp_count    = Signal(32)
+        cmp_fail     = Signal()
+        cmp_offset   = Signal(32)
+        cmp_byte     = Signal(range(5))
+        cmp_diff     = Signal(8)
+        cmp_first    = Signal(3)
+        cmp_bits     = Signal(4)
+        # Commands without BIT_COMPARE bypass the comparison states entirely, so that they take
+        # no more cycles per byte than they would without comparison support.
+        compare      = Signal()
+        m.d.comb += [
+            compare.eq(((cmd & CMD_MASK) == CMD_SHIFT_TDIO) & ((cmd & BIT_COMPARE) != 0)),
+            cmp_diff.eq((Mux(count == 0, shreg_i >> align, shreg_i) ^ cmp_data) & cmp_mask),
+            cmp_bits.eq(Mux(count == 0, 8 - align, 8)),
+        ]
+        for bit in reversed(range(8)):
+            with m.If(cmp_diff[bit]):
+                m.d.comb += cmp_first.eq(bit)
+
         with m.FSM() as fsm:
             with m.State("RECV-COMMAND"):
                 m.d.comb += self._in_fifo.flush.eq(1)
@@ -199,6 +229,9 @@ class JTAGProbeDriver(Elaboratable):
                     m.next = "SEND-AUX"
                 with m.Elif((cmd & CMD_MASK) == CMD_SET_AUX):
                     m.next = "RECV-AUX"
+                with m.Elif((cmd & CMD_MASK) == CMD_GET_CMP):
+                    m.d.sync += cmp_byte.eq(0)
+                    m.next = "SEND-CMP"
 
             with m.State("SEND-AUX"):
                 with m.If(self._in_fifo.w_rdy):
@@ -208,6 +241,21 @@ class JTAGProbeDriver(Elaboratable):
                     ]
                     m.next = "RECV-COMMAND"
 
+            with m.State("SEND-CMP"):
+                with m.If(self._in_fifo.w_rdy):
+                    m.d.comb += [
+                        self._in_fifo.w_en.eq(1),
+                        self._in_fifo.w_data.eq(
+                            Cat(cmp_fail, C(0, 7), cmp_offset).word_select(cmp_byte, 8)),
+                    ]
+                    m.d.sync += cmp_byte.eq(cmp_byte + 1)
+                    with m.If(cmp_byte == 4):
+                        m.d.sync += [
+                            cmp_fail.eq(0),
+                            cmp_count.eq(0),
+                        ]
+                        m.next = "RECV-COMMAND"
+
             with m.State("RECV-AUX"):
                 with m.If(self._out_fifo.r_rdy):
                     m.d.comb += self._out_fifo.r_en.eq(1)
@@ -241,10 +289,28 @@ class JTAGProbeDriver(Elaboratable):
                         with m.If(self._out_fifo.r_rdy):
                             m.d.comb += self._out_fifo.r_en.eq(1)
                             m.d.sync += shreg_o.eq(self._out_fifo.r_data)
-                            m.next = "SHIFT-SETUP"
+                            with m.If(compare):
+                                m.next = "RECV-CMP-DATA"
+                            with m.Else():
+                                m.next = "SHIFT-SETUP"
                     with m.Else():
                         m.d.sync += shreg_o.eq(0b11111111)
-                        m.next = "SHIFT-SETUP"
+                        with m.If(compare):
+                            m.next = "RECV-CMP-DATA"
+                        with m.Else():
+                            m.next = "SHIFT-SETUP"
+
+            with m.State("RECV-CMP-DATA"):
+                with m.If(self._out_fifo.r_rdy):
+                    m.d.comb += self._out_fifo.r_en.eq(1)
+                    m.d.sync += cmp_data.eq(self._out_fifo.r_data)
+                    m.next = "RECV-CMP-MASK"
+
+            with m.State("RECV-CMP-MASK"):
+                with m.If(self._out_fifo.r_rdy):
+                    m.d.comb += self._out_fifo.r_en.eq(1)
+                    m.d.sync += cmp_mask.eq(self._out_fifo.r_data)
+                    m.next = "SHIFT-SETUP"
 
             with m.State("SHIFT-SETUP"):
                 m.d.sync += self.adapter.stb.eq(1)
@@ -267,11 +333,22 @@ class JTAGProbeDriver(Elaboratable):
                 m.d.sync += self.adapter.stb.eq(0)
                 with m.If(self.adapter.rdy):
                     m.d.sync += shreg_i.eq(Cat(shreg_i[1:], self.adapter.tdo))
-                    with m.If(bitno == 0):
+                    with m.If((bitno == 0) & compare):
+                        m.next = "COMPARE-BITS"
+                    with m.Elif(bitno == 0):
                         m.next = "SEND-BITS"
                     with m.Else():
                         m.next = "SHIFT-SETUP"
 
+            with m.State("COMPARE-BITS"):
+                m.d.sync += cmp_count.eq(cmp_count + cmp_bits)
+                with m.If(~cmp_fail & cmp_diff.any()):
+                    m.d.sync += [
+                        cmp_fail.eq(1),
+                        cmp_offset.eq(cmp_count + cmp_first),
+                    ]
+                m.next = "SEND-BITS"
+
             with m.State("SEND-BITS"):
                 with m.If(cmd & BIT_DATA_IN):
                     with m.If(self._in_fifo.w_rdy):
@@ -326,6 +403,12 @@ class JTAGProbeInterface:
         self._state      = JTAGState.UNKNOWN
         self._current_ir = None
 
+        # TDO data that has been requested but not yet read, as a list of
+        # `(counts, future, convert)`, where `counts` are the bit counts of each shift command
+        # making up a single scan, and `convert` is applied to the data (if not `None`).
+        self._pending    = []
+        self._deferred   = 0
+
     def _log_l(self, message, *args):
         self._logger.log(self._level, "JTAG-L: " + message, *args)
 
@@ -338,12 +421,68 @@ class JTAGProbeInterface:
         self._log_l("flush")
         await self.lower.flush()
 
+    def _defer_tdo(self, counts, convert=None):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((counts, future, convert))
+        return future
+
+    def _deferred_result(self, value):
+        # Within a batch, every scan returns a future, even if its result is known immediately.
+        if self._deferred:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            return future
+        return value
+
+    async def sync(self):
+        """
+        Read the TDO data of all queued scans, in a single read, and resolve their futures.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        length = sum((count + 7) // 8 for counts, _, _ in pending for count in counts)
+        self._log_l("sync scans=%d bytes=%d", len(pending), length)
+        try:
+            data = await self.lower.read(length)
+        except BaseException:
+            for _, future, _ in pending:
+                future.cancel()
+            raise
+        offset = 0
+        for counts, future, convert in pending:
+            tdo_bits = bits()
+            for count in counts:
+                tdo_bits += bits(data[offset:offset + (count + 7) // 8], count)
+                offset += (count + 7) // 8
+            future.set_result(tdo_bits if convert is None else convert(tdo_bits))
+
+    @contextlib.asynccontextmanager
+    async def batch(self):
+        """
+        Queue scans without waiting for their results.
+
+        Within the batch, the methods that return TDO data (e.g. :meth:`shift_tdio`,
+        :meth:`exchange_dr`, or :meth:`read_ir`) return futures instead; the data for all of them
+        is read back at once when the batch ends (or when :meth:`sync` is called), so that
+        a sequence of many small scans costs a single round trip instead of one per scan.
+        Batches may be nested; the data is read back when the outermost batch ends.
+        """
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+            if not self._deferred:
+                await self.sync()
+
     async def set_aux(self, value):
         self._log_l("set aux=%s", format(value, "08b"))
         await self.lower.write(struct.pack("<BB",
             CMD_SET_AUX, value))
 
     async def get_aux(self):
+        await self.sync()
         await self.lower.write(struct.pack("<B",
             CMD_GET_AUX))
         value, = await self.lower.read(1)
@@ -400,7 +539,7 @@ class JTAGProbeInterface:
     async def shift_tdio(self, tdi_bits, *, prefix=0, suffix=0, last=True):
         assert self._state in (JTAGState.IRSHIFT, JTAGState.DRSHIFT)
         tdi_bits = bits(tdi_bits)
-        tdo_bits = bits()
+        counts   = []
         self._log_l("shift tdio-i=%d,<%s>,%d", prefix, dump_bin(tdi_bits), suffix)
         await self._shift_dummy(prefix)
         for tdi_bits, chunk_last in self._chunk_bits(tdi_bits, last and suffix == 0):
@@ -409,11 +548,16 @@ class JTAGProbeInterface:
                 len(tdi_bits)))
             tdi_bytes = bytes(tdi_bits)
             await self.lower.write(tdi_bytes)
-            tdo_bytes = await self.lower.read(len(tdi_bytes))
-            tdo_bits += bits(tdo_bytes, len(tdi_bits))
+            counts.append(len(tdi_bits))
         await self._shift_dummy(suffix, last)
-        self._log_l("shift tdio-o=%d,<%s>,%d", prefix, dump_bin(tdo_bits), suffix)
         self._shift_last(last)
+        tdo_future = self._defer_tdo(counts)
+        if self._deferred:
+            self._log_l("shift tdio-o=%d,<deferred>,%d", prefix, suffix)
+            return tdo_future
+        await self.sync()
+        tdo_bits = tdo_future.result()
+        self._log_l("shift tdio-o=%d,<%s>,%d", prefix, dump_bin(tdo_bits), suffix)
         return tdo_bits
 
     async def shift_tdi(self, tdi_bits, *, prefix=0, suffix=0, last=True):
@@ -432,19 +576,81 @@ class JTAGProbeInterface:
 
     async def shift_tdo(self, count, *, prefix=0, suffix=0, last=True):
         assert self._state in (JTAGState.IRSHIFT, JTAGState.DRSHIFT)
-        tdo_bits = bits()
+        counts = []
         await self._shift_dummy(prefix)
         for count, chunk_last in self._chunk_count(count, last and suffix == 0):
             await self.lower.write(struct.pack("<BH",
                 CMD_SHIFT_TDIO|BIT_DATA_IN|(BIT_LAST if chunk_last else 0),
                 count))
-            tdo_bytes = await self.lower.read((count + 7) // 8)
-            tdo_bits += bits(tdo_bytes, count)
+            counts.append(count)
         await self._shift_dummy(suffix, last)
-        self._log_l("shift tdo=%d,<%s>,%d", prefix, dump_bin(tdo_bits), suffix)
         self._shift_last(last)
+        tdo_future = self._defer_tdo(counts)
+        if self._deferred:
+            self._log_l("shift tdo=%d,<deferred>,%d", prefix, suffix)
+            return tdo_future
+        await self.sync()
+        tdo_bits = tdo_future.result()
+        self._log_l("shift tdo=%d,<%s>,%d", prefix, dump_bin(tdo_bits), suffix)
         return tdo_bits
 
+    async def shift_tdi_compare(self, tdi_bits, tdo_bits, mask_bits=None, *,
+                                prefix=0, suffix=0, last=True):
+        """
+        Shift ``tdi_bits``, and compare TDO with ``tdo_bits`` where ``mask_bits`` (by default,
+        all bits) is set in the probe, without reading TDO back. The result of the comparison is
+        retrieved with :meth:`get_compare`.
+        """
+        assert self._state in (JTAGState.IRSHIFT, JTAGState.DRSHIFT)
+        tdi_bits = bits(tdi_bits)
+        tdo_bits = bits(tdo_bits)
+        if mask_bits is None:
+            mask_bits = bits((1 << len(tdi_bits)) - 1, len(tdi_bits))
+        mask_bits = bits(mask_bits)
+        assert len(tdo_bits) == len(mask_bits) == len(tdi_bits)
+        self._log_l("shift tdi=%d,<%s>,%d tdo=<%s> mask=<%s>", prefix, dump_bin(tdi_bits), suffix,
+                    dump_bin(tdo_bits), dump_bin(mask_bits))
+        await self._shift_dummy(prefix)
+        offset = 0
+        for tdi_chunk, chunk_last in self._chunk_bits(tdi_bits, last and suffix == 0):
+            tdo_chunk  = tdo_bits[offset:offset + len(tdi_chunk)]
+            mask_chunk = mask_bits[offset:offset + len(tdi_chunk)]
+            offset += len(tdi_chunk)
+            await self.lower.write(struct.pack("<BH",
+                CMD_SHIFT_TDIO|BIT_DATA_OUT|BIT_COMPARE|(BIT_LAST if chunk_last else 0),
+                len(tdi_chunk)))
+            # Each byte of TDI data is followed by a byte of expected TDO data and of mask.
+            chunk_bytes = bytearray(3 * len(bytes(tdi_chunk)))
+            chunk_bytes[0::3] = bytes(tdi_chunk)
+            chunk_bytes[1::3] = bytes(tdo_chunk)
+            chunk_bytes[2::3] = bytes(mask_chunk)
+            await self.lower.write(chunk_bytes)
+        await self._shift_dummy(suffix, last)
+        self._shift_last(last)
+
+    @staticmethod
+    def _decode_compare(cmp_bits):
+        cmp_bytes = bytes(cmp_bits)
+        if cmp_bytes[0] & 1:
+            return int.from_bytes(cmp_bytes[1:5], "little")
+
+    async def get_compare(self):
+        """
+        Retrieve and reset the result of the comparisons made by :meth:`shift_tdi_compare`
+        (and the methods using it) since the previous call. Returns ``None`` if all of them
+        succeeded, or the offset of the first mismatching bit, counting all compared bits.
+        Within a batch, returns a future.
+        """
+        await self.lower.write(struct.pack("<B",
+            CMD_GET_CMP))
+        cmp_future = self._defer_tdo([40], self._decode_compare)
+        if self._deferred:
+            return cmp_future
+        await self.sync()
+        mismatch = cmp_future.result()
+        self._log_l("get cmp mismatch=%s", mismatch)
+        return mismatch
+
     async def pulse_tck(self, count):
         assert self._state in (JTAGState.IDLE, JTAGState.IRPAUSE, JTAGState.DRPAUSE)
         self._log_l("pulse tck count=%d", count)
@@ -644,24 +850,26 @@ class JTAGProbeInterface:
         self._log_h("exchange ir-i=%d,<%s>,%d", prefix, dump_bin(data), suffix)
         if not data:
             await self.enter_capture_ir()
-            data = bits()
+            data = self._deferred_result(bits())
         else:
             await self.enter_shift_ir()
             data = await self.shift_tdio(data, prefix=prefix, suffix=suffix)
         await self.enter_update_ir()
-        self._log_h("exchange ir-o=%d,<%s>,%d", prefix, dump_bin(data), suffix)
+        if not self._deferred:
+            self._log_h("exchange ir-o=%d,<%s>,%d", prefix, dump_bin(data), suffix)
         return data
 
     async def read_ir(self, count, *, prefix=0, suffix=0):
         self._current_ir = (prefix, bits((1,)) * count, suffix)
         if not count:
             await self.enter_capture_ir()
-            data = bits()
+            data = self._deferred_result(bits())
         else:
             await self.enter_shift_ir()
             data = await self.shift_tdo(count, prefix=prefix, suffix=suffix)
         await self.enter_update_ir()
-        self._log_h("read ir=%d,<%s>,%d", prefix, dump_bin(data), suffix)
+        if not self._deferred:
+            self._log_h("read ir=%d,<%s>,%d", prefix, dump_bin(data), suffix)
         return data
 
     async def write_ir(self, data, *, prefix=0, suffix=0, elide=True):
@@ -678,27 +886,40 @@ class JTAGProbeInterface:
             await self.shift_tdi(data, prefix=prefix, suffix=suffix)
         await self.enter_update_ir()
 
+    async def compare_ir(self, data, tdo, mask=None, *, prefix=0, suffix=0):
+        data = bits(data)
+        self._current_ir = (prefix, data, suffix)
+        self._log_h("compare ir=%d,<%s>,%d", prefix, dump_bin(data), suffix)
+        if not data:
+            await self.enter_capture_ir()
+        else:
+            await self.enter_shift_ir()
+            await self.shift_tdi_compare(data, tdo, mask, prefix=prefix, suffix=suffix)
+        await self.enter_update_ir()
+
     async def exchange_dr(self, data, *, prefix=0, suffix=0):
         self._log_h("exchange dr-i=%d,<%s>,%d", prefix, dump_bin(data), suffix)
         if not data:
             await self.enter_capture_dr()
-            data = bits()
+            data = self._deferred_result(bits())
         else:
             await self.enter_shift_dr()
             data = await self.shift_tdio(data, prefix=prefix, suffix=suffix)
         await self.enter_update_dr()
-        self._log_h("exchange dr-o=%d,<%s>,%d", prefix, dump_bin(data), suffix)
+        if not self._deferred:
+            self._log_h("exchange dr-o=%d,<%s>,%d", prefix, dump_bin(data), suffix)
         return data
 
     async def read_dr(self, count, *, prefix=0, suffix=0):
         if not count:
             await self.enter_capture_dr()
-            data = bits()
+            data = self._deferred_result(bits())
         else:
             await self.enter_shift_dr()
             data = await self.shift_tdo(count, prefix=prefix, suffix=suffix)
         await self.enter_update_dr()
-        self._log_h("read dr=%d,<%s>,%d", prefix, dump_bin(data), suffix)
+        if not self._deferred:
+            self._log_h("read dr=%d,<%s>,%d", prefix, dump_bin(data), suffix)
         return data
 
     async def write_dr(self, data, *, prefix=0, suffix=0):
@@ -711,6 +932,16 @@ class JTAGProbeInterface:
             await self.shift_tdi(data, prefix=prefix, suffix=suffix)
         await self.enter_update_dr()
 
+    async def compare_dr(self, data, tdo, mask=None, *, prefix=0, suffix=0):
+        data = bits(data)
+        self._log_h("compare dr=%d,<%s>,%d", prefix, dump_bin(data), suffix)
+        if not data:
+            await self.enter_capture_dr()
+        else:
+            await self.enter_shift_dr()
+            await self.shift_tdi_compare(data, tdo, mask, prefix=prefix, suffix=suffix)
+        await self.enter_update_dr()
+
     # Shift chain introspection
 
     async def _scan_xr(self, xr, *, max_length=None, check=True, idempotent=True):
@@ -732,8 +963,13 @@ class JTAGProbeInterface:
             await self.enter_shift_dr()
 
         # Add 1 so that registers of exactly `max_length` could be scanned successfully.
-        data_0 = await self.shift_tdio((0,) * (max_length + 1), last=False)
-        data_1 = await self.shift_tdio((1,) * (max_length + 1), last=not idempotent)
+        # Both shifts are queued before reading back the data; this also completes any scans
+        # queued in an enclosing batch, since the result is needed right away.
+        async with self.batch():
+            data_0 = await self.shift_tdio((0,) * (max_length + 1), last=False)
+            data_1 = await self.shift_tdio((1,) * (max_length + 1), last=not idempotent)
+            await self.sync()
+        data_0, data_1 = data_0.result(), data_1.result()
 
         try:
             value = None
@@ -936,6 +1172,12 @@ class TAPInterface:
     async def flush(self):
         await self.lower.flush()
 
+    def batch(self):
+        return self.lower.batch()
+
+    async def sync(self):
+        await self.lower.sync()
+
     async def test_reset(self):
         await self.lower.test_reset()
 
@@ -958,6 +1200,12 @@ class TAPInterface:
         await self.lower.write_ir(data, elide=elide,
             prefix=self._ir_prefix, suffix=self._ir_suffix)
 
+    async def compare_ir(self, data, tdo, mask=None):
+        data = bits(data)
+        assert len(data) == self.ir_length
+        await self.lower.compare_ir(data, tdo, mask,
+            prefix=self._ir_prefix, suffix=self._ir_suffix)
+
     async def exchange_dr(self, data):
         return await self.lower.exchange_dr(data,
             prefix=self._dr_prefix, suffix=self._dr_suffix)
@@ -970,6 +1218,13 @@ class TAPInterface:
         await self.lower.write_dr(data,
             prefix=self._dr_prefix, suffix=self._dr_suffix)
 
+    async def compare_dr(self, data, tdo, mask=None):
+        await self.lower.compare_dr(data, tdo, mask,
+            prefix=self._dr_prefix, suffix=self._dr_suffix)
+
+    async def get_compare(self):
+        return await self.lower.get_compare()
+
     async def scan_dr(self, *, check=True, max_length=None):
         if max_length is not None:
             max_length = self._dr_prefix + max_length + self._dr_suffix
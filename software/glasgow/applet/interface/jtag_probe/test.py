@@ -1,8 +1,15 @@
+import struct
+import asyncio
 import unittest
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFOBuffered
 
 from ....support.bits import *
+from ....gateware import simulation_test
 from ... import *
-from . import JTAGProbeApplet, JTAGProbeInterface, JTAGProbeError
+from . import JTAGProbeApplet, JTAGProbeInterface, JTAGProbeError, TAPInterface, JTAGProbeDriver
+from . import CMD_MASK, CMD_SHIFT_TMS, CMD_SHIFT_TDIO, CMD_GET_CMP
+from . import BIT_DATA_IN, BIT_DATA_OUT, BIT_LAST, BIT_COMPARE
 
 
 class JTAGInterrogationTestCase(unittest.TestCase):
@@ -125,6 +132,220 @@ class JTAGInterrogationTestCase(unittest.TestCase):
                          [3, 5])
 
 
+class _EchoInterface:
+    # Returns the TDI data of every shift command as TDO data, like a chain of 0-length registers.
+    def __init__(self):
+        self.commands = bytearray()
+        self.reads    = []
+        self.tdo      = bytearray()
+        self.cmp      = [0, None] # bits compared, offset of first mismatch
+
+    async def write(self, data):
+        self.commands += bytes(data)
+        while self.commands:
+            cmd = self.commands[0]
+            if cmd & CMD_MASK == CMD_GET_CMP:
+                count, offset = self.cmp
+                self.tdo += struct.pack("<BL", offset is not None, offset or 0)
+                self.cmp = [0, None]
+                del self.commands[:1]
+                continue
+            if cmd & CMD_MASK not in (CMD_SHIFT_TMS, CMD_SHIFT_TDIO) or len(self.commands) < 3:
+                break
+            count, = struct.unpack("<H", self.commands[1:3])
+            compare = cmd & CMD_MASK == CMD_SHIFT_TDIO and cmd & BIT_COMPARE
+            length = (count + 7) // 8 if cmd & BIT_DATA_OUT else 0
+            length *= 3 if compare else 1
+            if len(self.commands) < 3 + length:
+                break
+            tdi = self.commands[3:3 + length:3 if compare else 1]
+            if cmd & CMD_MASK == CMD_SHIFT_TDIO and cmd & BIT_DATA_IN:
+                self.tdo += tdi if length else b"\xff" * ((count + 7) // 8)
+            if compare:
+                tdo, expected, mask = (bits(self.commands[3 + n:3 + length:3], count)
+                                       for n in range(3))
+                diff = (tdo ^ expected) & mask
+                if self.cmp[1] is None and diff.to_int():
+                    self.cmp[1] = self.cmp[0] + diff.index(1)
+                self.cmp[0] += count
+            del self.commands[:3 + length]
+
+    async def read(self, length):
+        self.reads.append(length)
+        data, self.tdo = self.tdo[:length], self.tdo[length:]
+        assert len(data) == length
+        return data
+
+    async def flush(self):
+        pass
+
+
+class JTAGBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lower = _EchoInterface()
+        self.iface = JTAGProbeInterface(interface=self.lower, logger=JTAGProbeApplet.logger)
+
+    def run_async(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def test_immediate(self):
+        async def case():
+            await self.iface.test_reset()
+            self.assertEqual(await self.iface.exchange_dr(bits("1100101")), bits("1100101"))
+            self.assertEqual(self.lower.reads, [1])
+        self.run_async(case())
+
+    def test_chunked(self):
+        async def case():
+            await self.iface.test_reset()
+            data = bits("10" * 0x10000)
+            self.assertEqual(await self.iface.exchange_dr(data), data)
+            # Three shift commands (0xffff, 0xffff, and 2 bits long), read back at once.
+            self.assertEqual(self.lower.reads, [0x2000 + 0x2000 + 1])
+        self.run_async(case())
+
+    def test_batch(self):
+        async def case():
+            await self.iface.test_reset()
+            tap_iface = TAPInterface(self.iface, ir_length=4)
+            async with tap_iface.batch():
+                ir = await tap_iface.exchange_ir(bits("0101"))
+                dr = [await tap_iface.exchange_dr(bits(f"{n:09b}")) for n in range(100)]
+                empty = await tap_iface.exchange_dr(bits())
+                self.assertFalse(ir.done())
+                self.assertEqual(self.lower.reads, [])
+            self.assertEqual(self.lower.reads, [1 + 100 * 2])
+            self.assertEqual(ir.result(), bits("0101"))
+            self.assertEqual([data.result() for data in dr], [bits(f"{n:09b}") for n in range(100)])
+            self.assertEqual(empty.result(), bits())
+        self.run_async(case())
+
+    def test_compare(self):
+        async def case():
+            await self.iface.test_reset()
+            tap_iface = TAPInterface(self.iface, ir_length=4, dr_prefix=1)
+            async with tap_iface.batch():
+                await tap_iface.compare_ir(bits("0101"), bits("0111"), bits("1101"))
+                await tap_iface.compare_dr(bits("1" * 20), bits("1" * 20))
+                first = await tap_iface.get_compare()
+                await tap_iface.compare_dr(bits("1" * 20), bits("1" * 19 + "0"))
+                second = await tap_iface.get_compare()
+            self.assertEqual(len(self.lower.reads), 1)
+            self.assertEqual(first.result(), None)
+            self.assertEqual(second.result(), 0)
+            self.assertEqual(await tap_iface.get_compare(), None)
+        self.run_async(case())
+
+    def test_batch_scan(self):
+        async def case():
+            await self.iface.test_reset()
+            async with self.iface.batch():
+                dr = await self.iface.exchange_dr(bits("101"))
+                # Scanning needs its results immediately, and reads back queued data too.
+                self.assertEqual(await self.iface.scan_dr(check=False), bits())
+                self.assertEqual(dr.result(), bits("101"))
+        self.run_async(case())
+
+
+class _LoopbackAdapter(Elaboratable):
+    # Returns the TDI bit of every clock cycle as TDO.
+    def __init__(self):
+        self.stb   = Signal()
+        self.rdy   = Signal()
+        self.tms   = Signal()
+        self.tdo   = Signal()
+        self.tdi   = Signal()
+        self.aux_i = C(0)
+        self.aux_o = Signal(2)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.comb += self.rdy.eq(~self.stb)
+        with m.If(self.stb):
+            m.d.sync += self.tdo.eq(self.tdi)
+        return m
+
+
+class JTAGProbeDriverTestbench(Elaboratable):
+    def __init__(self):
+        self.out_fifo = SyncFIFOBuffered(width=8, depth=64)
+        self.in_fifo  = SyncFIFOBuffered(width=8, depth=64)
+        self.in_fifo.flush = Signal()
+        self.adapter  = _LoopbackAdapter()
+        self.driver   = JTAGProbeDriver(self.adapter, self.out_fifo, self.in_fifo)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.out_fifo = self.out_fifo
+        m.submodules.in_fifo  = self.in_fifo
+        m.submodules.adapter  = self.adapter
+        m.submodules.driver   = self.driver
+        return m
+
+    def write(self, data):
+        for byte in data:
+            yield self.out_fifo.w_data.eq(byte)
+            yield self.out_fifo.w_en.eq(1)
+            yield
+            while not (yield self.out_fifo.w_rdy):
+                yield
+        yield self.out_fifo.w_en.eq(0)
+
+    def read(self, count, limit=1000):
+        data = []
+        yield self.in_fifo.r_en.eq(1)
+        while len(data) < count and limit > 0:
+            yield
+            if (yield self.in_fifo.r_rdy):
+                data.append((yield self.in_fifo.r_data))
+            limit -= 1
+        yield self.in_fifo.r_en.eq(0)
+        return bytes(data)
+
+
+class JTAGProbeDriverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tb = JTAGProbeDriverTestbench()
+
+    def shift_compare(self, tdi, tdo, mask):
+        yield from self.tb.write(struct.pack("<BH",
+            CMD_SHIFT_TDIO|BIT_DATA_OUT|BIT_COMPARE|BIT_LAST, len(tdi)))
+        data = bytearray(3 * len(bytes(tdi)))
+        data[0::3], data[1::3], data[2::3] = bytes(tdi), bytes(tdo), bytes(mask)
+        yield from self.tb.write(data)
+
+    def get_compare(self):
+        yield from self.tb.write([CMD_GET_CMP])
+        return JTAGProbeInterface._decode_compare(bits((yield from self.tb.read(5)), 40))
+
+    @simulation_test
+    def test_compare(self, tb):
+        tdi = bits("110010100101")
+        yield from self.shift_compare(tdi, tdi, bits("111111111111"))
+        self.assertEqual((yield from self.get_compare()), None)
+
+        # Mismatches at bits 3 (masked) and 10, then 1 (in a subsequent command).
+        yield from self.shift_compare(tdi, tdi ^ bits("010000001000"), bits("111111110111"))
+        yield from self.shift_compare(tdi, tdi ^ bits("000000000010"), bits("111111111111"))
+        self.assertEqual((yield from self.get_compare()), 10)
+        self.assertEqual((yield from self.get_compare()), None)
+
+        yield from self.shift_compare(tdi, tdi ^ bits("000000000010"), bits("111111111111"))
+        self.assertEqual((yield from self.get_compare()), 1)
+
+    @simulation_test
+    def test_shift_without_compare(self, tb):
+        tdi = bits("110010100101")
+        yield from self.tb.write(struct.pack("<BH",
+            CMD_SHIFT_TDIO|BIT_DATA_OUT|BIT_DATA_IN|BIT_LAST, len(tdi)))
+        yield from self.tb.write(bytes(tdi))
+        self.assertEqual(bits((yield from self.tb.read(2)), len(tdi)), tdi)
+
+        # Shifts without BIT_COMPARE are not counted towards the mismatch offset.
+        yield from self.shift_compare(tdi, tdi ^ bits("000000000010"), bits("111111111111"))
+        self.assertEqual((yield from self.get_compare()), 1)
+
+
 class JTAGProbeAppletTestCase(GlasgowAppletTestCase, applet=JTAGProbeApplet):
     @synthesis_test
     def test_build(self):
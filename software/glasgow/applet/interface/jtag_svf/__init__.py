@@ -3,13 +3,23 @@
 # Ref: http://www.jtagtest.com/pdf/svf_specification.pdf
 # Accession: G00023
 
+import os
+import sys
+import mmap
+import time
+import bisect
 import struct
+import asyncio
+import hashlib
 import logging
+import functools
 import argparse
+import tempfile
 
 from ....arch.jtag import *
 from ....support.bits import *
 from ....support.logging import *
+from ....support.json_cache import cache_path
 from ....protocol.jtag_svf import *
 from ... import *
 from ..jtag_probe import JTAGState, JTAGProbeApplet, JTAGProbeStateTransitionError
@@ -43,12 +53,108 @@ class SVFOperation:
                             self.mask  + other.mask)
 
 
+@functools.lru_cache(maxsize=None)
+def _parser_fingerprint():
+    # A compiled program depends on the parser as much as on the SVF file, and a change to
+    # the parser does not necessarily change `SVFProgram.VERSION`; the parser is small, so its
+    # source is simply hashed.
+    with open(sys.modules[SVFProgram.__module__].__file__, "rb") as file:
+        return hashlib.blake2s(file.read()).digest()
+
+
+class SVFProgramCache:
+    """
+    Cache of compiled SVF programs.
+
+    Each program is stored in a file named after the blake2s hash of the SVF file it was compiled
+    from and of the parser that compiled it, so that playing the same file again does not need to
+    parse it. Only the ``max_entries`` most recently used programs are kept. A program that cannot
+    be loaded (e.g. because it is corrupted) is treated as absent.
+    """
+
+    DEFAULT_MAX_ENTRIES = 16
+
+    def __init__(self, path=None, *, max_entries=DEFAULT_MAX_ENTRIES, logger=None):
+        if path is None:
+            path = cache_path() / "svf"
+        self.path        = path
+        self.max_entries = max_entries
+        self._logger     = logger or logging.getLogger(__name__)
+
+    @staticmethod
+    def key(svf_data):
+        hasher = hashlib.blake2s()
+        hasher.update(struct.pack("<H", SVFProgram.VERSION))
+        hasher.update(_parser_fingerprint())
+        hasher.update(svf_data)
+        return hasher.hexdigest()
+
+    def get(self, key):
+        filename = self.path / key
+        try:
+            with filename.open("rb") as file:
+                program = SVFProgram.from_bytes(file.read())
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            self._logger.debug("ignoring cached SVF program %s: %s", key, error)
+            return None
+        return program
+
+    def put(self, key, program):
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            fd, temp_filename = tempfile.mkstemp(dir=self.path, prefix=f".{key}.")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(program.to_bytes())
+                os.replace(temp_filename, self.path / key)
+            except:
+                os.unlink(temp_filename)
+                raise
+            self._evict()
+        except OSError as error:
+            self._logger.warning("cannot cache compiled SVF program: %s", error)
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.startswith(".") and entry.is_file():
+                entries.append((entry.stat().st_mtime, entry.path))
+        for _, filename in sorted(entries, reverse=True)[self.max_entries:]:
+            os.unlink(filename)
+
+
 class SVFInterface(SVFEventHandler):
-    def __init__(self, interface, logger, frequency):
+    """
+    SVF player.
+
+    TDO is verified by the probe itself (see :meth:`JTAGProbeInterface.shift_tdi_compare`), so
+    scans never wait for TDO data to be read back. When :meth:`play` is used, the whole program
+    is sent to the probe as one stream. If ``check_interval`` is zero, the result of each
+    comparison is checked before the next command is sent. Otherwise, the result of the
+    comparisons is retrieved every ``check_interval`` compared bits and checked in the background
+    while the following commands are being sent; a mismatch is reported with the line of the first
+    command that failed, but several commands after it may have been executed by then. In either
+    case, the comparisons are always checked before a RUNTEST command, since it usually waits for
+    the device to carry out an operation (e.g. erasing or programming) that the preceding
+    commands have set up.
+    """
+
+    DEFAULT_CHECK_INTERVAL = 0
+
+    def __init__(self, interface, logger, frequency, *, check_interval=DEFAULT_CHECK_INTERVAL):
         self.lower   = interface
         self._logger = logger
         self._level  = logging.DEBUG if self._logger.name == __name__ else logging.TRACE
         self._frequency = frequency
+        self._check_interval = check_interval
+
+        self._line       = None
+        self._compared   = 0  # bits compared since the last checkpoint
+        self._compares   = [] # (first bit, line, command, op) of each compare since then
+        self._check_task = None
 
         self._endir  = "IDLE"
         self._enddr  = "IDLE"
@@ -213,29 +319,67 @@ class SVFInterface(SVFEventHandler):
     async def svf_tdr(self, tdi, smask, tdo, mask):
         self._tdr = SVFOperation(tdi, smask, tdo, mask)
 
+    async def _shift(self, command, op):
+        if op.tdo is None:
+            await self.lower.shift_tdi(op.tdi)
+            return
+        await self.lower.shift_tdi_compare(op.tdi, op.tdo, op.mask)
+        self._compares.append((self._compared, self._line, command, op))
+        self._compared += len(op.tdi)
+        if self._check_interval == 0:
+            await self._finish_checks()
+        elif self._compared >= self._check_interval:
+            await self._checkpoint()
+
+    async def _checkpoint(self):
+        if not self._compares:
+            return
+        cmp_result = await self.lower.get_compare()
+        compares, self._compares, self._compared = self._compares, [], 0
+        prev_task = self._check_task
+        if prev_task is not None and prev_task.done():
+            prev_task.result() # re-raise a mismatch as soon as it is known
+            prev_task = None
+        self._check_task = asyncio.ensure_future(self._check(prev_task, cmp_result, compares))
+
+    async def _check(self, prev_task, cmp_result, compares):
+        # Checks are chained, so that only one of them reads from the probe at any time.
+        if prev_task is not None:
+            await prev_task
+        if isinstance(cmp_result, asyncio.Future):
+            if not cmp_result.done():
+                await self.lower.sync()
+            cmp_result = cmp_result.result()
+        if cmp_result is None:
+            return
+        index = bisect.bisect_right([first for first, *_ in compares], cmp_result) - 1
+        first, line, command, op = compares[index]
+        where = "" if line is None else f" at line {line}"
+        raise SVFError("%s command%s failed: TDO bit %d does not match <%s> & <%s>"
+                       % (command, where, cmp_result - first,
+                          dump_bin(op.tdo), dump_bin(op.mask)))
+
+    async def _finish_checks(self):
+        await self._checkpoint()
+        if self._check_task is not None:
+            check_task, self._check_task = self._check_task, None
+            await check_task
+
     async def svf_sir(self, tdi, smask, tdo, mask):
         op = self._hir + SVFOperation(tdi, smask, tdo, mask) + self._tir
         await self.lower.enter_shift_ir()
-        if op.tdo is None:
-            await self.lower.shift_tdi(op.tdi)
-        else:
-            tdo = await self.lower.shift_tdio(op.tdi)
-            if tdo & op.mask != op.tdo & op.mask:
-                raise SVFError("SIR command failed: TDO <%s> & <%s> != <%s>"
-                               % (dump_bin(tdo), dump_bin(op.mask), dump_bin(op.tdo)))
+        await self._shift("SIR", op)
         await self._enter_state(self._endir)
+        if self._line is None:
+            await self._finish_checks()
 
     async def svf_sdr(self, tdi, smask, tdo, mask):
         op = self._hdr + SVFOperation(tdi, smask, tdo, mask) + self._tdr
         await self.lower.enter_shift_dr()
-        if op.tdo is None:
-            await self.lower.shift_tdi(op.tdi)
-        else:
-            tdo = await self.lower.shift_tdio(op.tdi)
-            if tdo & op.mask != op.tdo & op.mask:
-                raise SVFError("SDR command failed: TDO <%s> & <%s> != <%s>"
-                               % (dump_bin(tdo), dump_bin(op.mask), dump_bin(op.tdo)))
+        await self._shift("SDR", op)
         await self._enter_state(self._enddr)
+        if self._line is None:
+            await self._finish_checks()
 
     async def svf_runtest(self, run_state, run_count, run_clock, min_time, max_time, end_state):
         if run_clock != "TCK":
@@ -246,6 +390,8 @@ class SVFInterface(SVFEventHandler):
             self._logger.warning("RUNTEST exceeds maximum time: %d cycles (%.3f s) > %.3f s"
                                  % (run_count, run_count / self._frequency, max_time))
 
+        if self._compares:
+            await self._finish_checks()
         await self._enter_state(run_state)
         await self.lower.pulse_tck(run_count)
         await self._enter_state(end_state)
@@ -256,6 +402,29 @@ class SVFInterface(SVFEventHandler):
     async def svf_pio(self, vector):
         raise SVFError("the PIO command is not supported")
 
+    async def play(self, program):
+        """
+        Play the compiled SVF ``program`` (an :class:`SVFProgram`) as a single stream, and
+        return once all of its commands have been executed and verified.
+        """
+        log_commands = self._logger.isEnabledFor(self._level)
+        async with self.lower.batch():
+            try:
+                for line, name, kwargs in program:
+                    self._line = line
+                    if log_commands:
+                        self._log("line %d: %s", line, name[4:].upper())
+                    await getattr(self, name)(**kwargs)
+                await self._finish_checks()
+            finally:
+                self._line = None
+                if self._check_task is not None:
+                    if not self._check_task.cancel():
+                        # Already failed; the error being raised takes precedence.
+                        self._check_task.exception()
+                    self._check_task = None
+                self._compares, self._compared = [], 0
+
 
 class JTAGSVFApplet(JTAGProbeApplet):
     logger = logging.getLogger(__name__)
@@ -269,26 +438,78 @@ class JTAGSVFApplet(JTAGProbeApplet):
         * The SCK clock in RUNTEST is not supported.
 
     If any commands requiring these features are encountered, the applet terminates itself.
+
+    The test vector is parsed in full before it is played, and the parsed test vector is cached,
+    so that playing the same file again starts immediately. TDO is verified by the probe while
+    the test vector is playing; if it does not match, the line of the failing command is reported.
+
+    By default, the result of each TDO comparison is retrieved before the next command is sent,
+    which costs a round trip per comparison. With `--check-interval`, the results are instead
+    retrieved after the given number of compared bits, while the following commands are being
+    sent; this is much faster for test vectors that compare TDO often, but when a comparison
+    fails, the commands following it (up to the next RUNTEST command, or up to the given number
+    of compared bits) will have been executed by the time the failure is reported. Do not use
+    `--check-interval` with test vectors whose later commands could harm the device if an earlier
+    comparison failed, e.g. ones that program a device after checking its IDCODE without an
+    intervening RUNTEST.
     """
 
+    @classmethod
+    def add_run_arguments(cls, parser, access):
+        super().add_run_arguments(parser, access)
+
+        parser.add_argument(
+            "--check-interval", metavar="BITS", type=int,
+            default=SVFInterface.DEFAULT_CHECK_INTERVAL,
+            help="check TDO comparisons in the background every BITS compared bits, or before "
+                 "the next command if 0 (default: %(default)s)")
+
     async def run(self, device, args):
+        if args.check_interval < 0:
+            raise SVFError("check interval must not be negative")
         jtag_iface = await self.run_lower(JTAGSVFApplet, device, args)
-        return SVFInterface(jtag_iface, self.logger, args.frequency * 1000)
+        return SVFInterface(jtag_iface, self.logger, args.frequency * 1000,
+                            check_interval=args.check_interval)
 
     @classmethod
     def add_interact_arguments(cls, parser):
         parser.add_argument(
-            "svf_file", metavar="SVF-FILE", type=argparse.FileType("r"),
+            "--no-cache", dest="cache", default=True, action="store_false",
+            help="always parse SVF-FILE, and do not cache the compiled test vector")
+        parser.add_argument(
+            "svf_file", metavar="SVF-FILE", type=argparse.FileType("rb"),
             help="test vector to play")
 
     async def interact(self, device, args, svf_iface):
-        svf_parser = SVFParser(args.svf_file.read(), svf_iface)
-        while True:
-            coro = svf_parser.parse_command()
-            if not coro: break
-
-            for line in svf_parser.last_command().split("\n"):
-                line = line.strip()
-                if line: svf_iface._log(line)
-
-            await coro
+        try:
+            # Large test vectors are lexed directly from the page cache.
+            svf_data = mmap.mmap(args.svf_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Not a regular file (e.g. a pipe), or an empty file.
+            svf_data = args.svf_file.read()
+        try:
+            program = None
+            if args.cache:
+                cache = SVFProgramCache(logger=self.logger)
+                cache_key = cache.key(svf_data)
+                program = cache.get(cache_key)
+                if program is not None:
+                    self.logger.info("using cached compiled test vector")
+            if program is None:
+                started = time.perf_counter()
+                try:
+                    program = SVFProgram.compile(svf_data)
+                except SVFParsingError as error:
+                    raise SVFError(str(error))
+                self.logger.info("parsed %d commands in %.3f s",
+                                 len(program), time.perf_counter() - started)
+                if args.cache:
+                    cache.put(cache_key, program)
+        finally:
+            if isinstance(svf_data, mmap.mmap):
+                svf_data.close()
+
+        started = time.perf_counter()
+        await svf_iface.play(program)
+        self.logger.info("played %d commands in %.3f s",
+                         len(program), time.perf_counter() - started)
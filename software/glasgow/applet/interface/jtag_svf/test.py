@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import tempfile
+import unittest
+import pathlib
+from unittest import mock
+
+from ....protocol.jtag_svf import SVFProgram
+from ... import *
+from ..jtag_probe import JTAGProbeInterface
+from ..jtag_probe.test import _EchoInterface
+from . import JTAGSVFApplet, SVFInterface, SVFProgramCache, SVFError
+
+
+class SVFPlayerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lower = _EchoInterface()
+        self.iface = SVFInterface(
+            JTAGProbeInterface(interface=self.lower, logger=JTAGSVFApplet.logger),
+            JTAGSVFApplet.logger, frequency=1e6, check_interval=16)
+
+    def play(self, source):
+        program = SVFProgram.compile(source)
+        asyncio.get_event_loop().run_until_complete(self.iface.play(program))
+
+    def test_pass(self):
+        self.play("STATE RESET;\n" + "SDR 12 TDI (abc) TDO (abc);\n" * 4 + "SIR 4 TDI (5);\n")
+        # Two checkpoints (after 24 bits, after 48 bits), each returning 5 bytes; the check of
+        # the first one runs in the background, and picks up the result of the second one too.
+        self.assertEqual(self.lower.reads, [10])
+
+    def test_fail(self):
+        with self.assertRaisesRegex(SVFError,
+                r"^SDR command at line 4 failed: TDO bit 0 does not match "
+                r"<101111010101> & <111111111111>$"):
+            self.play("STATE RESET;\n"
+                      "SDR 12 TDI (abc) TDO (abc);\n"
+                      "SIR 4 TDI (5) TDO (0) MASK (0);\n"
+                      "SDR 12 TDI (abc) TDO (abd);\n"
+                      "SDR 12 TDI (abc) TDO (abc);\n")
+
+    def test_fail_masked(self):
+        self.play("STATE RESET;\n"
+                  "SDR 12 TDI (abc) TDO (abd) MASK (ff0);\n")
+
+    def test_check_each(self):
+        self.iface = SVFInterface(
+            JTAGProbeInterface(interface=self.lower, logger=JTAGSVFApplet.logger),
+            JTAGSVFApplet.logger, frequency=1e6, check_interval=0)
+        self.play("STATE RESET;\n" + "SDR 12 TDI (abc) TDO (abc);\n" * 2)
+        self.assertEqual(self.lower.reads, [5, 5])
+        with self.assertRaisesRegex(SVFError, r"^SDR command at line 2 failed"):
+            self.play("STATE RESET;\n"
+                      "SDR 12 TDI (abc) TDO (abd);\n"
+                      "SDR 12 TDI (abc) TDO (abc);\n")
+        # The command after the failed one was never sent.
+        self.assertEqual(self.lower.cmp, [0, None])
+
+    def test_check_before_runtest(self):
+        self.play("STATE RESET;\n"
+                  "SDR 12 TDI (abc) TDO (abc);\n"
+                  "RUNTEST 10 TCK;\n"
+                  "SDR 12 TDI (abc) TDO (abc);\n")
+        self.assertEqual(self.lower.reads, [5, 5])
+        with self.assertRaisesRegex(SVFError, r"^SDR command at line 2 failed"):
+            self.play("STATE RESET;\n"
+                      "SDR 12 TDI (abc) TDO (abd);\n"
+                      "RUNTEST 10 TCK;\n"
+                      "SDR 12 TDI (abc) TDO (abc);\n")
+        self.assertEqual(self.lower.cmp, [0, None])
+
+
+class SVFProgramCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = SVFProgramCache(pathlib.Path(self.tempdir.name), max_entries=2,
+                                     logger=logging.getLogger(__name__))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_get_put(self):
+        program = SVFProgram.compile("SIR 4 TDI (5);")
+        key = self.cache.key(b"SIR 4 TDI (5);")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, program)
+        self.assertEqual(self.cache.get(key).commands, program.commands)
+
+    def test_key(self):
+        key = self.cache.key(b"SIR 4 TDI (5);")
+        self.assertNotEqual(self.cache.key(b"SIR 4 TDI (6);"), key)
+        with mock.patch.object(SVFProgram, "VERSION", SVFProgram.VERSION + 1):
+            self.assertNotEqual(self.cache.key(b"SIR 4 TDI (5);"), key)
+        with mock.patch(f"{SVFProgramCache.__module__}._parser_fingerprint",
+                        return_value=b"\x00" * 32):
+            self.assertNotEqual(self.cache.key(b"SIR 4 TDI (5);"), key)
+
+    def test_corrupted(self):
+        key = self.cache.key(b"")
+        (self.cache.path / key).write_bytes(b"garbage")
+        self.assertIsNone(self.cache.get(key))
+
+    def test_evict(self):
+        program = SVFProgram()
+        for key in ("a", "b", "c"):
+            self.cache.put(key, program)
+        self.assertEqual(len(list(self.cache.path.iterdir())), 2)
+
+
+class JTAGSVFAppletTestCase(GlasgowAppletTestCase, applet=JTAGSVFApplet):
+    @synthesis_test
+    def test_build(self):
+        self.assertBuilds()
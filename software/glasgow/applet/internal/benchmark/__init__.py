@@ -178,8 +178,9 @@ class BenchmarkApplet(GlasgowApplet):
                 length = len(golden)
                 counter_fut.cancel()
 
-                error = bool(await device.read_register(self.__addr_error))
-                count = await device.read_register(self.__addr_count, width=4)
+                error, count = await device.read_registers(
+                    [self.__addr_error, (self.__addr_count, 4)])
+                error = bool(error)
 
             if mode == "loopback":
                 await device.write_register(self.__addr_mode, Mode.LOOPBACK.value)
@@ -418,14 +418,20 @@ class XC95xxXLInterface:
             # Use FVFY just to set the address counter.
             await self._dr_isconfiguration(CTRL_START, 0)
             await self.lower.write_ir(IR_FVFYI)
-            for row in range(BS_ROWS):
-                for col in range(BS_COLS):
-                    await self.lower.run_test_idle(1)
-                    last = row == BS_ROWS - 1 and col == BS_COLS - 1
-                    res = await self._dr_isdata(CTRL_OK if last else CTRL_START)
-                    if res.control != CTRL_OK:
-                        raise XC9500XLError(f"fast read failed {res.bits_repr()} at ({row}, {col})")
-                    bs.put_word(row, col, res.data)
+            # Queue all of the reads, and check the results once they have all been read back.
+            words = []
+            async with self.lower.batch():
+                for row in range(BS_ROWS):
+                    for col in range(BS_COLS):
+                        await self.lower.run_test_idle(1)
+                        last = row == BS_ROWS - 1 and col == BS_COLS - 1
+                        isdata = self.DR_ISDATA(control=CTRL_OK if last else CTRL_START, data=0)
+                        words.append((row, col, await self.lower.exchange_dr(isdata.to_bits())))
+            for row, col, isdata_bits in words:
+                res = self.DR_ISDATA.from_bits(isdata_bits.result())
+                if res.control != CTRL_OK:
+                    raise XC9500XLError(f"fast read failed {res.bits_repr()} at ({row}, {col})")
+                bs.put_word(row, col, res.data)
         else:
             # Use FVFY for all reads.
             prev_row = prev_col = None
@@ -6,7 +6,11 @@ import logging
 import argparse
 import textwrap
 import re
+import io
+import time
+import shlex
 import asyncio
+import contextlib
 import signal
 import unittest
 import importlib.metadata
@@ -19,11 +23,14 @@ from fx2.format import input_data, diff_data
 from . import __version__
 from .support.logging import *
 from .support.asignal import *
+from .support.daemon import daemon_endpoint, DaemonServer, daemon_run_script, daemon_forward
+from .support.trace_worker import TraceWorker
 from .support.plugin import PluginRequirementsUnmet, PluginLoadError
 from .device import GlasgowDeviceError
 from .device.config import GlasgowConfig
 from .target.toolchain import ToolchainNotFound
-from .target.hardware import GlasgowHardwareTarget
+from .target.hardware import GlasgowHardwareTarget, build_bitstreams
+from .target.cache import BitstreamCache, parse_size
 from .gateware import GatewareBuildError
 from .gateware.analyzer import TraceDecoder
 from .device.hardware import VID_QIHW, PID_GLASGOW, GlasgowHardwareDevice
@@ -91,6 +98,35 @@ def version_info():
     )
 
 
+class LazyArgumentParser(argparse.ArgumentParser):
+    """An argument parser that adds its arguments only once it is used.
+
+    Adding the arguments of an applet requires importing it, which is only done for the applet
+    that is actually selected on the command line.
+    """
+
+    def __init__(self, *args, populate=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._populate = populate
+
+    def _ensure_populated(self):
+        if self._populate is not None:
+            populate, self._populate = self._populate, None
+            populate(self)
+
+    def parse_known_args(self, *args, **kwargs):
+        self._ensure_populated()
+        return super().parse_known_args(*args, **kwargs)
+
+    def format_usage(self):
+        self._ensure_populated()
+        return super().format_usage()
+
+    def format_help(self):
+        self._ensure_populated()
+        return super().format_help()
+
+
 def create_argparser():
     parser = argparse.ArgumentParser(formatter_class=TextHelpFormatter)
 
@@ -126,16 +162,16 @@ def get_argparser():
                 kwargs['prog'] = formatter.format_help().strip()
 
             parsers_class = parser._pop_action_class(kwargs, 'parsers')
-            subparsers = argparse._SubParsersAction(option_strings=[],
-                                                    parser_class=type(container),
-                                                    **kwargs)
+            kwargs.setdefault('parser_class', type(container))
+            subparsers = argparse._SubParsersAction(option_strings=[], **kwargs)
             parser._add_action(subparsers)
         else:
             subparsers = parser.add_subparsers(**kwargs)
         return subparsers
 
     def add_applet_arg(parser, mode, required=False):
-        subparsers = add_subparsers(parser, dest="applet", metavar="APPLET", required=required)
+        subparsers = add_subparsers(parser, dest="applet", metavar="APPLET", required=required,
+                                    parser_class=LazyArgumentParser)
 
         for handle, metadata in GlasgowAppletMetadata.all().items():
             if not metadata.loadable:
@@ -147,65 +183,70 @@ def get_argparser():
                 p_applet.add_argument("help", nargs="?", default=p_applet.format_help())
                 continue
 
-            applet_cls = metadata.applet_cls
-
-            if mode == "test" and applet_cls.tests() is None:
+            if mode == "test" and not metadata.has_tests:
                 continue
-            if mode == "tool" and not hasattr(applet_cls, "tool_cls"):
+            if mode == "tool" and not metadata.has_tool:
                 continue
 
             if mode == "tool":
-                help        = applet_cls.tool_cls.help
-                description = applet_cls.tool_cls.description
+                help        = metadata.tool_synopsis
+                description = metadata.tool_description
             else:
-                help        = applet_cls.help
-                description = applet_cls.description
-            if applet_cls.preview:
+                help        = metadata.synopsis
+                description = metadata.description
+            if metadata.preview:
                 help += " (PREVIEW QUALITY APPLET)"
                 description = "    This applet is PREVIEW QUALITY and may CORRUPT DATA or " \
                               "have missing features. Use at your own risk.\n" + description
-            if applet_cls.required_revision > "A0":
-                help += f" (rev{applet_cls.required_revision}+)"
+            if metadata.required_revision > "A0":
+                help += f" (rev{metadata.required_revision}+)"
                 description += "\n    This applet requires Glasgow rev{} or later." \
-                               .format(applet_cls.required_revision)
-
-            p_applet = subparsers.add_parser(
+                               .format(metadata.required_revision)
+
+            def add_applet_args(p_applet, handle=handle, metadata=metadata):
+                applet_cls = metadata.applet_cls
+
+                if mode == "test":
+                    p_applet.add_argument(
+                        "tests", metavar="TEST", nargs="*",
+                        help="test cases to run")
+
+                if mode in ("build", "interact", "repl", "script", "daemon"):
+                    access_args = DirectArguments(applet_name=handle,
+                                                  default_port="AB",
+                                                  pin_count=16)
+                    if mode in ("interact", "repl", "script", "daemon"):
+                        g_applet_build = p_applet.add_argument_group("build arguments")
+                        applet_cls.add_build_arguments(g_applet_build, access_args)
+                        p_applet.set_defaults(_build_arg_names=[
+                            action.dest for action in g_applet_build._group_actions])
+                        g_applet_run = p_applet.add_argument_group("run arguments")
+                        applet_cls.add_run_arguments(g_applet_run, access_args)
+                        if mode == "interact":
+                            # FIXME: this makes it impossible to add subparsers in applets
+                            # g_applet_interact = p_applet.add_argument_group("interact arguments")
+                            # applet.add_interact_arguments(g_applet_interact)
+                            applet_cls.add_interact_arguments(p_applet)
+                        if mode == "repl":
+                            # FIXME: same as above
+                            applet_cls.add_repl_arguments(p_applet)
+                    if mode == "build":
+                        applet_cls.add_build_arguments(p_applet, access_args)
+                        p_applet.set_defaults(_build_arg_names=[
+                            action.dest for action in p_applet._actions if action.dest != "help"])
+
+                if mode == "tool":
+                    applet_cls.tool_cls.add_arguments(p_applet)
+
+                if mode in ("repl", "script"):
+                    # this will absorb all arguments from the '--' onwards (inclusive), make sure
+                    # it's always last... the '--' item that ends up at the front is removed before
+                    # the list is passed to the repo / script environment
+                    p_applet.add_argument('script_args', nargs=argparse.REMAINDER)
+
+            subparsers.add_parser(
                 handle, help=help, description=description,
-                formatter_class=TextHelpFormatter)
-
-            if mode == "test":
-                p_applet.add_argument(
-                    "tests", metavar="TEST", nargs="*",
-                    help="test cases to run")
-
-            if mode in ("build", "interact", "repl", "script"):
-                access_args = DirectArguments(applet_name=handle,
-                                              default_port="AB",
-                                              pin_count=16)
-                if mode in ("interact", "repl", "script"):
-                    g_applet_build = p_applet.add_argument_group("build arguments")
-                    applet_cls.add_build_arguments(g_applet_build, access_args)
-                    g_applet_run = p_applet.add_argument_group("run arguments")
-                    applet_cls.add_run_arguments(g_applet_run, access_args)
-                    if mode == "interact":
-                        # FIXME: this makes it impossible to add subparsers in applets
-                        # g_applet_interact = p_applet.add_argument_group("interact arguments")
-                        # applet.add_interact_arguments(g_applet_interact)
-                        applet_cls.add_interact_arguments(p_applet)
-                    if mode == "repl":
-                        # FIXME: same as above
-                        applet_cls.add_repl_arguments(p_applet)
-                if mode == "build":
-                    applet_cls.add_build_arguments(p_applet, access_args)
-
-            if mode == "tool":
-                applet_cls.tool_cls.add_arguments(p_applet)
-
-            if mode in ("repl", "script"):
-                # this will absorb all arguments from the '--' onwards (inclusive), make sure it's
-                # always last... the '--' item that ends up at the front is removed before the list
-                # is passed to the repo / script environment
-                p_applet.add_argument('script_args', nargs=argparse.REMAINDER)
+                formatter_class=TextHelpFormatter, populate=add_applet_args)
 
     parser = create_argparser()
 
@@ -313,6 +354,47 @@ def get_argparser():
     add_run_args(p_script)
     add_applet_arg(p_script, mode="script", required=True)
 
+    p_daemon = subparsers.add_parser(
+        "daemon", formatter_class=TextHelpFormatter,
+        help="run an applet and keep it running to serve requests from clients")
+    add_run_args(p_daemon)
+    p_daemon.add_argument(
+        "endpoint", metavar="ENDPOINT", type=daemon_endpoint,
+        help="listen at ENDPOINT, which must be unix:PATH (the socket is only accessible "
+             "to the current user)")
+    add_applet_arg(p_daemon, mode="daemon", required=True)
+
+    p_fleet = subparsers.add_parser(
+        "fleet", formatter_class=TextHelpFormatter,
+        help="run an applet on several devices at once and report the outcome for each")
+    add_build_args(p_fleet)
+    p_fleet.add_argument(
+        "--reload", default=False, action="store_true",
+        help="(advanced) reload bitstream even if an identical one is already loaded")
+    p_fleet.add_argument(
+        "-d", "--device", metavar="SERIAL", dest="fleet_serials", type=serial, action="append",
+        help="run applet on device with serial number SERIAL (may be specified multiple times; "
+             "default: every connected device)")
+    add_applet_arg(p_fleet, mode="interact", required=True)
+
+    p_client = subparsers.add_parser(
+        "client", formatter_class=TextHelpFormatter,
+        help="execute a script or forward the applet pipe using an applet daemon")
+    p_client.add_argument(
+        "endpoint", metavar="ENDPOINT", type=daemon_endpoint,
+        help="connect to the daemon at ENDPOINT, which must be unix:PATH")
+    g_client_request = p_client.add_mutually_exclusive_group(required=True)
+    g_client_request.add_argument(
+        "-f", metavar="FILENAME", dest="script_file", type=argparse.FileType("r"),
+        help="run Python script FILENAME in the applet context")
+    g_client_request.add_argument(
+        "-c", metavar="COMMAND", dest="script_cmd", type=str,
+        help="run Python statement COMMAND in the applet context")
+    g_client_request.add_argument(
+        "--forward", default=False, action="store_true",
+        help="forward standard input and output to and from the applet pipe")
+    p_client.add_argument('script_args', nargs=argparse.REMAINDER)
+
     p_tool = subparsers.add_parser(
         "tool", formatter_class=TextHelpFormatter,
         help="run an offline tool provided with an applet")
@@ -358,7 +440,59 @@ def get_argparser():
     p_build.add_argument(
         "-f", "--filename", metavar="FILENAME", type=str,
         help="file to save artifact to (default: <applet-name>.{zip,il,bin})")
-    add_applet_arg(p_build, mode="build", required=True)
+    p_build.add_argument(
+        "-j", "--jobs", metavar="COUNT", type=int, default=None,
+        help="in batch mode, run up to COUNT builds in parallel (default: number of CPU cores)")
+    g_build_applet = p_build.add_mutually_exclusive_group(required=True)
+    g_build_applet.add_argument(
+        "--batch", metavar="FILENAME", type=argparse.FileType("r"),
+        help="build bitstreams for each applet and its build arguments listed on a line of "
+             "FILENAME, and store them in the bitstream cache")
+    g_build_applet.add_argument(
+        "--all", dest="batch_all", default=False, action="store_true",
+        help="build bitstreams for every applet with default build arguments, and store them "
+             "in the bitstream cache")
+    add_applet_arg(g_build_applet, mode="build")
+
+    def cache_size(arg):
+        try:
+            return parse_size(arg)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    p_cache = subparsers.add_parser(
+        "cache", formatter_class=TextHelpFormatter,
+        help="(advanced) manage the bitstream cache")
+    cache_subparsers = p_cache.add_subparsers(dest="cache_action", metavar="ACTION")
+    cache_subparsers.required = True
+
+    p_cache_list = cache_subparsers.add_parser(
+        "list", formatter_class=TextHelpFormatter,
+        help="list cached bitstreams, most recently used first")
+
+    p_cache_prune = cache_subparsers.add_parser(
+        "prune", formatter_class=TextHelpFormatter,
+        help="remove least recently used bitstreams from the cache")
+    g_cache_prune = p_cache_prune.add_mutually_exclusive_group()
+    g_cache_prune.add_argument(
+        "--max-size", metavar="SIZE", type=cache_size, default=None,
+        help="shrink the cache to at most SIZE bytes; K, M, G suffixes are accepted "
+             "(default: $GLASGOW_BITSTREAM_CACHE_SIZE or 256M)")
+    g_cache_prune.add_argument(
+        "--all", default=False, action="store_true",
+        help="remove all cached bitstreams")
+
+    p_cache_prewarm = cache_subparsers.add_parser(
+        "prewarm", formatter_class=TextHelpFormatter,
+        help="build applet logic and store the bitstream in the cache")
+    add_build_args(p_cache_prewarm)
+    p_cache_prewarm.add_argument(
+        "--rev", metavar="REVISION", type=revision, required=True,
+        help="board revision")
+    p_cache_prewarm.add_argument(
+        "--trace", default=False, action="store_true",
+        help="include applet analyzer")
+    add_applet_arg(p_cache_prewarm, mode="build", required=True)
 
     p_test = subparsers.add_parser(
         "test", formatter_class=TextHelpFormatter,
@@ -429,6 +563,187 @@ def _applet(revision, args):
     return target, applet
 
 
+def _build_plan(target, applet, args):
+    # The values of the build arguments identify the design for the bitstream index; the run
+    # arguments do not affect the design and are excluded so that they do not cause index misses.
+    build_args = {name: getattr(args, name) for name in getattr(args, "_build_arg_names", [])}
+    return target.build_plan(applet=applet, build_args=build_args)
+
+
+def _build_batch(parser, args):
+    common_argv = ["build", "--rev", args.rev]
+    if args.trace:
+        common_argv.append("--trace")
+    if args.override_required_revision:
+        common_argv.append("--override-required-revision")
+
+    if args.batch:
+        with args.batch:
+            batch = [argv for argv in map(lambda line: shlex.split(line, comments=True), args.batch)
+                     if argv]
+    else:
+        batch = []
+        for handle, metadata in GlasgowAppletMetadata.all().items():
+            if not metadata.loadable:
+                continue
+            if metadata.required_revision > args.rev:
+                logger.debug("skipping applet %r, which requires device rev%s+", handle,
+                             metadata.required_revision)
+                continue
+            batch.append([handle])
+
+    failed = []
+    def plans():
+        for argv in batch:
+            name = shlex.join(argv)
+            stderr = io.StringIO()
+            try:
+                with contextlib.redirect_stderr(stderr):
+                    build_args = parser.parse_args([*common_argv, *argv])
+            except SystemExit:
+                # In `--all` mode, applets that have required build arguments are skipped.
+                message = (stderr.getvalue().strip().splitlines() or ["invalid arguments"])[-1]
+                if args.batch_all:
+                    logger.debug("skipping applet %r: %s", name, message)
+                else:
+                    logger.error("cannot build %r: %s", name, message)
+                    failed.append(name)
+                continue
+            try:
+                target, applet = _applet(args.rev, build_args)
+            except SystemExit:
+                failed.append(name)
+                continue
+            except Exception as exn:
+                logger.error("failed to build subtarget for %r: %s", name, exn)
+                failed.append(name)
+                continue
+            yield name, _build_plan(target, applet, build_args)
+
+    started_at = time.perf_counter()
+    results = []
+    for name, plan, result, elaborate_time, build_time in \
+            build_bitstreams(plans(), jobs=args.jobs):
+        if isinstance(result, Exception):
+            logger.error("failed to build %r: %s", name, result)
+            failed.append(name)
+        else:
+            logger.info("%s bitstream ID %s for %r", result, plan.bitstream_id.hex(), name)
+            results.append((name, plan.bitstream_id, result, elaborate_time, build_time))
+    total_time = time.perf_counter() - started_at
+
+    print("Elaborate\tBuild\tResult\tBitstream ID\t\t\t\tApplet")
+    for name, bitstream_id, result, elaborate_time, build_time in \
+            sorted(results, key=lambda result: -result[4]):
+        print(f"{elaborate_time:.1f} s\t{build_time:.1f} s\t{result}\t{bitstream_id.hex()}\t{name}")
+    for name in failed:
+        print(f"\t\tfailed\t\t\t\t\t{name}")
+    logger.info("%d bitstreams built, %d cached, %d failed in %.1f s",
+                sum(result[2] == "built" for result in results),
+                sum(result[2] == "cached" for result in results),
+                len(failed), total_time)
+    return 1 if failed else 0
+
+
+async def _run_fleet(args):
+    devices = GlasgowHardwareDevice.open_many(args.fleet_serials)
+    try:
+        # Each device gets its own applet instance, since applets keep per-device state. Devices
+        # of the same revision build the same design, so they share the build plan (and hence
+        # the bitstream) of the first device of that revision, which is only elaborated once.
+        runs = []
+        plans = {}
+        bitstreams = {}
+        for device in devices:
+            device_args = argparse.Namespace(**vars(args))
+            target, applet = _applet(device.revision, device_args)
+            device.demultiplexer = DirectDemultiplexer(device, target.multiplexer.pipe_count)
+            if device.revision not in plans:
+                plan = plans[device.revision] = _build_plan(target, applet, device_args)
+                try:
+                    bitstreams[plan.bitstream_id] = plan.get_bitstream()
+                except GatewareBuildError as e:
+                    applet.logger.error(e)
+                    return 2
+            runs.append((device, applet, plans[device.revision], device_args))
+
+        async def run_device(device, applet, plan, device_args):
+            started_at = time.perf_counter()
+            load_time = None
+            try:
+                if args.reload or await device.bitstream_id() != plan.bitstream_id:
+                    logger.info("device %s: loading bitstream ID %s",
+                                device.serial, plan.bitstream_id.hex())
+                    await device.download_bitstream(bitstreams[plan.bitstream_id],
+                                                    plan.bitstream_id)
+                load_time = time.perf_counter() - started_at
+                logger.info("device %s: running handler for applet %r",
+                            device.serial, args.applet)
+                iface = await applet.run(device, device_args)
+                result = await applet.interact(device, device_args, iface)
+            except (GlasgowAppletError, GlasgowDeviceError) as e:
+                applet.logger.error("device %s: %s", device.serial, e)
+                result = 1
+            except asyncio.CancelledError:
+                result = 130 # 128 + SIGINT
+            except Exception:
+                logger.exception("device %s: unexpected error", device.serial)
+                result = 1
+            finally:
+                # A failure to flush the data written by the applet is a failure of the device,
+                # and must not prevent the other devices from being reported.
+                try:
+                    await device.demultiplexer.flush()
+                except asyncio.CancelledError:
+                    result = 130 # 128 + SIGINT
+                except GlasgowDeviceError as e:
+                    applet.logger.error("device %s: %s", device.serial, e)
+                    result = 1
+                except Exception:
+                    logger.exception("device %s: unexpected error", device.serial)
+                    result = 1
+                if args.show_statistics:
+                    device.demultiplexer.statistics()
+            return result, load_time, time.perf_counter() - started_at
+
+        if applet.preview:
+            logger.warning("applet %r is PREVIEW QUALITY and may CORRUPT DATA", args.applet)
+        started_at = time.perf_counter()
+        device_tasks = [asyncio.ensure_future(run_device(*run)) for run in runs]
+        sigint_task = asyncio.ensure_future(wait_for_signal(signal.SIGINT))
+        devices_task = asyncio.ensure_future(asyncio.wait(device_tasks))
+        await asyncio.wait([devices_task, sigint_task], return_when=asyncio.FIRST_COMPLETED)
+        if sigint_task.done():
+            logger.debug("Ctrl+C pressed, terminating")
+            for task in device_tasks:
+                task.cancel()
+        else:
+            sigint_task.cancel()
+        await asyncio.wait([devices_task, sigint_task])
+        total_time = time.perf_counter() - started_at
+
+        for device, *_ in runs:
+            await device.demultiplexer.cancel()
+
+        passed = 0
+        print("Result\tLoad\tTotal\tSerial")
+        for (device, *_), task in zip(runs, device_tasks):
+            result, load_time, device_time = task.result()
+            if result in (None, 0):
+                passed += 1
+                outcome = "pass"
+            else:
+                outcome = f"fail ({result})"
+            load_time = "-" if load_time is None else f"{load_time:.1f} s"
+            print(f"{outcome}\t{load_time}\t{device_time:.1f} s\t{device.serial}")
+        logger.info("%d devices passed, %d failed in %.1f s",
+                    passed, len(runs) - passed, total_time)
+        return 0 if passed == len(runs) else 1
+    finally:
+        for device in devices:
+            device.close()
+
+
 class TerminalFormatter(logging.Formatter):
     DEFAULT_COLORS = {
         "TRACE"   : "\033[0m",
@@ -512,12 +827,14 @@ async def main():
     # subsystem).
     term_handler = create_logger()
 
-    args = get_argparser().parse_args()
+    parser = get_argparser()
+    args = parser.parse_args()
     configure_logger(args, term_handler)
 
     device = None
     try:
-        if args.action not in ("build", "test", "tool", "factory", "list"):
+        if args.action not in ("build", "cache", "client", "fleet", "test", "tool", "factory",
+                               "list"):
             device = GlasgowHardwareDevice(args.serial)
 
         if args.action == "voltage":
@@ -564,10 +881,10 @@ async def main():
                 print("{}\t{:.2}\t{:.2}"
                       .format(port, vio, vlimit))
 
-        if args.action in ("run", "repl", "script"):
+        if args.action in ("run", "repl", "script", "daemon"):
             target, applet = _applet(device.revision, args)
             device.demultiplexer = DirectDemultiplexer(device, target.multiplexer.pipe_count)
-            plan = target.build_plan()
+            plan = _build_plan(target, applet, args)
 
             if args.prebuilt or args.bitstream:
                 bitstream_file = args.bitstream or open(f"{args.applet}.bin", "rb")
@@ -582,66 +899,32 @@ async def main():
                 await device.write_register(target.analyzer.addr_done, 0)
                 analyzer_iface = await device.demultiplexer.claim_interface(
                     target.analyzer, target.analyzer.mux_interface, args=None)
-                trace_decoder = TraceDecoder(target.analyzer.event_sources)
                 # Use the coarsest possible timescale to improve performance with sigrok.
                 vcd_writer = VCDWriter(args.trace, timescale="10 ns", check_values=False,
                     comment='Generated by Glasgow for bitstream ID %s'
                             % plan.bitstream_id.hex())
+                trace_worker = TraceWorker(TraceDecoder(target.analyzer.event_sources),
+                    vcd_writer, sys_clk_freq=target.sys_clk_freq, logger=target.analyzer.logger)
 
             async def run_analyzer():
-                signals = {}
-                strobes = set()
-                for field_name, field_trigger, field_width in trace_decoder.events():
-                    if field_trigger == "throttle":
-                        var_type = "wire"
-                        var_init = 0
-                    elif field_trigger == "change":
-                        var_type = "wire"
-                        var_init = "x" * field_width
-                    elif field_trigger == "strobe":
-                        if field_width > 0:
-                            var_type = "tri"
-                            var_init = "z"
-                        else:
-                            var_type = "event"
-                            var_init = ""
-                    else:
-                        assert False
-                    signals[field_name] = vcd_writer.register_var(
-                        scope="", name=field_name, var_type=var_type,
-                        size=field_width, init=var_init)
-                    if field_trigger == "strobe":
-                        strobes.add(field_name)
-
-                init = True
-                while not trace_decoder.is_done():
-                    trace_decoder.process(await analyzer_iface.read())
-                    for cycle, events in trace_decoder.flush():
-                        if events == "overrun":
-                            target.analyzer.logger.error("FIFO overrun, shutting down")
-
-                            for name in signals:
-                                vcd_writer.change(signals[name], next_timestamp, "x")
-                            next_timestamp += 100 # 1us
-                            break
-
-                        event_repr = " ".join(f"{n}={v}"
-                                              for n, v in events.items())
-                        target.analyzer.logger.trace("cycle %d: %s", cycle, event_repr)
-
-                        timestamp      = int(1e8 * (cycle + 0) // target.sys_clk_freq)
-                        next_timestamp = int(1e8 * (cycle + 1) // target.sys_clk_freq)
-                        if init:
-                            init = False
-                            vcd_writer._timestamp = timestamp
-                        for name, value in events.items():
-                            vcd_writer.change(signals[name], timestamp, value)
-                        for name, _value in events.items():
-                            if name in strobes:
-                                vcd_writer.change(signals[name], next_timestamp, "z")
-                        vcd_writer.flush()
-
-                vcd_writer.close(next_timestamp)
+                # Only drain the analyzer FIFO here; the trace is decoded and written by a worker
+                # thread, so that tracing slows down the applet as little as possible.
+                async def drain():
+                    while True:
+                        await trace_worker.put(await analyzer_iface.read())
+
+                drain_task = asyncio.ensure_future(drain())
+                wait_task  = asyncio.ensure_future(trace_worker.wait())
+                try:
+                    await asyncio.wait([drain_task, wait_task],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in (drain_task, wait_task):
+                        task.cancel()
+                    await asyncio.wait([drain_task, wait_task])
+                    await trace_worker.close()
+                if not drain_task.cancelled():
+                    drain_task.result()
 
             async def run_applet():
                 logger.info("running handler for applet %r", args.applet)
@@ -666,6 +949,16 @@ async def main():
                         future = eval(code, {"iface":iface, "device":device, "args":args})
                         if future is not None:
                             await future
+                    elif args.action == "daemon":
+                        def make_globals(script_args):
+                            script_args = argparse.Namespace(**{**vars(args),
+                                                                "script_args": script_args})
+                            return {"iface":iface, "device":device, "args":script_args}
+                        try:
+                            await DaemonServer(logger, args.endpoint, iface=iface,
+                                               make_globals=make_globals).serve()
+                        except OSError as e:
+                            raise GlasgowAppletError(f"cannot start daemon: {e}")
 
                 except GlasgowAppletError as e:
                     applet.logger.error(str(e))
@@ -706,6 +999,47 @@ async def main():
 
             return applet_task.result()
 
+        if args.action == "fleet":
+            if args.serial:
+                logger.error("--serial is not supported for fleet runs; use --device instead")
+                return 1
+            return await _run_fleet(args)
+
+        if args.action == "client":
+            try:
+                if args.forward:
+                    loop = asyncio.get_running_loop()
+                    stdin = asyncio.StreamReader()
+                    try:
+                        await loop.connect_read_pipe(
+                            lambda: asyncio.StreamReaderProtocol(stdin), sys.stdin)
+                    except ValueError: # regular file
+                        stdin.feed_data(sys.stdin.buffer.read())
+                        stdin.feed_eof()
+                    async def write_output(data):
+                        sys.stdout.buffer.write(data)
+                        sys.stdout.buffer.flush()
+                    response = await daemon_forward(args.endpoint,
+                        lambda: stdin.read(65536), write_output)
+                else:
+                    if len(args.script_args) > 0 and args.script_args[0] == "--":
+                        args.script_args = args.script_args[1:]
+                    if args.script_file:
+                        with args.script_file:
+                            code, filename = args.script_file.read(), args.script_file.name
+                    else:
+                        code, filename = args.script_cmd, "<command>"
+                    response = await daemon_run_script(args.endpoint, code,
+                        filename=filename, args=args.script_args)
+                    sys.stdout.write(response.get("output", ""))
+            except OSError as e:
+                logger.error("cannot connect to daemon: %s", e)
+                return 1
+            if response["status"] != "ok":
+                logger.error("daemon request failed: %s", response["error"].rstrip())
+                return 1
+            return 0
+
         if args.action == "tool":
             tool = GlasgowAppletMetadata.get(args.applet).tool_cls()
             try:
@@ -753,9 +1087,9 @@ async def main():
             elif args.applet:
                 logger.info("generating bitstream for applet %s", args.applet)
                 target, applet = _applet(device.revision, args)
-                plan = target.build_plan()
-                new_bitstream_id = plan.bitstream_id
+                plan = _build_plan(target, applet, args)
                 new_bitstream    = plan.get_bitstream()
+                new_bitstream_id = plan.bitstream_id
 
                 # We always build and reflash the bitstream in case the one currently
                 # in EEPROM is corrupted. If we only compared the ID, there would be
@@ -818,9 +1152,15 @@ async def main():
             else:
                 logger.info("configuration and firmware identical")
 
+        if args.action == "build" and args.applet is None:
+            if args.type not in ("bin", "bitstream") or args.filename is not None:
+                logger.error("batch builds only produce bitstreams in the bitstream cache")
+                return 1
+            return _build_batch(parser, args)
+
         if args.action == "build":
             target, applet = _applet(args.rev, args)
-            plan = target.build_plan()
+            plan = _build_plan(target, applet, args)
             if args.type in ("il", "rtlil"):
                 logger.info("generating RTLIL for applet %r", args.applet)
                 with open(args.filename or args.applet + ".il", "w") as f:
@@ -830,9 +1170,33 @@ async def main():
                 plan.archive(args.filename or args.applet + ".zip")
             if args.type in ("bin", "bitstream"):
                 logger.info("generating bitstream for applet %r", args.applet)
+                bitstream = plan.get_bitstream()
                 with open(args.filename or args.applet + ".bin", "wb") as f:
                     f.write(plan.bitstream_id)
-                    f.write(plan.get_bitstream())
+                    f.write(bitstream)
+
+        if args.action == "cache":
+            cache = BitstreamCache()
+            if args.cache_action == "list":
+                entries = cache.entries()
+                print("Bitstream ID\t\t\t\tSize\tLast used\t\tVerified")
+                for bitstream_id, size, last_used, verified in entries:
+                    print("{}\t{}\t{}\t{}".format(
+                        bitstream_id.hex(), size,
+                        datetime.fromtimestamp(last_used).strftime("%Y-%m-%d %H:%M:%S"),
+                        "yes" if verified else "no"))
+                logger.info("%d bitstreams cached in %s, %d of %d bytes used",
+                            len(entries), cache.path, sum(entry[1] for entry in entries),
+                            cache.max_size)
+            if args.cache_action == "prune":
+                evicted = cache.prune(0 if args.all else args.max_size)
+                logger.info("removed %d bitstreams from cache", len(evicted))
+            if args.cache_action == "prewarm":
+                target, applet = _applet(args.rev, args)
+                plan = _build_plan(target, applet, args)
+                logger.info("generating bitstream for applet %r", args.applet)
+                plan.get_bitstream()
+                logger.info("bitstream ID %s is cached", plan.bitstream_id.hex())
 
         if args.action == "test":
             logger.info("testing applet %r", args.applet)
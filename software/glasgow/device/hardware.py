@@ -4,12 +4,15 @@ import struct
 import logging
 import usb1
 import asyncio
+import functools
 import threading
 import importlib.resources
+from collections import deque
 from fx2 import REQ_RAM, REG_CPUCS
 from fx2.format import input_data
 
 from ..support.logging import *
+from ..support.json_cache import JSONCache, cache_path
 from . import GlasgowDeviceError, quirks
 from .config import GlasgowConfig
 
@@ -52,6 +55,17 @@ class _PollerThread(threading.Thread):
         super().__init__()
         self.done    = False
         self.context = context
+        # Number of devices using the context; see `GlasgowHardwareDevice.open_many()`.
+        self.users   = 0
+
+        # Waking up the event loop (which involves writing to its self-pipe) is expensive, so
+        # transfer completions are collected during each `handleEvents()` pass and delivered
+        # to each event loop in a single batch.
+        self._lock    = threading.Lock()
+        self._pending = []
+
+        self.completion_count = 0
+        self.wakeup_count     = 0
 
     def run(self):
         # The poller thread spends most of its life in blocking `handleEvents()` calls and this can
@@ -65,6 +79,50 @@ class _PollerThread(threading.Thread):
         threading._register_atexit(self.stop)
         while not self.done:
             self.context.handleEvents()
+            self._deliver()
+
+    def complete(self, loop, callback, transfer):
+        """
+        Schedule ``callback(transfer)`` to be called on ``loop``.
+
+        Must be called from a libusb transfer callback. The call is deferred until the end of
+        the current ``handleEvents()`` pass.
+        """
+        with self._lock:
+            self._pending.append((loop, callback, transfer))
+
+    def _deliver(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        batches = {}
+        for loop, callback, transfer in pending:
+            batches.setdefault(loop, []).append((callback, transfer))
+        for loop, batch in batches.items():
+            self.completion_count += len(batch)
+            self.wakeup_count     += 1
+            loop.call_soon_threadsafe(self._run_batch, loop, batch)
+
+    @staticmethod
+    def _run_batch(loop, batch):
+        # Each callback would have run as a separate event loop callback without batching, so
+        # an exception in one of them must not prevent the rest of the batch from running.
+        for callback, transfer in batch:
+            try:
+                callback(transfer)
+            except Exception as exc:
+                loop.call_exception_handler({
+                    "message":   "Exception in USB transfer completion callback",
+                    "exception": exc,
+                    "transfer":  transfer,
+                })
+
+    @property
+    def coalesced_count(self):
+        """Count transfer completions that did not require a separate event loop wakeup."""
+        return self.completion_count - self.wakeup_count
 
     def stop(self):
         self.done = True
@@ -72,6 +130,94 @@ class _PollerThread(threading.Thread):
         self.join()
 
 
+class _TransferPool:
+    """
+    A pool of reusable libusb transfers and bulk transfer buffers.
+
+    Allocating a transfer and a buffer for every request takes a significant share of CPU time at
+    high data rates, so both are recycled. Bulk IN data is returned to consumers as ``memoryview``
+    objects over pooled buffers; once a consumer is done with the data, it returns the view to
+    the pool with :meth:`release_buffer`. A released buffer is only reused once no views of it
+    remain, so a consumer that keeps a slice of the data never observes it being overwritten.
+
+    Only buffers returned by :meth:`get_buffer` may be passed to :meth:`put_buffer` or (as views)
+    to :meth:`release_buffer`; see :meth:`_is_referenced` for why.
+    """
+    def __init__(self, usb_handle, max_free=64):
+        self._usb_handle = usb_handle
+        self._max_free   = max_free
+        self._transfers  = []
+        self._buffers    = {}
+        self._released   = deque()
+
+        self.transfers_allocated = 0
+        self.buffers_allocated   = 0
+        self.buffers_reused      = 0
+
+    def get_transfer(self):
+        if self._transfers:
+            return self._transfers.pop()
+        self.transfers_allocated += 1
+        return self._usb_handle.getTransfer()
+
+    def put_transfer(self, transfer):
+        if len(self._transfers) < self._max_free:
+            self._transfers.append(transfer)
+
+    @staticmethod
+    def _is_referenced(buffer):
+        """
+        Check whether any views (``memoryview`` objects, or ctypes arrays created by libusb1) of
+        ``buffer`` exist.
+
+        Python provides no way to query the number of exports of a ``bytearray``, but it refuses
+        to resize one while it has any exports, so this tries to append a byte to the buffer and
+        immediately removes it. This is only cheap and safe because :meth:`get_buffer` resizes
+        every buffer once when allocating it, which gives it spare capacity: appending a byte
+        then never reallocates the storage, and the contents and address of the buffer do not
+        change.
+        """
+        try:
+            buffer.append(0)
+        except BufferError:
+            return True
+        del buffer[-1]
+        return False
+
+    def _reclaim(self):
+        for _ in range(len(self._released)):
+            buffer = self._released.popleft()
+            if self._is_referenced(buffer):
+                self._released.append(buffer)
+            else:
+                free = self._buffers.setdefault(len(buffer), [])
+                if len(free) < self._max_free:
+                    free.append(buffer)
+
+    def get_buffer(self, size):
+        if self._released:
+            self._reclaim()
+        if free := self._buffers.get(size):
+            self.buffers_reused += 1
+            return free.pop()
+        self.buffers_allocated += 1
+        buffer = bytearray(size)
+        # Resize the buffer once to give it spare capacity; `_is_referenced` relies on this.
+        buffer.append(0)
+        del buffer[-1]
+        return buffer
+
+    def put_buffer(self, buffer):
+        self._released.append(buffer)
+        if len(self._released) > self._max_free:
+            # A consumer is holding on to the data; let it keep the buffer.
+            self._released.popleft()
+
+    def release_buffer(self, data):
+        if isinstance(data, memoryview) and isinstance(data.obj, bytearray):
+            self.put_buffer(data.obj)
+
+
 class GlasgowHardwareDevice:
     @classmethod
     def firmware_file(cls):
@@ -82,10 +228,60 @@ class GlasgowHardwareDevice:
         with cls.firmware_file().open() as file:
             return input_data(file, fmt="ihex")
 
+    # Reading the serial number requires opening the device, which is slow (especially with many
+    # devices on the bus) and disturbs devices that are in use by other processes. The location
+    # (bus number and port path) of each device is remembered, so that the device with a requested
+    # serial number can usually be opened directly. Locations change when devices are moved, so
+    # a cached location is only used if the serial number of the device found there matches.
+    _location_cache = JSONCache(cache_path() / "devices.json")
+
+    @staticmethod
+    def _device_location(device):
+        try:
+            return [device.getBusNumber(), *device.getPortNumberList()]
+        except usb1.USBError:
+            return None
+
+    @classmethod
+    def _find_cached_device(cls, usb_context, serial):
+        location = cls._location_cache.load().get(serial)
+        if location is None:
+            return None
+        for device in usb_context.getDeviceIterator(skip_on_error=True):
+            if device.getVendorID() != VID_QIHW or device.getProductID() != PID_GLASGOW:
+                continue
+            if device.getbcdDevice() >> 8 != CUR_API_LEVEL:
+                continue
+            if cls._device_location(device) != location:
+                continue
+            try:
+                handle = device.open()
+                try:
+                    device_serial = handle.getASCIIStringDescriptor(
+                        device.getSerialNumberDescriptor())
+                finally:
+                    handle.close()
+            except usb1.USBError as error:
+                logger.debug("cannot open device at cached location %s: %s",
+                             "/".join(map(str, location)), error)
+                return None
+            if device_serial != serial:
+                logger.debug("device at cached location %s has serial %s instead of %s",
+                             "/".join(map(str, location)), device_serial, serial)
+                return None
+            revision = GlasgowConfig.decode_revision(device.getbcdDevice() & 0xFF)
+            logger.debug("found rev%s device with serial %s at cached location %s",
+                         revision, serial, "/".join(map(str, location)))
+            return revision, device
+        return None
+
     @classmethod
     def _enumerate_devices(cls, usb_context):
         devices = []
         devices_by_serial = {}
+        locations = {}
+        started_at = time.perf_counter()
+        firmware_time = 0.0
 
         def hotplug_callback(usb_context, device, event):
             if event == usb1.HOTPLUG_EVENT_DEVICE_ARRIVED:
@@ -144,11 +340,13 @@ class GlasgowHardwareDevice:
                 if serial not in devices_by_serial:
                     logger.debug("found rev%s device with serial %s", revision, serial)
                     devices_by_serial[serial] = (revision, device)
+                    locations[serial] = cls._device_location(device)
                 handle.close()
                 continue
 
             # If the device has no firmware or the firmware is too old (or, potentially, too new),
             # load the firmware that we know will work.
+            firmware_started_at = time.perf_counter()
             logger.debug("loading firmware from %r to rev%s device",
                          str(cls.firmware_file()), revision)
             handle.controlWrite(usb1.REQUEST_TYPE_VENDOR, REQ_RAM, REG_CPUCS, 0, [1])
@@ -191,6 +389,18 @@ class GlasgowHardwareDevice:
 
                 devices.extend(list(usb_context.getDeviceIterator(skip_on_error=True)))
 
+            firmware_time += time.perf_counter() - firmware_started_at
+
+        if locations:
+            cls._location_cache.update(lambda cache: cache.update(
+                {serial: location for serial, location in locations.items()
+                 if location is not None}))
+
+        elapsed_time = time.perf_counter() - started_at
+        logger.debug("enumerated %d devices in %.3f s (%.3f s scanning, %.3f s loading firmware "
+                     "and waiting for re-enumeration)",
+                     len(devices_by_serial), elapsed_time, elapsed_time - firmware_time,
+                     firmware_time)
         return devices_by_serial
 
     @classmethod
@@ -199,28 +409,84 @@ class GlasgowHardwareDevice:
             devices = cls._enumerate_devices(usb_context)
             return list(devices.keys())
 
-    def __init__(self, serial=None):
-        usb_context = usb1.USBContext()
-        devices = self._enumerate_devices(usb_context)
+    @classmethod
+    def _select_devices(cls, usb_context, serials):
+        # Returns a list of `(revision, usb_device)` for each of `serials`, where `None` selects
+        # the only connected device; if `serials` is `None`, every connected device is selected.
+        devices = None
+        if serials and None not in serials:
+            started_at = time.perf_counter()
+            cached_devices = {}
+            for serial in serials:
+                if (cached_device := cls._find_cached_device(usb_context, serial)) is None:
+                    break
+                cached_devices[serial] = cached_device
+            else:
+                devices = cached_devices
+            logger.debug("looked up devices at cached locations in %.3f s (%s)",
+                         time.perf_counter() - started_at, "hit" if devices else "miss")
+        if devices is None:
+            devices = cls._enumerate_devices(usb_context)
 
         if len(devices) == 0:
             raise GlasgowDeviceError("device not found")
-        elif serial is None:
-            if len(devices) > 1:
-                raise GlasgowDeviceError("found {} devices (serial numbers {}), but a serial "
-                                         "number is not specified"
-                                         .format(len(devices), ", ".join(devices.keys())))
-            self.revision, usb_device = next(iter(devices.values()))
-        else:
-            if serial not in devices:
-                raise GlasgowDeviceError("device with serial number {} not found"
-                                         .format(serial))
-            self.revision, usb_device = devices[serial]
+        elif serials is None:
+            return list(devices.values())
+        selected = []
+        for serial in serials:
+            if serial is None:
+                if len(devices) > 1:
+                    raise GlasgowDeviceError("found {} devices (serial numbers {}), but a serial "
+                                             "number is not specified"
+                                             .format(len(devices), ", ".join(devices.keys())))
+                selected.append(next(iter(devices.values())))
+            else:
+                if serial not in devices:
+                    raise GlasgowDeviceError("device with serial number {} not found"
+                                             .format(serial))
+                selected.append(devices[serial])
+        return selected
+
+    def __init__(self, serial=None):
+        usb_context = usb1.USBContext()
+        (revision, usb_device), = self._select_devices(usb_context, [serial])
+        usb_poller = _PollerThread(usb_context)
+        usb_poller.start()
+        self._open(usb_context, usb_poller, revision, usb_device)
+
+    @classmethod
+    def open_many(cls, serials=None):
+        """Open devices with each of ``serials`` (or every connected device, if ``None``).
 
+        The devices share a single USB context and poller thread, which is released once every
+        device is closed.
+        """
+        usb_context = usb1.USBContext()
+        selected = cls._select_devices(usb_context, serials)
+        usb_poller = _PollerThread(usb_context)
+        usb_poller.start()
+        devices = []
+        try:
+            for revision, usb_device in selected:
+                device = cls.__new__(cls)
+                device._open(usb_context, usb_poller, revision, usb_device)
+                devices.append(device)
+        except:
+            for device in devices:
+                device.close()
+            if not devices:
+                usb_poller.stop()
+                usb_context.close()
+            raise
+        return devices
+
+    def _open(self, usb_context, usb_poller, revision, usb_device):
+        self.revision = revision
         self.usb_context = usb_context
-        self.usb_poller = _PollerThread(self.usb_context)
-        self.usb_poller.start()
+        self.usb_poller = usb_poller
         self.usb_handle = usb_device.open()
+        self._transfer_pool = _TransferPool(self.usb_handle)
+        self._register_shadow = {}
         try:
             self.usb_handle.setAutoDetachKernelDriver(True)
         except usb1.USBErrorNotSupported:
@@ -241,6 +507,7 @@ class GlasgowHardwareDevice:
                         self._serial)
             logger.info("the Glasgow Interface Explorer project is not responsible for "
                         "operation of this device")
+        self.usb_poller.users += 1
 
     @property
     def serial(self):
@@ -252,17 +519,20 @@ class GlasgowHardwareDevice:
 
     def close(self):
         self.usb_handle.close()
-        self.usb_poller.stop()
-        self.usb_context.close()
+        self.usb_poller.users -= 1
+        if self.usb_poller.users == 0:
+            self.usb_poller.stop()
+            self.usb_context.close()
 
-    async def _do_transfer(self, is_read, setup):
+    async def _do_transfer(self, is_read, setup, buffer=None):
         # libusb transfer cancellation is asynchronous, and moreover, it is necessary to wait for
-        # all transfers to finish cancelling before closing the event loop. To do this, use
-        # separate futures for result and cancel.
-        cancel_future = asyncio.Future()
+        # all transfers to finish cancelling before closing the event loop. The transfer (and its
+        # buffer) can only be reused once libusb is done with it, so a separate future, resolved
+        # with the final status of the transfer, is used to wait for that.
         result_future = asyncio.Future()
+        done_future   = asyncio.Future()
 
-        transfer = self.usb_handle.getTransfer()
+        transfer = self._transfer_pool.get_transfer()
         setup(transfer)
 
         def usb_callback(transfer):
@@ -285,11 +555,12 @@ class GlasgowHardwareDevice:
                     endpoint_dir = "OUT"
                 logger.trace("USB: %s EP%d %s (cancelled)",
                              transfer_type, endpoint & 0x7f, endpoint_dir)
-                cancel_future.set_result(None)
             elif result_future.cancelled():
                 pass
             elif status == usb1.TRANSFER_COMPLETED:
-                if is_read:
+                if is_read and buffer is not None:
+                    result_future.set_result(memoryview(buffer)[:transfer.getActualLength()])
+                elif is_read:
                     result_future.set_result(transfer.getBuffer()[:transfer.getActualLength()])
                 else:
                     result_future.set_result(None)
@@ -300,6 +571,7 @@ class GlasgowHardwareDevice:
             else:
                 result_future.set_exception(GlasgowDeviceError(
                     f"transfer error: {usb1.libusb1.libusb_transfer_status(status)}"))
+            done_future.set_result(status)
 
         def handle_usb_error(func):
             try:
@@ -308,17 +580,36 @@ class GlasgowHardwareDevice:
                 raise GlasgowDeviceError("device disconnected") from None
 
         loop = asyncio.get_event_loop()
-        transfer.setCallback(lambda transfer: loop.call_soon_threadsafe(usb_callback, transfer))
-        handle_usb_error(lambda: transfer.submit())
+        transfer.setCallback(lambda transfer:
+            self.usb_poller.complete(loop, usb_callback, transfer))
+        try:
+            handle_usb_error(lambda: transfer.submit())
+        except:
+            self._recycle_transfer(transfer, buffer)
+            raise
         try:
             return await result_future
         finally:
-            if result_future.cancelled():
+            if not done_future.done():
                 try:
                     handle_usb_error(lambda: transfer.cancel())
-                    await cancel_future
                 except usb1.USBErrorNotFound:
-                    pass # already finished, one way or another
+                    pass # already finished, but the completion has not been delivered yet
+            # If the wait is interrupted, the transfer is never reused, since libusb may still
+            # be using it.
+            status = await done_future
+            # The data in the buffer of a completed read now belongs to the caller.
+            self._recycle_transfer(transfer, buffer, keep_buffer=is_read and
+                status == usb1.TRANSFER_COMPLETED and not result_future.cancelled())
+
+    def _recycle_transfer(self, transfer, buffer, *, keep_buffer=False):
+        # Detach the pooled buffer (if any) so that the transfer does not keep it exported, and
+        # return both to the pool.
+        if buffer is not None:
+            transfer.setBuffer(0)
+            if not keep_buffer:
+                self._transfer_pool.put_buffer(buffer)
+        self._transfer_pool.put_transfer(transfer)
 
     async def control_read(self, request_type, request, value, index, length):
         logger.trace("USB: CONTROL IN type=%#04x request=%#04x "
@@ -330,7 +621,7 @@ class GlasgowHardwareDevice:
         return data
 
     async def control_write(self, request_type, request, value, index, data):
-        if not isinstance(data, (bytes, bytearray)):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
             data = bytes(data)
         logger.trace("USB: CONTROL OUT type=%#04x request=%#04x "
                      "value=%#06x index=%#06x data=<%s> (submit)",
@@ -340,17 +631,53 @@ class GlasgowHardwareDevice:
         logger.trace("USB: CONTROL OUT (completed)")
 
     async def bulk_read(self, endpoint, length):
+        """
+        Read at most ``length`` bytes from bulk ``endpoint``.
+
+        Returns a ``memoryview`` over a pooled buffer. Once the data is consumed, the view may be
+        passed to :meth:`release_buffer` to allow the buffer to be reused.
+        """
         logger.trace("USB: BULK EP%d IN length=%d (submit)", endpoint & 0x7f, length)
-        data = await self._do_transfer(is_read=True, setup=lambda transfer:
-            transfer.setBulk(endpoint|usb1.ENDPOINT_IN, length))
+        buffer = self._transfer_pool.get_buffer(length)
+        data = await self._do_transfer(is_read=True, buffer=buffer, setup=lambda transfer:
+            transfer.setBulk(endpoint|usb1.ENDPOINT_IN, buffer))
         logger.trace("USB: BULK EP%d IN data=<%s> (completed)", endpoint & 0x7f, dump_hex(data))
         return data
 
+    def release_buffer(self, data):
+        """
+        Return ``data``, previously returned by :meth:`bulk_read`, to the buffer pool.
+
+        The buffer is not reused until every view of it (including ``data`` itself and any slices
+        of it) has been destroyed.
+        """
+        self._transfer_pool.release_buffer(data)
+
     async def bulk_write(self, endpoint, data):
-        if not isinstance(data, (bytes, bytearray)):
-            data = bytes(data)
+        """
+        Write ``data`` to bulk ``endpoint``.
+
+        ``data`` may be any object supporting the buffer protocol, or a list of such objects that
+        are gathered into a single transfer. The data is copied exactly once, into a pooled transfer
+        buffer, so the caller may modify or resize ``data`` as soon as this method is called.
+        """
+        if not isinstance(data, (list, tuple)) or any(isinstance(c, int) for c in data):
+            data = [data]
+        chunks = []
+        for chunk in data:
+            try:
+                chunks.append(memoryview(chunk).cast("B"))
+            except TypeError:
+                chunks.append(memoryview(bytes(chunk)))
+        length = sum(map(len, chunks))
+        buffer = self._transfer_pool.get_buffer(1 << max(0, length - 1).bit_length())
+        offset = 0
+        for chunk in chunks:
+            buffer[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        data = memoryview(buffer)[:length]
         logger.trace("USB: BULK EP%d OUT data=<%s> (submit)", endpoint & 0x7f, dump_hex(data))
-        await self._do_transfer(is_read=False, setup=lambda transfer:
+        await self._do_transfer(is_read=False, buffer=buffer, setup=lambda transfer:
             transfer.setBulk(endpoint|usb1.ENDPOINT_OUT, data))
         logger.trace("USB: BULK EP%d OUT (completed)", endpoint & 0x7f)
 
@@ -457,15 +784,35 @@ class GlasgowHardwareDevice:
             return None
         return bytes(bitstream_id)
 
+    # Each bitstream chunk is 1 KiB; this is far below the usbfs limit on in-flight requests.
+    _max_bitstream_requests = 8
+
     async def download_bitstream(self, bitstream, bitstream_id=b"\xff" * 16):
         """Download ``bitstream`` with ID ``bitstream_id`` to FPGA."""
+        # Register values do not survive reconfiguration.
+        self.forget_registers()
+        started_at = time.monotonic()
         # Send consecutive chunks of bitstream.
         # Sending 0th chunk resets the FPGA.
-        index = 0
-        while index * 1024 < len(bitstream):
-            await self.control_write(usb1.REQUEST_TYPE_VENDOR, REQ_FPGA_CFG,
-                                     0, index, bitstream[index * 1024:(index + 1) * 1024])
-            index += 1
+        # The firmware requires the chunks to arrive in order. Requests on the control endpoint are
+        # always completed in the order they were submitted, so several chunks are kept in flight
+        # to hide the round trip latency.
+        bitstream = memoryview(bitstream)
+        inflight  = deque()
+        try:
+            for index in range((len(bitstream) + 1023) // 1024):
+                if len(inflight) == self._max_bitstream_requests:
+                    await inflight.popleft()
+                inflight.append(asyncio.ensure_future(
+                    self.control_write(usb1.REQUEST_TYPE_VENDOR, REQ_FPGA_CFG,
+                                       0, index, bitstream[index * 1024:(index + 1) * 1024])))
+            while inflight:
+                await inflight.popleft()
+        finally:
+            for request in inflight:
+                request.cancel()
+            if inflight:
+                await asyncio.wait(inflight)
         # Complete configuration by setting bitstream ID.
         # This starts the FPGA.
         try:
@@ -473,6 +820,9 @@ class GlasgowHardwareDevice:
                                      0, 0, bitstream_id)
         except usb1.USBErrorPipe:
             raise GlasgowDeviceError("FPGA configuration failed")
+        elapsed = time.monotonic() - started_at
+        logger.debug("FPGA configured with %d bytes in %.3f s (%.1f KiB/s)",
+                     len(bitstream), elapsed, len(bitstream) / elapsed / 1024)
 
     async def download_target(self, plan, *, reload=False):
         if await self.bitstream_id() == plan.bitstream_id and not reload:
@@ -675,7 +1025,79 @@ class GlasgowHardwareDevice:
         """Write ``value`` to ``width``-byte FPGA register at ``addr``."""
         try:
             logger.trace("register %d write: %#04x", addr, value)
-            value = value.to_bytes(width, byteorder="big")
-            await self.control_write(usb1.REQUEST_TYPE_VENDOR, REQ_REGISTER, addr, 0, value)
+            self._register_shadow.pop(addr, None)
+            await self.control_write(usb1.REQUEST_TYPE_VENDOR, REQ_REGISTER, addr, 0,
+                                     value.to_bytes(width, byteorder="big"))
+            self._register_shadow[addr] = value
         except usb1.USBErrorPipe:
             await self._register_error(addr)
+
+    # The firmware processes control requests one at a time, but keeping several of them in flight
+    # removes the host-side round trip between consecutive requests.
+    _max_register_requests = 16
+
+    async def _pipeline_registers(self, requests):
+        # Each request is a function returning a coroutine. The coroutines are only created one
+        # batch at a time, so that if a request fails, the requests after it are never started
+        # and no coroutines are left unawaited.
+        results = []
+        for index in range(0, len(requests), self._max_register_requests):
+            tasks = [asyncio.ensure_future(request())
+                     for request in requests[index:index + self._max_register_requests]]
+            try:
+                results += await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        return results
+
+    @staticmethod
+    def _register_width(addr_or_pair, width):
+        if isinstance(addr_or_pair, tuple):
+            return addr_or_pair
+        return addr_or_pair, width
+
+    async def read_registers(self, addrs, width=1):
+        """
+        Read FPGA registers at ``addrs``, keeping several requests in flight at once.
+
+        Each element of ``addrs`` is either a register address, in which case the register is
+        ``width`` bytes wide, or an ``(addr, width)`` tuple. Returns a list of values in the same
+        order as ``addrs``.
+        """
+        requests = []
+        for addr_or_pair in addrs:
+            addr, addr_width = self._register_width(addr_or_pair, width)
+            requests.append(functools.partial(self.read_register, addr, addr_width))
+        return await self._pipeline_registers(requests)
+
+    def forget_registers(self):
+        """
+        Forget the register values written by the host, so that the next :meth:`write_registers`
+        call writes every register it is given. Called whenever the FPGA or an interface is reset.
+        """
+        self._register_shadow.clear()
+
+    async def write_registers(self, values, width=1, *, force=False):
+        """
+        Write FPGA registers, keeping several requests in flight at once.
+
+        ``values`` is a mapping from register addresses to values; the registers are ``width``
+        bytes wide, unless a value is specified as a ``(value, width)`` tuple. The writes are
+        performed in the iteration order of ``values``.
+
+        Unless ``force`` is true, registers whose last value written by the host is the same as
+        the requested value are not written. The values written are forgotten when the FPGA is
+        reconfigured or any of its interfaces is reset (see :meth:`forget_registers`); a register
+        that gateware modifies on its own must be written with ``force=True`` to be rewritten.
+        """
+        requests = []
+        for addr, value_or_pair in values.items():
+            value, addr_width = self._register_width(value_or_pair, width)
+            if not force and self._register_shadow.get(addr) == value:
+                logger.trace("register %d write: %#04x (unchanged)", addr, value)
+                continue
+            requests.append(functools.partial(self.write_register, addr, value, addr_width))
+        await self._pipeline_registers(requests)
@@ -1,11 +1,11 @@
+import array
 from functools import reduce
-from collections import OrderedDict
 from amaranth import *
 from amaranth.lib.fifo import FIFOInterface, SyncFIFOBuffered
 from amaranth.lib.coding import PriorityEncoder, PriorityDecoder
 
 
-__all__ = ["EventSource", "EventAnalyzer", "TraceDecodingError", "TraceDecoder"]
+__all__ = ["EventSource", "EventAnalyzer", "TraceDecodingError", "TraceColumns", "TraceDecoder"]
 
 
 REPORT_DELAY        = 0b10000000
@@ -340,12 +340,53 @@ class TraceDecodingError(Exception):
     pass
 
 
+class TraceColumns:
+    """
+    Decoded analyzer trace in columnar form.
+
+    ``timestamps`` is an array with the timestamp of each row (a cycle with at least one event).
+    ``columns`` maps each event name (see :meth:`TraceDecoder.events`) to a ``(rows, values)``
+    pair, where ``rows`` is an array of indexes into ``timestamps`` and ``values`` is an array of
+    the corresponding event values (or a list, for events wider than 64 bits, which do not fit in
+    an array), or ``None`` for events that do not carry data. If the trace
+    ended with a FIFO overrun, ``overrun`` is the timestamp of the overrun; otherwise it is
+    ``None``.
+    """
+    def __init__(self, timestamps, columns, overrun=None):
+        self.timestamps = timestamps
+        self.columns    = columns
+        self.overrun    = overrun
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def rows(self):
+        """
+        Convert the trace to a list of ``(timestamp, events)`` pairs, where ``events`` is
+        a dictionary mapping event names to their values.
+        """
+        events = [{} for _ in self.timestamps]
+        for name, (rows, values) in self.columns.items():
+            if values is None:
+                for row in rows:
+                    events[row][name] = None
+            else:
+                for row, value in zip(rows, values):
+                    events[row][name] = value
+        return list(zip(self.timestamps, events))
+
+
 class TraceDecoder:
     """
     Event analyzer trace decoder.
 
     Decodes raw analyzer traces into a timestamped sequence of maps from event fields to
     their values.
+
+    The trace is decoded one record (a run of delay bytes, a special byte, or an event byte and
+    its data bytes) at a time using a table built from the event sources, rather than one byte at
+    a time, and the results are accumulated in columns (see :class:`TraceColumns`). A record that
+    is split between chunks is kept until the rest of it arrives.
     """
     def __init__(self, event_sources, absolute_timestamps=True):
         self.event_sources       = event_sources
@@ -353,13 +394,12 @@ class TraceDecoder:
 
         self._state      = "IDLE"
         self._byte_off   = 0
+        self._partial    = b""
         self._timestamp  = 0
         self._delay      = 0
-        self._event_src  = 0
-        self._event_off  = 0
-        self._event_data = 0
-        self._pending    = OrderedDict()
-        self._timeline   = []
+        self._row_open   = False
+        self._overrun    = None
+        self._reset_columns()
 
     def events(self):
         """
@@ -374,106 +414,258 @@ class TraceDecoder:
             else:
                 yield (event_src.name, event_src.kind, event_src.width)
 
-    def _flush_timestamp(self):
-        if self._delay == 0:
-            return
-
-        if self._pending:
-            self._timeline.append((self._timestamp, self._pending))
-            self._pending = OrderedDict()
+    def _reset_columns(self):
+        self._timestamps = array.array("Q")
+        self._columns    = {}
+        for name, _kind, width in self.events():
+            if width == 0:
+                self._columns[name] = (array.array("L"), None)
+            elif width <= 64:
+                self._columns[name] = (array.array("L"), array.array("Q"))
+            else:
+                self._columns[name] = (array.array("L"), [])
 
-        if self.absolute_timestamps:
-            self._timestamp += self._delay
-        else:
-            self._timestamp  = self._delay
-        self._delay = 0
+        # For each event source, the number of data bytes that follow the event byte, and where
+        # the data goes: `(rows, values, shift, mask)`, where `mask` is `None` if the data is
+        # recorded as-is (or not at all, if `values` is `None`).
+        self._event_table = [None] * 2 ** 6
+        for index, event_src in enumerate(self.event_sources):
+            if event_src.fields:
+                targets = []
+                offset  = 0
+                for field_name, field_width in event_src.fields:
+                    rows, values = self._columns["{}-{}".format(field_name, event_src.name)]
+                    targets.append((rows, values, offset, (1 << field_width) - 1))
+                    offset += field_width
+            else:
+                rows, values = self._columns[event_src.name]
+                targets = [(rows, values, 0, None)]
+            self._event_table[index] = ((event_src.width + 7) // 8, targets)
+        self._throttle_rows, self._throttle_values = self._columns["throttle"]
 
     def process(self, data):
         """
         Incrementally parse a chunk of analyzer trace, and record events in it.
         """
-        for octet in data:
-            is_delay   = ((octet & REPORT_DELAY_MASK)   == REPORT_DELAY)
-            is_event   = ((octet & REPORT_EVENT_MASK)   == REPORT_EVENT)
-            is_special = ((octet & REPORT_SPECIAL_MASK) == REPORT_SPECIAL)
-            special    = octet & ~REPORT_SPECIAL
-
-            if self._state == "IDLE" and is_delay:
-                self._state = "DELAY"
-                self._delay = octet & ~REPORT_DELAY_MASK
-
-            elif self._state == "DELAY" and is_delay:
-                self._delay = (self._delay << 7) | (octet & ~REPORT_DELAY_MASK)
-
-            elif self._state == "DELAY" and is_special and \
-                        special in (SPECIAL_THROTTLE, SPECIAL_DETHROTTLE):
-                self._flush_timestamp()
+        self._process(data, self._decode)
 
-                if special == SPECIAL_THROTTLE:
-                    self._pending["throttle"] = 1
-                elif special == SPECIAL_DETHROTTLE:
-                    self._pending["throttle"] = 0
-
-            elif self._state in ("IDLE", "DELAY") and is_event:
-                self._flush_timestamp()
+    def skip(self, data):
+        """
+        Incrementally parse a chunk of analyzer trace without recording events in it, e.g. to find
+        out whether the trace has ended (see :meth:`is_done`) while storing it as-is. A decoder
+        must be used either with :meth:`skip` or with :meth:`process`, but not both.
+        """
+        self._process(data, self._skip)
+
+    def _process(self, data, decode):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        data = memoryview(data)
+        if self._partial:
+            # Only the record that was split between chunks is copied; the rest of the chunk is
+            # decoded in place.
+            size, _targets = self._event_table[self._partial[0] & ~REPORT_EVENT_MASK]
+            needed = 1 + size - len(self._partial)
+            if len(data) < needed:
+                self._partial += bytes(data)
+                return
+            record, self._partial = self._partial + bytes(data[:needed]), b""
+            decode(record)
+            data = data[needed:]
+
+        offset = decode(data)
+        self._partial = bytes(data[offset:])
+        if self._partial and self._state in ("DONE", "OVERRUN"):
+            raise TraceDecodingError("at byte offset %d: invalid byte %#04x for state %s" %
+                                     (self._byte_off, self._partial[0], self._state))
+
+    def _decode(self, data):
+        # Decodes as many complete records from the start of ``data`` as possible, and returns
+        # the number of bytes consumed.
+        byte_off = self._byte_off
+
+        # The decoder state is kept in local variables for speed.
+        state       = self._state
+        timestamp   = self._timestamp
+        delay       = self._delay
+        row_open    = self._row_open
+        absolute    = self.absolute_timestamps
+        timestamps  = self._timestamps
+        event_table = self._event_table
+        row         = len(timestamps) - 1
+
+        offset = 0
+        length = len(data)
+        while offset < length and state != "DONE" and state != "OVERRUN":
+            octet = data[offset]
+            # The record types are distinguished by the top two bits of the first byte.
+            if octet & REPORT_DELAY_MASK:
+                delay = (delay << 7) | (octet & ~REPORT_DELAY_MASK)
+                state = "DELAY"
+                offset += 1
+                continue
+
+            # Any other record ends the current cycle, if there was a delay.
+            if delay:
+                row_open = False
+                if absolute:
+                    timestamp += delay
+                else:
+                    timestamp  = delay
+                delay = 0
 
-                if (octet & ~REPORT_EVENT_MASK) > len(self.event_sources):
+            if octet & REPORT_EVENT:
+                entry = event_table[octet & ~REPORT_EVENT_MASK]
+                if entry is None:
                     raise TraceDecodingError("at byte offset %d: event source out of bounds" %
-                                             self._byte_off)
-                self._event_src = self.event_sources[octet & ~REPORT_EVENT_MASK]
-                if self._event_src.width == 0:
-                    self._pending[self._event_src.name] = None
-                    self._state = "IDLE"
-                else:
-                    self._event_off  = self._event_src.width
-                    self._event_data = 0
-                    self._state = "EVENT"
-
-            elif self._state == "EVENT":
-                self._event_data <<= 8
-                self._event_data  |= octet
-                if self._event_off > 8:
-                    self._event_off -= 8
+                                             (byte_off + offset))
+                size, targets = entry
+                if offset + 1 + size > length:
+                    break # wait for the rest of the record
+                if not row_open:
+                    timestamps.append(timestamp)
+                    row += 1
+                    row_open = True
+                if size == 0:
+                    for rows, _values, _shift, _mask in targets:
+                        rows.append(row)
                 else:
-                    if self._event_src.fields:
-                        offset = 0
-                        for field_name, field_width in self._event_src.fields:
-                            self._pending["{}-{}".format(field_name, self._event_src.name)] = \
-                                (self._event_data >> offset) & ((1 << field_width) - 1)
-                            offset += field_width
+                    if size == 1:
+                        value = data[offset + 1]
                     else:
-                        self._pending[self._event_src.name] = self._event_data
+                        value = int.from_bytes(data[offset + 1:offset + 1 + size], "big")
+                    for rows, values, shift, mask in targets:
+                        rows.append(row)
+                        if mask is None:
+                            values.append(value)
+                        else:
+                            values.append((value >> shift) & mask)
+                state = "IDLE"
+                offset += 1 + size
+
+            elif state == "DELAY" and octet in (REPORT_SPECIAL|SPECIAL_THROTTLE,
+                                                REPORT_SPECIAL|SPECIAL_DETHROTTLE):
+                if not row_open:
+                    timestamps.append(timestamp)
+                    row += 1
+                    row_open = True
+                self._throttle_rows.append(row)
+                self._throttle_values.append(int(octet == REPORT_SPECIAL|SPECIAL_THROTTLE))
+                offset += 1
+
+            elif state == "DELAY" and octet == REPORT_SPECIAL|SPECIAL_DONE:
+                if not row_open:
+                    timestamps.append(timestamp)
+                    row += 1
+                    row_open = True
+                state = "DONE"
+                offset += 1
+
+            elif state == "DELAY" and octet == REPORT_SPECIAL|SPECIAL_OVERRUN:
+                self._overrun = timestamp
+                state = "OVERRUN"
+                offset += 1
+
+            else:
+                raise TraceDecodingError("at byte offset %d: invalid byte %#04x for state %s" %
+                                         (byte_off + offset, octet, state))
+
+        self._state     = state
+        self._timestamp = timestamp
+        self._delay     = delay
+        self._row_open  = row_open
+        self._byte_off  = byte_off + offset
+        return offset
+
+    def _skip(self, data):
+        # Same as `_decode`, but only follows the record boundaries.
+        state       = self._state
+        event_table = self._event_table
+
+        offset = 0
+        length = len(data)
+        while offset < length and state != "DONE" and state != "OVERRUN":
+            octet = data[offset]
+            if octet & REPORT_DELAY_MASK:
+                state = "DELAY"
+                offset += 1
+
+            elif octet & REPORT_EVENT:
+                entry = event_table[octet & ~REPORT_EVENT_MASK]
+                if entry is None:
+                    raise TraceDecodingError("at byte offset %d: event source out of bounds" %
+                                             (self._byte_off + offset))
+                size = entry[0]
+                if offset + 1 + size > length:
+                    break # wait for the rest of the record
+                state = "IDLE"
+                offset += 1 + size
 
-                    self._state = "IDLE"
+            elif state == "DELAY" and octet in (REPORT_SPECIAL|SPECIAL_THROTTLE,
+                                                REPORT_SPECIAL|SPECIAL_DETHROTTLE):
+                offset += 1
 
-            elif self._state in "DELAY" and is_special and \
-                        special in (SPECIAL_DONE, SPECIAL_OVERRUN):
-                self._flush_timestamp()
-                if special == SPECIAL_DONE:
-                    self._state = "DONE"
-                elif special == SPECIAL_OVERRUN:
-                    self._state = "OVERRUN"
+            elif state == "DELAY" and octet == REPORT_SPECIAL|SPECIAL_DONE:
+                state = "DONE"
+                offset += 1
+
+            elif state == "DELAY" and octet == REPORT_SPECIAL|SPECIAL_OVERRUN:
+                state = "OVERRUN"
+                offset += 1
 
             else:
                 raise TraceDecodingError("at byte offset %d: invalid byte %#04x for state %s" %
-                                         (self._byte_off, octet, self._state))
+                                         (self._byte_off + offset, octet, state))
+
+        self._state     = state
+        self._byte_off += offset
+        return offset
 
-            self._byte_off += 1
+    def flush_columns(self, pending=False):
+        """
+        Return the event trace since the start of decoding or the previous flush as
+        :class:`TraceColumns`. If ``pending`` is ``True``, also flushes pending events; this may
+        cause duplicate timestamps if more events arrive after the flush.
+        """
+        timestamps, columns = self._timestamps, self._columns
+        overrun, self._overrun = self._overrun, None
+        self._reset_columns()
+
+        # The events in the last row may still be followed by more events in the same cycle,
+        # unless the trace has ended.
+        if self._row_open and not (pending or self.is_done()):
+            last_row = len(timestamps) - 1
+            self._timestamps.append(timestamps.pop())
+            for name, (rows, values) in columns.items():
+                next_rows, next_values = self._columns[name]
+                while rows and rows[-1] == last_row:
+                    rows.pop()
+                    next_rows.append(0)
+                    if values is not None:
+                        next_values.append(values.pop())
+        else:
+            self._row_open = False
+
+        return TraceColumns(timestamps, columns, overrun)
 
     def flush(self, pending=False):
         """
         Return the complete event timeline since the start of decoding or the previous flush.
         If ``pending`` is ``True``, also flushes pending events; this may cause duplicate
         timestamps if more events arrive after the flush.
-        """
-        if self._state == "OVERRUN":
-            self._timeline.append((self._timestamp, "overrun"))
-        elif pending and self._pending or self._state == "DONE":
-            self._timeline.append((self._timestamp, self._pending))
-            self._pending = OrderedDict()
 
-        timeline, self._timeline = self._timeline, []
+        The timeline is a list of ``(timestamp, events)`` pairs, where ``events`` is a dictionary
+        mapping event names to their values, or the string ``"overrun"`` if the FIFO overflowed
+        at that point. Consider using :meth:`flush_columns` instead, which is much faster.
+        """
+        trace = self.flush_columns(pending)
+        timeline = trace.rows()
+        if trace.overrun is not None:
+            timeline.append((trace.overrun, "overrun"))
         return timeline
 
     def is_done(self):
         return self._state in ("DONE", "OVERRUN")
+
+    def is_overrun(self):
+        return self._state == "OVERRUN"
@@ -4,16 +4,13 @@
 # Accession: G00023
 
 import re
+import struct
 from abc import ABCMeta, abstractmethod
 
 from ..support.bits import *
 
 
-__all__ = ["SVFParser", "SVFEventHandler"]
-
-
-def _hex_to_bits(input_nibbles):
-    return bits(int(input_nibbles, 16))
+__all__ = ["SVFParsingError", "SVFParser", "SVFEventHandler", "SVFProgram", "parse_svf"]
 
 
 _commands = (
@@ -54,38 +51,65 @@ class SVFLexer:
         * Literal (``(HLUDXZHHLL)``, ``(IN FOO)``, ...), returned as Python ``tuple(str,)``;
         * End of file, returned as Python ``None``.
 
-    :type buffer: str
+    The input buffer may be a ``str``, or any bytes-like object, in particular an :class:`mmap.mmap`
+    of an SVF file; tokens are only ever extracted from it one at a time, so files much larger
+    than the available memory can be lexed.
+
+    :type buffer: str or bytes-like
     :attr buffer:
         Input buffer.
 
     :type position: int
     :attr position:
         Offset into buffer from which the next token will be read.
+
+    :type token_position: int
+    :attr token_position:
+        Offset into buffer at which the token last returned by :meth:`next` starts.
     """
 
-    _keywords = _commands + _parameters + _trst_modes + _tap_states + (";",)
-    _scanner  = tuple((re.compile(src, re.A|re.I|re.M), act) for src, act in (
-        (r"\s+",
-         None),
-        (r"(?:!|//)([^\n]*)(?:\n|\Z)",
-         None),
-        (r"({})(?=\s+|[;()]|\Z)".format("|".join(_keywords)),
-         lambda m: m[1]),
-        (r"(\d+)(?=[^0-9\.E])",
-         lambda m: int(m[1])),
-        (r"(\d+(?:\.\d+)?(?:E[+-]?\d+)?)",
-         lambda m: float(m[1])),
-        (r"\(\s*([0-9A-F\s]+)\s*\)",
-         lambda m: _hex_to_bits(re.sub(r"\s+", "", m[1]))),
-        (r"\(\s*(.+?)\s*\)",
-         lambda m: (m[1],)),
-        (r"\Z",
-         lambda m: None),
-    ))
+    _keywords = {
+        keyword: keyword
+        for keyword in _commands + _parameters + _trst_modes + _tap_states
+    }
+    _keywords.update({keyword.encode("ascii"): keyword for keyword in _keywords})
+
+    # The whitespace and comments preceding a token are skipped separately from matching the token,
+    # so that neither can be reinterpreted as the other while backtracking.
+    _skip_source  = r"(?:\s|(?:!|//)[^\n]*)*"
+    # Case-insensitive matching is avoided, since it makes matching scan data many times slower.
+    _token_source = (
+        r"(?P<keyword>[A-Za-z][A-Za-z0-9]*)(?=[\s;()]|\Z)"
+        r"|(?P<semicolon>;)"
+        r"|(?P<number>\d+(?P<real>(?:\.\d+)?(?:[Ee][+-]?\d+)?))"
+        r"|\((?P<scan_data>[0-9A-Fa-f\s]+)\)"
+        r"|\(\s*(?P<literal>[^\n]+?)\s*\)"
+        r"|(?P<eof>\Z)"
+    )
+    _str_scanners   = (re.compile(_skip_source, re.A),
+                       re.compile(_token_source, re.A))
+    _bytes_scanners = (re.compile(_skip_source.encode("ascii")),
+                       re.compile(_token_source.encode("ascii")))
 
     def __init__(self, buffer):
         self.buffer   = buffer
         self.position = 0
+        self.token_position = 0
+
+        if isinstance(buffer, str):
+            self._skip_re, self._token_re = self._str_scanners
+            self._text = lambda data: data
+        else:
+            self._skip_re, self._token_re = self._bytes_scanners
+            self._text = lambda data: data.decode("utf-8", errors="replace")
+        self._empty   = buffer[:0]
+        self._newline = "\n" if isinstance(buffer, str) else b"\n"
+        self._peeked  = None
+
+    def count_lines(self, start, end):
+        """Return the number of line breaks between ``start`` and ``end``."""
+        # `mmap` objects do not have a `count()` method, but their slices do.
+        return self.buffer[start:end].count(self._newline)
 
     def line_column(self, position=None):
         """
@@ -93,38 +117,62 @@ class SVFLexer:
 
         Both the line and the column start at 1.
         """
-        line = len(re.compile(r"\n").findall(self.buffer, endpos=self.position))
-        if line > 1:
-            column = self.position - self.buffer.rindex("\n", 0, self.position)
-        else:
-            column = self.position
-        return line + 1, column + 1
+        if position is None:
+            position = self.position
+        line   = self.count_lines(0, position) + 1
+        column = position - (self.buffer.rfind(self._newline, 0, position) + 1) + 1
+        return line, column
 
     def _lex(self):
-        while True:
-            for token_re, action in self._scanner:
-                match = token_re.match(self.buffer, self.position)
-                # print(token_re, match)
-                if match:
-                    if action is None:
-                        self.position = match.end()
-                        break
-                    else:
-                        return action(match), match.end()
+        if self._peeked is not None and self._peeked[0] == self.position:
+            return self._peeked[1:]
+
+        start = self._skip_re.match(self.buffer, self.position).end()
+        match = self._token_re.match(self.buffer, start)
+        if match is None:
+            self._error(start)
+        kind = match.lastgroup
+        if kind == "keyword":
+            token = self._keywords.get(match[kind].upper())
+            if token is None:
+                self._error(start)
+        elif kind == "semicolon":
+            token = ";"
+        elif kind == "scan_data":
+            data = match[kind]
+            if not data.isalnum():
+                data = self._empty.join(data.split())
+                if not data:
+                    self._error(start)
+            # Converting from hexadecimal is linear in the length of the data; so is converting
+            # the resulting integer to bits, which is a single `int.to_bytes()` call.
+            token = bits(int(data, 16))
+        elif kind == "number":
+            if match["real"]:
+                token = float(match[kind])
             else:
-                raise SVFParsingError("unrecognized SVF data at line %d, column %d (%s...)"
-                                    % (*self.line_column(),
-                                       self.buffer[self.position:self.position + 16]))
+                token = int(match[kind])
+        elif kind == "literal":
+            token = (self._text(match[kind]),)
+        else: # eof
+            token = None
+
+        self._peeked = (self.position, token, start, match.end())
+        return token, start, match.end()
+
+    def _error(self, position):
+        raise SVFParsingError("unrecognized SVF data at line %d, column %d (%s...)"
+                              % (*self.line_column(position),
+                                 self._text(self.buffer[position:position + 16])))
 
     def peek(self):
         """Return the next token without advancing the position."""
-        token, _ = self._lex()
+        token, _, _ = self._lex()
         return token
 
     def next(self):
         """Return the next token and advance the position."""
-        token, next_pos = self._lex()
-        self.position = next_pos
+        token, self.token_position, self.position = self._lex()
         return token
 
     def __iter__(self):
@@ -151,6 +199,10 @@ class SVFParser:
         self._position  = 0
         self._token     = None
         self._cmd_pos   = 0
+        self._cmd_start = 0
+        self._line_pos  = 0
+        self._line      = 1
+        self._trying    = 0
 
         self._param_tdi   = \
             {"HIR": None, "HDR": None, "SIR": None, "SDR": None, "TIR": None, "TDR": None}
@@ -163,20 +215,26 @@ class SVFParser:
         self._param_end_state = "IDLE"
 
     def _try(self, action, *args):
+        old_position = self._lexer.position
+        self._trying += 1
         try:
-            old_position = self._lexer.position
             return action(*args)
         except SVFParsingError as e:
             self._lexer.position = old_position
             return None
+        finally:
+            self._trying -= 1
 
     def _parse_token(self):
-        self._position = self._lexer.position
         self._token    = self._lexer.next()
+        self._position = self._lexer.token_position
         # print("token %s @ %d" % (self._token, self._position))
         return self._token
 
     def _parse_error(self, error):
+        if self._trying:
+            # The error will be discarded; don't spend time finding out where it is.
+            raise SVFParsingError(error)
         raise SVFParsingError("%s at line %d, column %d"
                               % (error, *self._lexer.line_column(self._position)))
 
@@ -252,19 +310,22 @@ class SVFParser:
 
     def _parse_scan_data(self, length):
         value = self._parse_value(bits)
-        if int(value[length:]) != 0:
+        # The lexer returns scan data without leading zeroes, so it is only ever too long if
+        # it has bits set past the end of the command.
+        if len(value) > length:
             self._parse_error("scan data length %d exceeds command length %d"
                               % (len(value), length))
 
         if length > len(value):
-            return value + bits(0, length - len(value))
+            return bits(value.to_int(), length)
         else:
-            return value[:length]
+            return value
 
     def parse_command(self):
         self._cmd_pos = self._lexer.position
 
         command = self._parse_token()
+        self._cmd_start = self._lexer.token_position
         if command is None:
             return False
 
@@ -284,10 +345,8 @@ class SVFParser:
 
         elif command == "STATE":
             states = []
-            while True:
-                state = self._try(self._parse_tap_state)
-                if state is None: break
-                states.append(state)
+            while self._lexer.peek() in _tap_states:
+                states.append(self._parse_tap_state())
 
             self._parse_keyword(";")
 
@@ -321,10 +380,8 @@ class SVFParser:
             param_mask  = self._param_mask[command]
             param_smask = self._param_smask[command]
             parameters  = set()
-            while True:
-                parameter = self._try(self._parse_keywords, ("TDI", "TDO", "MASK", "SMASK"))
-                if parameter is None: break
-
+            while self._lexer.peek() in ("TDI", "TDO", "MASK", "SMASK"):
+                parameter = self._parse_token()
                 value = self._parse_scan_data(length)
                 if parameter in parameters:
                     self._parse_error("parameter %s specified twice" % parameter)
@@ -443,6 +500,16 @@ class SVFParser:
     def last_command(self):
         return self._lexer.buffer[self._cmd_pos:self._lexer.position]
 
+    def last_command_line(self):
+        """Return the line (starting at 1) on which the last parsed command begins."""
+        # Commands are parsed in order, so the line can be tracked incrementally instead of
+        # counting every line from the start of the buffer.
+        if self._cmd_start < self._line_pos:
+            self._line_pos, self._line = 0, 1
+        self._line += self._lexer.count_lines(self._line_pos, self._cmd_start)
+        self._line_pos = self._cmd_start
+        return self._line
+
     def parse_file(self):
         while self.parse_command(): pass
 
@@ -511,3 +578,182 @@ class SVFEventHandler(metaclass=ABCMeta):
     @abstractmethod
     def svf_pio(self, vector):
         """Called when the ``PIO`` command is encountered."""
+
+
+class _SVFRecorder:
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        if name.startswith("svf_"):
+            def svf_event(**kwargs):
+                self.events.append((name, kwargs))
+            return svf_event
+        raise AttributeError(name)
+
+
+def parse_svf(buffer):
+    """
+    Parse ``buffer`` (see :class:`SVFLexer`) incrementally, yielding a ``(line, method, arguments)``
+    tuple for each event that :class:`SVFParser` would invoke on an event handler, as soon as
+    the command it belongs to has been parsed.
+    """
+    recorder = _SVFRecorder()
+    parser   = SVFParser(buffer, recorder)
+    while parser.parse_command():
+        line = parser.last_command_line()
+        for name, kwargs in recorder.events:
+            yield line, name, kwargs
+        recorder.events.clear()
+
+
+class SVFProgram:
+    """
+    A compiled Serial Vector Format file.
+
+    The program is the sequence of events that :class:`SVFParser` would invoke on an event
+    handler for the file, as ``(line, method, arguments)`` tuples, with all lexical state already
+    resolved. Replaying a program with :meth:`play` is equivalent to parsing the file again, but
+    much faster; a program can be serialized to a compact binary form with :meth:`to_bytes`
+    and loaded back with :meth:`from_bytes`, e.g. to cache it between runs.
+    """
+
+    MAGIC   = b"Glasgow SVF program\x00"
+    VERSION = 1
+
+    # Serialization order of the events and of their arguments; the numbering is a part of
+    # the binary format, so new events and arguments must only ever be appended.
+    _events = (
+        ("svf_frequency", ("frequency",)),
+        ("svf_trst",      ("mode",)),
+        ("svf_state",     ("state", "path")),
+        ("svf_endir",     ("state",)),
+        ("svf_enddr",     ("state",)),
+        ("svf_hir",       ("tdi", "smask", "tdo", "mask")),
+        ("svf_sir",       ("tdi", "smask", "tdo", "mask")),
+        ("svf_tir",       ("tdi", "smask", "tdo", "mask")),
+        ("svf_hdr",       ("tdi", "smask", "tdo", "mask")),
+        ("svf_sdr",       ("tdi", "smask", "tdo", "mask")),
+        ("svf_tdr",       ("tdi", "smask", "tdo", "mask")),
+        ("svf_runtest",   ("run_state", "run_count", "run_clock", "min_time", "max_time",
+                           "end_state")),
+        ("svf_piomap",    ("mapping",)),
+        ("svf_pio",       ("vector",)),
+    )
+    _event_codes = {name: code for code, (name, _) in enumerate(_events)}
+
+    _TAG_NONE, _TAG_STR, _TAG_INT, _TAG_FLOAT, _TAG_BITS, _TAG_LIST = range(6)
+
+    def __init__(self, commands=()):
+        self.commands = list(commands)
+
+    @classmethod
+    def compile(cls, buffer):
+        """Parse ``buffer``, raising :class:`SVFParsingError` if it is not well-formed."""
+        return cls(parse_svf(buffer))
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __iter__(self):
+        return iter(self.commands)
+
+    async def play(self, handler):
+        """Invoke the events of the program on ``handler``, in order."""
+        for line, name, kwargs in self.commands:
+            await getattr(handler, name)(**kwargs)
+
+    @classmethod
+    def _encode_value(cls, value, output):
+        if value is None:
+            output.append(cls._TAG_NONE)
+        elif isinstance(value, str):
+            data = value.encode("utf-8")
+            output += struct.pack("<BL", cls._TAG_STR, len(data)) + data
+        elif isinstance(value, bits):
+            data = bytes(value)
+            output += struct.pack("<BL", cls._TAG_BITS, len(value)) + data
+        elif isinstance(value, float):
+            output += struct.pack("<Bd", cls._TAG_FLOAT, value)
+        elif isinstance(value, int):
+            output += struct.pack("<Bq", cls._TAG_INT, value)
+        elif isinstance(value, list):
+            output += struct.pack("<BL", cls._TAG_LIST, len(value))
+            for item in value:
+                cls._encode_value(item, output)
+        else:
+            assert False
+
+    def to_bytes(self):
+        output = bytearray(self.MAGIC + struct.pack("<HL", self.VERSION, len(self.commands)))
+        for line, name, kwargs in self.commands:
+            code = self._event_codes[name]
+            output += struct.pack("<BL", code, line)
+            for arg_name in self._events[code][1]:
+                self._encode_value(kwargs[arg_name], output)
+        return bytes(output)
+
+    @classmethod
+    def _decode_value(cls, data, offset):
+        tag = data[offset]
+        offset += 1
+        if tag == cls._TAG_NONE:
+            return None, offset
+        elif tag == cls._TAG_STR:
+            length, = struct.unpack_from("<L", data, offset)
+            offset += 4
+            if offset + length > len(data):
+                raise IndexError
+            return str(data[offset:offset + length], "utf-8"), offset + length
+        elif tag == cls._TAG_BITS:
+            length, = struct.unpack_from("<L", data, offset)
+            offset += 4
+            size = (length + 7) // 8
+            if offset + size > len(data):
+                raise IndexError
+            return bits(data[offset:offset + size], length), offset + size
+        elif tag == cls._TAG_FLOAT:
+            return struct.unpack_from("<d", data, offset)[0], offset + 8
+        elif tag == cls._TAG_INT:
+            return struct.unpack_from("<q", data, offset)[0], offset + 8
+        elif tag == cls._TAG_LIST:
+            count, = struct.unpack_from("<L", data, offset)
+            offset += 4
+            items = []
+            for _ in range(count):
+                item, offset = cls._decode_value(data, offset)
+                items.append(item)
+            return items, offset
+        else:
+            raise ValueError(f"unknown value tag {tag}")
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Load a program serialized by :meth:`to_bytes`, raising :exc:`ValueError` if ``data``
+        is not a valid program for this version of the software.
+        """
+        data = memoryview(data)
+        if bytes(data[:len(cls.MAGIC)]) != cls.MAGIC:
+            raise ValueError("not a compiled SVF program")
+        try:
+            version, count = struct.unpack_from("<HL", data, len(cls.MAGIC))
+            if version != cls.VERSION:
+                raise ValueError(f"unsupported compiled SVF program version {version}")
+            offset = len(cls.MAGIC) + 6
+            commands = []
+            for _ in range(count):
+                code, line = struct.unpack_from("<BL", data, offset)
+                offset += 5
+                if code >= len(cls._events):
+                    raise ValueError(f"unknown SVF event code {code}")
+                name, arg_names = cls._events[code]
+                kwargs = {}
+                for arg_name in arg_names:
+                    kwargs[arg_name], offset = cls._decode_value(data, offset)
+                commands.append((line, name, kwargs))
+        except (struct.error, IndexError) as error:
+            raise ValueError("truncated compiled SVF program") from error
+        if offset != len(data):
+            raise ValueError("trailing data after compiled SVF program")
+        return cls(commands)
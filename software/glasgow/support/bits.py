@@ -1,5 +1,4 @@
 import re
-import itertools
 import operator
 from collections.abc import Sequence, MutableSequence, Iterable
 from typing_extensions import Self
@@ -51,7 +50,7 @@ class _bits_base(Sequence):
         value  = re.sub(r"[\s_]", "", value)
         if not re.match(r"^[01]*$", value):
             raise ValueError(f"invalid input for {cls.__name__}(): '{value}'")
-        return cls.from_iter(int(x) for x in reversed(value))
+        return cls.from_int(int(value, 2) if value else 0, len(value))
 
     @classmethod
     def from_iter(cls, iterator) -> Self:
@@ -171,6 +170,13 @@ class _bits_base(Sequence):
                 res._bytes = self._bytes[start // 8 : (stop + 7) // 8]
                 res._len = stop - start
                 return res
+            elif step == 1:
+                # unaligned fastpath: shift the bytes covering the slice into place
+                value = int.from_bytes(self._bytes[start // 8 : (stop + 7) // 8], 'little')
+                return self.from_int(value >> (start % 8), stop - start)
+            elif step == -1:
+                # unaligned reverse fastpath
+                return self[stop + 1 : start + 1].reversed()
             else:
                 # slow path
                 return self.from_iter(self[i] for i in range(start, stop, step))
@@ -191,7 +197,9 @@ class _bits_base(Sequence):
 
     def to_str(self) -> str:
         """Returns the bit string as a human-readable string (MSB-first)."""
-        return ''.join(str(x) for x in reversed(self))
+        if not self._len:
+            return ''
+        return format(self.to_int(), f'0{self._len}b')
 
     def to_bytes(self) -> bytes:
         """Returns the bits packed into bytes. The bits are packed into bytes LSB-first.
@@ -216,7 +224,8 @@ class _bits_base(Sequence):
             res._bytes = self._bytes + other._bytes
             res._len = self._len + other._len
             return res
-        return self.from_iter(itertools.chain(self, other))
+        return self.from_int(self.to_int() | (other.to_int() << self._len),
+                             self._len + other._len)
 
     def __radd__(self, other) -> Self:
         if isinstance(other, (str, Iterable)):
@@ -228,17 +237,31 @@ class _bits_base(Sequence):
             res._bytes = other._bytes + self._bytes
             res._len = other._len + self._len
             return res
-        return self.from_iter(itertools.chain(other, self))
+        return self.from_int(other.to_int() | (self.to_int() << other._len),
+                             other._len + self._len)
 
     def __mul__(self, other) -> Self:
         if not isinstance(other, int):
             return NotImplemented
+        other = max(other, 0)
         if self._len % 8 == 0:
             res = object.__new__(self.__class__)
             res._bytes = self._bytes * other
             res._len = self._len * other
             return res
-        return self.from_iter(itertools.chain.from_iterable(itertools.repeat(self, other)))
+        # Double the repeated value until it is long enough, which takes a logarithmic number
+        # of shifts instead of a linear number of concatenations.
+        value,  length  = 0, 0
+        repeat, rlength = self.to_int(), self._len
+        while other:
+            if other & 1:
+                value  |= repeat << length
+                length += rlength
+            other >>= 1
+            if other:
+                repeat  |= repeat << rlength
+                rlength *= 2
+        return self.from_int(value, length)
 
     __rmul__ = __mul__
 
@@ -249,10 +272,7 @@ class _bits_base(Sequence):
             other = bits(other)
         if len(other) != len(self):
             raise ValueError("mismatched bitwise operator widths")
-        res = object.__new__(self.__class__)
-        res._bytes = self._bytestype(op(a, b) for (a, b) in zip(self._bytes, other._bytes))
-        res._len = self._len
-        return res
+        return self.from_int(op(self.to_int(), other.to_int()), self._len)
 
     def __and__(self, other) -> Self:
         return self._bitop(other, operator.__and__)
@@ -270,18 +290,8 @@ class _bits_base(Sequence):
     __rxor__ = __xor__
 
     def __invert__(self) -> Self:
-        if self._len % 8 == 0:
-            pad_idx = None
-        else:
-            pad_idx = self._len // 8
-            pad_mask = ~(-1 << self._len % 8)
-        res = object.__new__(self.__class__)
-        res._bytes = self._bytestype(
-            ~x & pad_mask if i == pad_idx else ~x & 0xff
-            for i, x in enumerate(self._bytes)
-        )
-        res._len = self._len
-        return res
+        # `from_int` masks off the bits past the end.
+        return self.from_int(~self.to_int(), self._len)
 
     def reversed(self) -> Self:
         """Returns a reversed copy of this bit string. Equivalent to ``from_iter(reversed(self))``."""
@@ -291,7 +301,9 @@ class _bits_base(Sequence):
             res._len = self._len
             return res
         else:
-            return self.from_iter(reversed(self))
+            # reverse the padded bytes, then shift out the padding, which ends up at the LSBs
+            value = int.from_bytes(self._bytes.translate(_byterev_lut)[::-1], 'little')
+            return self.from_int(value >> (-self._len % 8), self._len)
 
     def byte_reversed(self) -> Self:
         """Returns a copy of this bit string with bits reversed within each byte.
@@ -316,11 +328,18 @@ class _bits_base(Sequence):
             needle = bits([needle])
         if end is None:
             end = self._len
+        start = max(start, 0)
         end = min(end, self._len - (needle._len - 1))
-        for i in range(start, end):
-            if all(self[i + j] == needle[j] for j in range(needle._len)):
-               return i
-        return -1
+        if start >= end:
+            return -1
+        # Search the MSB-first string representations (in which both the haystack and
+        # the needle are reversed), using the substring search of `str`. Only the part of
+        # the haystack that may contain a match is converted.
+        haystack = self[start : end + needle._len - 1].to_str()
+        index = haystack.rfind(needle.to_str())
+        if index == -1:
+            return -1
+        return start + len(haystack) - needle._len - index
 
     def index(self, *args, **kwargs) -> int:
         """Like ``find``, but raises ``ValueError`` when the substring is not found."""
@@ -394,14 +413,19 @@ class bitarray(_bits_base, MutableSequence):
                 self._bytes[start // 8 :] = value._bytes
                 self._len = start + value._len
             elif stop - start == value._len:
-                # slow-ish path, no resize
-                for di, bit in zip(rng, value):
-                    self[di] = bit
+                # unaligned path, no resize: splice the value into the bytes covering the slice
+                bstart, bstop = start // 8, (stop + 7) // 8
+                mask = ~(-1 << value._len) << (start % 8)
+                window = int.from_bytes(self._bytes[bstart:bstop], 'little') & ~mask
+                window |= value.to_int() << (start % 8)
+                self._bytes[bstart:bstop] = window.to_bytes(bstop - bstart, 'little')
             elif stop == self._len:
-                # slow-ish path, extend/truncate
+                # unaligned path, extend/truncate: the bits past `start` are zero after resizing
+                self._resize(start)
                 self._resize(start + value._len)
-                for di, bit in enumerate(value, start=start):
-                    self[di] = bit
+                bstart = start // 8
+                window = self._bytes[bstart] | (value.to_int() << (start % 8))
+                self._bytes[bstart:] = window.to_bytes(len(self._bytes) - bstart, 'little')
             else:
                 # slow path
                 tail = self[stop:]
@@ -516,9 +540,9 @@ class bitarray(_bits_base, MutableSequence):
         elif other < 0:
             raise ValueError("cannot multiply bitarray by negative count")
         elif other != 1:
-            val = self[:]
-            for _ in range(other - 1):
-                self += val
+            res = self * other
+            self._bytes = res._bytes
+            self._len = res._len
         return self
 
     def _ibitop(self, other, op):
@@ -528,8 +552,8 @@ class bitarray(_bits_base, MutableSequence):
             other = bits(other)
         if len(other) != len(self):
             raise ValueError("mismatched bitwise operator widths")
-        for i, b in enumerate(other._bytes):
-            self._bytes[i] = op(self._bytes[i], b)
+        value = op(self.to_int(), other.to_int())
+        self._bytes[:] = value.to_bytes(len(self._bytes), 'little')
         return self
 
     def __iand__(self, other) -> Self:
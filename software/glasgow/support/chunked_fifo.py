@@ -9,32 +9,49 @@ class ChunkedFIFO:
     A first-in first-out byte buffer that uses discontiguous storage to operate without copying.
     """
     def __init__(self):
-        self._queue  = deque()
-        self._chunk  = None
-        self._offset = 0
-        self._length = 0
-        self._rtotal = 0
-        self._wtotal = 0
+        self._queue   = deque()
+        self._chunk   = None
+        self._release = None
+        self._offset  = 0
+        self._length  = 0
+        self._rtotal  = 0
+        self._wtotal  = 0
 
     def clear(self):
         """Remove all data from the buffer."""
-        self._queue.clear()
-        self._chunk  = None
-        self._offset = 0
-        self._length = 0
+        if self._chunk is not None:
+            self._release_chunk(self._chunk, self._release)
+        while self._queue:
+            self._release_chunk(*self._queue.popleft())
+        self._chunk   = None
+        self._release = None
+        self._offset  = 0
+        self._length  = 0
+
+    @staticmethod
+    def _release_chunk(chunk, release):
+        if release is not None:
+            release(chunk)
+
+    def write(self, data, *, release=None):
+        """
+        Enqueue ``data``.
 
-    def write(self, data):
-        """Enqueue ``data``."""
+        If ``release`` is specified, it is called with the enqueued ``memoryview`` once all of
+        the data has been dequeued, e.g. to return the underlying storage to a pool. Views
+        returned by :meth:`read` may still be in use at that point.
+        """
         try:
             data = memoryview(data)
         except TypeError:
             data = memoryview(bytes(data))
 
         if not data:
+            self._release_chunk(data, release)
             return
         self._length += len(data)
         self._wtotal += len(data)
-        self._queue.append(data)
+        self._queue.append((data, release))
 
     def read(self, max_length=None):
         """
@@ -46,9 +63,10 @@ class ChunkedFIFO:
         """
         if max_length is None and self._chunk is None:
             # Fast path.
-            chunk = self._queue.popleft()
+            chunk, release = self._queue.popleft()
             self._length -= len(chunk)
             self._rtotal += len(chunk)
+            self._release_chunk(chunk, release)
             return chunk
 
         if max_length == 0:
@@ -58,7 +76,7 @@ class ChunkedFIFO:
             if not self._queue:
                 return memoryview(b"")
 
-            self._chunk  = self._queue.popleft()
+            self._chunk, self._release = self._queue.popleft()
             self._offset = 0
 
         if max_length is None:
@@ -67,7 +85,9 @@ class ChunkedFIFO:
             result = self._chunk[self._offset:self._offset + max_length]
 
         if self._offset + len(result) == len(self._chunk):
-            self._chunk = None
+            self._release_chunk(self._chunk, self._release)
+            self._chunk   = None
+            self._release = None
         else:
             self._offset += len(result)
 
@@ -75,6 +95,22 @@ class ChunkedFIFO:
         self._rtotal += len(result)
         return result
 
+    def readinto(self, buffer):
+        """
+        Dequeue at most ``len(buffer)`` bytes into ``buffer``, which may be any writable object
+        supporting the buffer protocol (e.g. ``bytearray``, ``mmap``, or a NumPy array). Returns
+        the amount of bytes dequeued.
+
+        The data is copied exactly once, directly from the enqueued chunks.
+        """
+        buffer = memoryview(buffer).cast("B")
+        offset = 0
+        while offset < len(buffer) and self:
+            chunk = self.read(len(buffer) - offset)
+            buffer[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return offset
+
     def __bool__(self):
         """Check whether there are any bytes in the FIFO."""
         return bool(self._queue) or self._chunk is not None
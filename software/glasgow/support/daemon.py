@@ -0,0 +1,247 @@
+import io
+import os
+import ast
+import stat
+import errno
+import json
+import socket
+import asyncio
+import argparse
+import functools
+import contextlib
+import traceback
+
+from .endpoint import endpoint
+
+
+__all__ = ["daemon_endpoint", "DaemonServer", "daemon_run_script", "daemon_forward"]
+
+
+# The protocol is deliberately simple so that clients can be written in any language (or be
+# a shell one-liner using `socat`). A client connects and sends a request: a JSON object followed
+# by a newline. Two requests are supported:
+#
+#   * ``{"script": CODE, "filename": NAME, "args": [ARG, ...]}`` runs the Python script CODE (with
+#     top-level await allowed) in the applet context (``iface``, ``device``, ``args``, where
+#     ``args.script_args`` is the provided list). When it finishes, the daemon replies with
+#     ``{"status": "ok" | "error", "output": OUTPUT, "error": TRACEBACK}`` followed by a newline,
+#     and closes the connection. OUTPUT is everything the script printed with ``print()``, which
+#     is replaced in the script globals; ``sys.stdout`` itself is left alone, since it belongs to
+#     the whole process (and is where the daemon itself logs).
+#   * ``{"forward": true}`` forwards the applet pipe. The daemon replies with ``{"status": "ok"}``
+#     followed by a newline (or an error as above), and then any bytes sent by the client are
+#     written to the applet interface and any bytes read from the applet interface are sent to
+#     the client, until the client closes its end of the connection.
+#
+# The daemon only listens at a UNIX socket: anyone who can connect to it can run arbitrary code
+# as the user running the daemon, so access is controlled by the permissions of the socket file,
+# which only allow the owner to connect.
+#
+# Only one request is served at a time, since the applet interface cannot be shared; other
+# clients wait until the current one is done.
+
+
+def daemon_endpoint(spec):
+    """Parse a daemon endpoint, ``unix:PATH``, for use as an ``argparse`` argument type."""
+    sock_addr = endpoint(spec)
+    if sock_addr[0] != "unix":
+        raise argparse.ArgumentTypeError(
+            f"invalid daemon endpoint: {spec!r} (the daemon can only use a UNIX socket)")
+    return sock_addr
+
+
+class DaemonServer:
+    def __init__(self, logger, sock_addr, *, iface, make_globals):
+        self._logger       = logger
+        self._sock_addr    = sock_addr
+        self._iface        = iface
+        self._make_globals = make_globals
+        self._lock         = asyncio.Lock()
+        self._server       = None
+
+    async def serve(self):
+        proto, *proto_args = self._sock_addr
+        if proto != "unix":
+            # The daemon runs any script it is sent, so it must only be reachable by users who
+            # could run the script themselves; a UNIX socket is protected by file permissions.
+            raise OSError(errno.EPROTONOSUPPORT,
+                          f"the daemon can only listen at a UNIX socket, not {proto}:")
+        path, = proto_args
+        await self._check_socket(path)
+        sock = self._bind_socket(path)
+        try:
+            self._server = await asyncio.start_unix_server(self._handle, sock=sock)
+            self._logger.info("daemon listening at unix:%s", path)
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+    async def _check_socket(self, path):
+        # A daemon that was killed leaves its socket behind, which is removed; but the socket of
+        # a daemon that is still running must be left alone.
+        if not (os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode)):
+            return
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+        writer.close()
+        raise OSError(errno.EADDRINUSE, f"another daemon is listening at unix:{path}")
+
+    @staticmethod
+    def _bind_socket(path):
+        # The permissions of a new socket file depend on the umask; they are restricted to
+        # the owner before the socket starts listening, so that no one else can ever connect.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(path)
+        except:
+            sock.close()
+            raise
+        try:
+            os.chmod(path, 0o600)
+        except:
+            sock.close()
+            os.unlink(path)
+            raise
+        return sock
+
+    async def _handle(self, reader, writer):
+        try:
+            async with self._lock:
+                request_line = await reader.readline()
+                if not request_line:
+                    return # connected and disconnected without a request
+                request = json.loads(request_line)
+                if not isinstance(request, dict):
+                    raise ValueError("request is not an object")
+                if "script" in request:
+                    self._logger.info("running script %r", request.get("filename", "<script>"))
+                    response = await self._run_script(request)
+                    writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                elif request.get("forward"):
+                    self._logger.info("forwarding applet pipe")
+                    await self._forward(reader, writer)
+                else:
+                    raise ValueError("unknown request")
+                await writer.drain()
+        except (ValueError, UnicodeDecodeError) as error:
+            self._logger.warning("invalid request: %s", error)
+            writer.write(json.dumps({"status": "error", "error": str(error)}).encode() + b"\n")
+        except ConnectionError as error:
+            self._logger.info("connection lost: %s", error)
+        finally:
+            writer.close()
+
+    async def _run_script(self, request):
+        output = io.StringIO()
+        try:
+            code = compile(request["script"], filename=request.get("filename", "<script>"),
+                           mode="exec", flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+            script_globals = self._make_globals(list(request.get("args", [])))
+            script_globals["print"] = functools.partial(print, file=output)
+            future = eval(code, script_globals)
+            if future is not None:
+                await future
+        except asyncio.CancelledError:
+            raise
+        except SystemExit as exn:
+            if exn.code not in (None, 0):
+                return {"status": "error", "output": output.getvalue(),
+                        "error": f"script exited with code {exn.code}"}
+        except BaseException as exn:
+            self._logger.warning("script raised an exception: %s", exn)
+            return {"status": "error", "output": output.getvalue(),
+                    "error": "".join(traceback.format_exception(exn))}
+        finally:
+            await self._iface_flush()
+        return {"status": "ok", "output": output.getvalue()}
+
+    async def _iface_flush(self):
+        if hasattr(self._iface, "flush"):
+            await self._iface.flush()
+
+    async def _forward(self, reader, writer):
+        if not (hasattr(self._iface, "read") and hasattr(self._iface, "write")):
+            raise ValueError("applet interface does not support forwarding")
+        writer.write(json.dumps({"status": "ok"}).encode("utf-8") + b"\n")
+
+        async def forward_out():
+            while data := await reader.read(65536):
+                await self._iface.write(data)
+                await self._iface_flush()
+        async def forward_in():
+            while True:
+                writer.write(await self._iface.read())
+                await writer.drain()
+
+        forward_out_fut = asyncio.ensure_future(forward_out())
+        forward_in_fut  = asyncio.ensure_future(forward_in())
+        try:
+            await asyncio.wait([forward_out_fut, forward_in_fut],
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for future in (forward_out_fut, forward_in_fut):
+                future.cancel()
+            await asyncio.wait([forward_out_fut, forward_in_fut])
+        for future in (forward_out_fut, forward_in_fut):
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+
+
+async def _daemon_connect(sock_addr, request):
+    proto, *proto_args = sock_addr
+    if proto == "unix":
+        reader, writer = await asyncio.open_unix_connection(*proto_args)
+    else:
+        raise OSError(errno.EPROTONOSUPPORT,
+                      f"the daemon can only be reached at a UNIX socket, not {proto}:")
+    writer.write(json.dumps(request).encode("utf-8") + b"\n")
+    await writer.drain()
+    return reader, writer
+
+
+async def daemon_run_script(sock_addr, code, *, filename="<script>", args=[]):
+    """Run a script in a daemon. Returns the response object."""
+    reader, writer = await _daemon_connect(sock_addr,
+        {"script": code, "filename": filename, "args": list(args)})
+    try:
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+
+async def daemon_forward(sock_addr, read_input, write_output):
+    """Forward the applet pipe of a daemon.
+
+    ``read_input`` is an async function returning data to be sent to the applet (or an empty
+    bytes object at end of input), and ``write_output`` is an async function consuming data
+    received from the applet.
+    """
+    reader, writer = await _daemon_connect(sock_addr, {"forward": True})
+    try:
+        response = json.loads(await reader.readline())
+        if response["status"] != "ok":
+            return response
+
+        async def forward_out():
+            while data := await read_input():
+                writer.write(data)
+                await writer.drain()
+            writer.write_eof()
+        async def forward_in():
+            while data := await reader.read(65536):
+                await write_output(data)
+
+        forward_out_fut = asyncio.ensure_future(forward_out())
+        forward_in_fut  = asyncio.ensure_future(forward_in())
+        try:
+            await forward_in_fut
+        finally:
+            forward_out_fut.cancel()
+        return response
+    finally:
+        writer.close()
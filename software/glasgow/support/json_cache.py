@@ -0,0 +1,68 @@
+import os
+import json
+import logging
+import pathlib
+import tempfile
+import platformdirs
+
+
+__all__ = ["cache_path", "JSONCache"]
+
+
+logger = logging.getLogger(__name__)
+
+
+def cache_path():
+    """Directory for data that can be recomputed, such as bitstreams."""
+    return platformdirs.user_cache_path("GlasgowEmbedded", appauthor=False)
+
+
+class JSONCache:
+    """A JSON object persisted to a file.
+
+    The cache is only ever an optimization, so any problem reading it (the file is missing,
+    unreadable, truncated, or was written by an incompatible version) results in an empty object,
+    and any problem writing it is logged and otherwise ignored. Writes are atomic: the new contents
+    are written to a temporary file that then replaces the old one, so that concurrently running
+    processes never observe a partially written cache. If several processes update the cache at
+    the same time, the last writer wins.
+    """
+
+    def __init__(self, filename, *, version=1):
+        self.filename = pathlib.Path(filename)
+        self.version  = version
+
+    def load(self):
+        try:
+            with self.filename.open("r") as file:
+                contents = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(contents, dict) or contents.get("version") != self.version:
+            return {}
+        data = contents.get("data")
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def save(self, data):
+        try:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_filename = tempfile.mkstemp(dir=self.filename.parent,
+                                                 prefix=f".{self.filename.name}.")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    json.dump({"version": self.version, "data": data}, file)
+                os.replace(temp_filename, self.filename)
+            except:
+                os.unlink(temp_filename)
+                raise
+        except OSError as error:
+            logger.debug("cannot write cache %r: %s", str(self.filename), error)
+
+    def update(self, updater):
+        """Load the cache, call ``updater`` to modify the loaded object in place, and save it."""
+        data = self.load()
+        updater(data)
+        self.save(data)
+        return data
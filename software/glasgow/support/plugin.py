@@ -1,13 +1,18 @@
 import re
 import os
 import sys
+import hashlib
+import functools
 import traceback
+import importlib
 import importlib.metadata
 import packaging.requirements
 import pathlib
 import sysconfig
 import logging
 
+from .json_cache import JSONCache, cache_path
+
 
 __all__ = ["PluginRequirementsUnmet", "PluginLoadError", "PluginMetadata"]
 
@@ -33,15 +38,45 @@ if sys.version_info >= (3, 9, 0) and sys.version_info < (3, 9, 11):
 # package) and importlib_metadata (the PyPI installable shim), so implement this function the way
 # we need ourselves based on the Python 3.9 API. Once we drop Python 3.9 support this abomination
 # can be removed.
-def _entry_points(*, group, name=None):
+#
+# Scanning the installed distributions is fairly slow, so it is done at most once per process.
+@functools.cache
+def _all_entry_points():
+    entry_points = []
     for distribution in importlib.metadata.distributions():
         if not hasattr(distribution, "name"):
             distribution.name = distribution.metadata["Name"]
         for entry_point in distribution.entry_points:
-            if entry_point.group == group and (name is None or entry_point.name == name):
-                if not hasattr(entry_point, "dist"):
-                    entry_point.dist = distribution
-                yield entry_point
+            if not hasattr(entry_point, "dist"):
+                entry_point.dist = distribution
+            entry_points.append(entry_point)
+    return entry_points
+
+
+def _entry_points(*, group, name=None):
+    for entry_point in _all_entry_points():
+        if entry_point.group == group and (name is None or entry_point.name == name):
+            yield entry_point
+
+
+def _distributions_fingerprint():
+    # Installing, upgrading, or removing a distribution always creates or removes its metadata
+    # directory, which changes its modification time. This is much cheaper to check than reading
+    # the entry points of every distribution.
+    hasher = hashlib.blake2s()
+    for path in sys.path:
+        try:
+            names = sorted(name for name in os.listdir(path or ".")
+                           if name.endswith((".dist-info", ".egg-info")))
+        except OSError:
+            continue
+        for name in names:
+            try:
+                mtime_ns = os.stat(os.path.join(path or ".", name)).st_mtime_ns
+            except OSError:
+                continue
+            hasher.update(f"{path}\0{name}\0{mtime_ns}\0".encode())
+    return hasher.hexdigest()
 
 
 def _requirements_for_optional_dependencies(distribution, depencencies):
@@ -110,9 +145,15 @@ class PluginMetadata:
 
     _out_of_tree_warning_printed_for = set()
 
+    # Displaying the list of plugins should not require importing every one of them (together with
+    # all of their dependencies), so the person-side metadata of every plugin that could be loaded
+    # is kept in a persistent cache. The cache is discarded whenever the set of installed
+    # distributions changes, and an entry is discarded whenever the module defining the plugin
+    # is modified.
+    _metadata_cache = JSONCache(cache_path() / "plugins.json")
+
     @classmethod
-    def _loadable(cls, entry_point):
-        dist_name = entry_point.dist.name
+    def _loadable(cls, dist_name):
         if dist_name == "glasgow":
             return True # in-tree
         if os.getenv("GLASGOW_OUT_OF_TREE_APPLETS") == "I-am-okay-with-breaking-changes":
@@ -123,45 +164,113 @@ class PluginMetadata:
             return True
         return False
 
+    @classmethod
+    def _records(cls):
+        cache = cls._metadata_cache.load()
+        fingerprint = _distributions_fingerprint()
+        if cache.get("fingerprint") == fingerprint and cls.GROUP_NAME in cache.get("groups", {}):
+            return cache["groups"][cls.GROUP_NAME], False
+
+        logger.trace("plugin metadata cache for %r is stale, rescanning distributions",
+                     cls.GROUP_NAME)
+        records = {}
+        for entry_point in _entry_points(group=cls.GROUP_NAME):
+            requirements = _requirements_for_optional_dependencies(
+                entry_point.dist, entry_point.extras)
+            records[entry_point.name] = {
+                "module": entry_point.module,
+                "cls_name": entry_point.attr,
+                "dist_name": entry_point.dist.name,
+                "requirements": sorted(map(str, requirements)),
+            }
+        return records, True
+
+    @classmethod
+    def _save_records(cls, records):
+        def update(cache):
+            fingerprint = _distributions_fingerprint()
+            if cache.get("fingerprint") != fingerprint:
+                cache.clear()
+                cache["fingerprint"] = fingerprint
+            cache.setdefault("groups", {})[cls.GROUP_NAME] = records
+        cls._metadata_cache.update(update)
+
     @classmethod
     def get(cls, handle):
-        entry_point, *_ = _entry_points(group=cls.GROUP_NAME, name=handle)
-        return cls(entry_point)
+        records, changed = cls._records()
+        metadata = cls(handle, records[handle])
+        if changed or metadata._changed:
+            cls._save_records(records)
+        return metadata
 
     @classmethod
     def all(cls):
-        return {ep.name: cls(ep) for ep in _entry_points(group=cls.GROUP_NAME) if cls._loadable(ep)}
+        records, changed = cls._records()
+        result = {}
+        for handle, record in records.items():
+            if cls._loadable(record["dist_name"]):
+                result[handle] = metadata = cls(handle, record)
+                changed |= metadata._changed
+        if changed:
+            cls._save_records(records)
+        return result
+
+    @classmethod
+    def _describe(cls, plugin_cls):
+        """Return the person-side metadata for a loaded plugin class.
+
+        The returned dictionary is stored in the plugin metadata cache and must be serializable
+        to JSON. Subclasses may extend it with metadata specific to the kind of plugin.
+        """
+        return {
+            "synopsis": plugin_cls.help,
+            "description": plugin_cls.description,
+        }
 
-    def __init__(self, entry_point):
-        assert self._loadable(entry_point)
+    def __init__(self, handle, record):
+        assert self._loadable(record["dist_name"])
 
         # Python-side metadata (how to load it, etc.)
-        self.module = entry_point.module
-        self.cls_name = entry_point.attr
-        self.dist_name = entry_point.dist.name
-        self.requirements = _requirements_for_optional_dependencies(
-            entry_point.dist, entry_point.extras)
+        self.module = record["module"]
+        self.cls_name = record["cls_name"]
+        self.dist_name = record["dist_name"]
+        self.requirements = set(map(packaging.requirements.Requirement, record["requirements"]))
 
         # Person-side metadata (how to display it, etc.)
-        self.handle = entry_point.name
+        self.handle = handle
+        self._cls = None
+        self._changed = False
         if not self.unmet_requirements:
-            try:
-                self._cls = entry_point.load()
-                self.synopsis = self._cls.help
-                self.description = self._cls.description
-            except Exception as exn:
-                self._cls = None
-                # traceback.format_exception_only can return multiple lines
-                self.synopsis = (
-                    f"/!\\ unavailable due to a load error: "
-                    "".join(traceback.format_exception_only(exn)).splitlines()[0])
-                # traceback.format_exception can return lines with internal newlines
-                self.description = (
-                    f"\nThis plugin is unavailable because attempting to load it has raised "
-                    f"an exception. The exception is:\n\n    " +
-                    "".join(traceback.format_exception(exn)).replace("\n", "\n    "))
+            described = record.get("described")
+            if described is not None and self._source_stamp(described["source"][0]) == \
+                    described["source"]:
+                self._metadata = described["metadata"]
+            else:
+                self._changed = True
+                try:
+                    self._cls = self._import()
+                    self._metadata = self._describe(self._cls)
+                    record["described"] = {
+                        "source": self._source_stamp(sys.modules[self.module].__file__),
+                        "metadata": self._metadata,
+                    }
+                except Exception as exn:
+                    record.pop("described", None)
+                    self._metadata = None
+                    # traceback.format_exception_only can return multiple lines
+                    self.synopsis = (
+                        f"/!\\ unavailable due to a load error: "
+                        "".join(traceback.format_exception_only(exn)).splitlines()[0])
+                    # traceback.format_exception can return lines with internal newlines
+                    self.description = (
+                        f"\nThis plugin is unavailable because attempting to load it has raised "
+                        f"an exception. The exception is:\n\n    " +
+                        "".join(traceback.format_exception(exn)).replace("\n", "\n    "))
+            if self._metadata is not None:
+                self.synopsis = self._metadata["synopsis"]
+                self.description = self._metadata["description"]
         else:
-            self._cls = None
+            self._metadata = None
             self.synopsis = (
                 f"/!\\ unavailable due to unmet requirements: "
                 f"{', '.join(str(r) for r in self.unmet_requirements)}")
@@ -171,6 +280,17 @@ class PluginMetadata:
                 _install_command_for_requirements(self.unmet_requirements) +
                 f"\n")
 
+    def _import(self):
+        return getattr(importlib.import_module(self.module), self.cls_name)
+
+    @staticmethod
+    def _source_stamp(filename):
+        try:
+            stat = os.stat(filename)
+        except (TypeError, OSError):
+            return None
+        return [filename, stat.st_size, stat.st_mtime_ns]
+
     @property
     def unmet_requirements(self):
         return _unmet_requirements_in(self.requirements)
@@ -181,13 +301,18 @@ class PluginMetadata:
 
     @property
     def loadable(self):
-        return self._cls is not None
+        return self._metadata is not None
 
     def load(self):
         if self.unmet_requirements:
             raise PluginRequirementsUnmet(self)
-        if self._cls is None:
+        if self._metadata is None:
             raise PluginLoadError(self)
+        if self._cls is None:
+            try:
+                self._cls = self._import()
+            except Exception as exn:
+                raise PluginLoadError(self) from exn
         return self._cls
 
     def __repr__(self):
@@ -0,0 +1,163 @@
+import queue
+import asyncio
+import logging
+import threading
+
+
+__all__ = ["TraceWorker"]
+
+
+class TraceWorker:
+    """
+    Analyzer trace writer running in a worker thread.
+
+    Decoding the analyzer trace and writing it to a VCD file is slow enough that doing it on
+    the event loop would starve the applet being traced (and then the analyzer FIFO would overrun
+    for lack of anyone draining it). Instead, the event loop only reads raw chunks from the device
+    and passes them to :meth:`put`; a worker thread decodes them with ``decoder`` (a
+    :class:`TraceDecoder`) and writes the events to ``vcd_writer``.
+
+    The chunks are passed through a queue holding at most ``max_chunks`` chunks. If the worker
+    falls behind so far that the queue is full, :meth:`put` waits (without blocking the event
+    loop) until there is space again; the analyzer FIFO in the device absorbs the difference.
+    The deepest the queue has been is reported when the worker is closed.
+    """
+    def __init__(self, decoder, vcd_writer, *, sys_clk_freq, logger, max_chunks=1024):
+        self._decoder      = decoder
+        self._vcd_writer   = vcd_writer
+        self._sys_clk_freq = sys_clk_freq
+        self._logger       = logger
+
+        self._loop      = asyncio.get_event_loop()
+        self._queue     = queue.Queue(max_chunks)
+        self._finished  = self._loop.create_future()
+        self._exception = None
+
+        # Queue statistics; the byte count is updated from both threads.
+        self._lock              = threading.Lock()
+        self._queued_bytes      = 0
+        self._max_queued_bytes  = 0
+        self._max_queued_chunks = 0
+        self._full_count        = 0
+
+        self._signals = {}
+        self._strobes = set()
+        for event_name, event_kind, event_width in decoder.events():
+            if event_kind == "throttle":
+                var_type, var_init = "wire", 0
+            elif event_kind == "change":
+                var_type, var_init = "wire", "x" * event_width
+            elif event_kind == "strobe":
+                if event_width > 0:
+                    var_type, var_init = "tri", "z"
+                else:
+                    var_type, var_init = "event", None
+            else:
+                assert False
+            self._signals[event_name] = vcd_writer.register_var(
+                scope="", name=event_name, var_type=var_type, size=event_width, init=var_init)
+            if event_kind == "strobe" and event_width > 0:
+                self._strobes.add(event_name)
+        self._init = True
+        self._next_timestamp = 0
+
+        self._thread = threading.Thread(target=self._run, name="TraceWorker", daemon=True)
+        self._thread.start()
+
+    async def put(self, data):
+        """Queue a chunk of raw analyzer data for decoding."""
+        data = bytes(data) # the buffer may be reused once we return
+        with self._lock:
+            self._queued_bytes += len(data)
+            self._max_queued_bytes = max(self._max_queued_bytes, self._queued_bytes)
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self._full_count += 1
+            await self._loop.run_in_executor(None, self._queue.put, data)
+        self._max_queued_chunks = max(self._max_queued_chunks, self._queue.qsize())
+
+    async def wait(self):
+        """Wait until the trace has ended (or the worker has failed)."""
+        await asyncio.shield(self._finished)
+
+    async def close(self):
+        """
+        Finish writing the trace and stop the worker. Re-raises any exception raised while
+        decoding or writing the trace.
+        """
+        await self._loop.run_in_executor(None, self._queue.put, None)
+        await self._loop.run_in_executor(None, self._thread.join)
+        self._logger.info("trace queue high-water mark: %d chunks (%d bytes) of %d chunks; "
+                          "full %d times",
+                          self._max_queued_chunks, self._max_queued_bytes, self._queue.maxsize,
+                          self._full_count)
+        if self._full_count:
+            self._logger.warning("trace decoding fell behind the analyzer %d times; "
+                                 "the applet may have been slowed down", self._full_count)
+        if self._exception is not None:
+            raise self._exception
+
+    def _get(self):
+        # Coalesce everything that is already queued, to amortize the per-chunk overhead.
+        chunks = [self._queue.get()]
+        while chunks[-1] is not None:
+            try:
+                chunks.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._queued_bytes -= sum(len(chunk) for chunk in chunks if chunk is not None)
+        return chunks
+
+    def _run(self):
+        stopped = False
+        try:
+            while not stopped:
+                chunks = self._get()
+                if chunks[-1] is None:
+                    stopped = True
+                    chunks.pop()
+                for chunk in chunks:
+                    self._decoder.process(chunk)
+                self._write(self._decoder.flush_columns(pending=stopped))
+                if self._decoder.is_done():
+                    break
+            self._vcd_writer.close(self._next_timestamp)
+        except BaseException as exn:
+            self._exception = exn
+        finally:
+            self._loop.call_soon_threadsafe(self._set_finished)
+            # Keep draining the queue, so that `put()` never waits for a worker that has stopped.
+            while not stopped:
+                stopped = None in self._get()
+
+    def _set_finished(self):
+        if not self._finished.done():
+            self._finished.set_result(None)
+
+    def _write(self, trace):
+        vcd_writer = self._vcd_writer
+        signals    = self._signals
+        log_events = self._logger.isEnabledFor(logging.TRACE)
+        for cycle, events in trace.rows():
+            if log_events:
+                self._logger.trace("cycle %d: %s", cycle,
+                                   " ".join(f"{n}={v}" for n, v in events.items()))
+
+            timestamp            = int(1e8 * (cycle + 0) // self._sys_clk_freq)
+            self._next_timestamp = int(1e8 * (cycle + 1) // self._sys_clk_freq)
+            if self._init:
+                self._init = False
+                vcd_writer._timestamp = timestamp
+            for name, value in events.items():
+                vcd_writer.change(signals[name], timestamp, True if value is None else value)
+            for name in events:
+                if name in self._strobes:
+                    vcd_writer.change(signals[name], self._next_timestamp, "z")
+        if trace.overrun is not None:
+            self._logger.error("FIFO overrun, shutting down")
+            for signal in signals.values():
+                vcd_writer.change(signal, self._next_timestamp, "x")
+            self._next_timestamp += 100 # 1us
+        vcd_writer.flush()
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import logging
+import hashlib
+import tempfile
+
+from ..support.json_cache import JSONCache, cache_path
+
+
+__all__ = ["BitstreamCache", "parse_size"]
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(size):
+    """Parse a size in bytes with an optional binary suffix, e.g. ``512K``, ``256M``, ``1G``."""
+    m = re.match(r"^\s*(\d+)\s*([KMG]?)i?B?\s*$", str(size), re.I)
+    if m is None:
+        raise ValueError(f"{size!r} is not a valid size")
+    return int(m[1]) << {"": 0, "K": 10, "M": 20, "G": 30}[m[2].upper()]
+
+
+class BitstreamCache:
+    """Size-bounded cache of built bitstreams.
+
+    Each bitstream is stored in a file named after its bitstream ID, prefixed with the blake2s
+    hash of the bitstream data. The cache index records the size of each file, the time it was
+    last used, and whether (and at which size and modification time) the hash has been verified;
+    a verified file that has not changed since is not hashed again on subsequent uses.
+
+    Whenever a bitstream is added, the least recently used bitstreams are evicted until the total
+    size of the cache is below ``max_size`` bytes. The default is taken from the environment
+    variable ``GLASGOW_BITSTREAM_CACHE_SIZE``, or is :data:`DEFAULT_MAX_SIZE` if it is not set.
+
+    Files in the cache directory that are not in the index (e.g. ones written by an older version
+    of the software) are adopted on first use, with their modification time as the last use time.
+    """
+
+    DEFAULT_MAX_SIZE = 256 << 20
+
+    _HASH_SIZE = hashlib.blake2s().digest_size
+
+    def __init__(self, path=None, *, max_size=None):
+        if path is None:
+            path = cache_path() / "bitstreams"
+        if max_size is None:
+            max_size = self.DEFAULT_MAX_SIZE
+            if "GLASGOW_BITSTREAM_CACHE_SIZE" in os.environ:
+                try:
+                    max_size = parse_size(os.environ["GLASGOW_BITSTREAM_CACHE_SIZE"])
+                except ValueError as error:
+                    logger.warning(f"ignoring GLASGOW_BITSTREAM_CACHE_SIZE: {error}")
+        self.path     = path
+        self.max_size = max_size
+        self._index   = JSONCache(self.path / "index.json")
+
+    def filename(self, bitstream_id):
+        return self.path / bitstream_id.hex()
+
+    def _scan(self, index):
+        # Reconcile the index with the directory contents: forget entries whose files were removed
+        # behind our back, and adopt files that were added behind our back.
+        try:
+            names = {name for name in os.listdir(self.path) if re.match(r"^[0-9a-f]{32}$", name)}
+        except FileNotFoundError:
+            names = set()
+        for name in set(index) - names:
+            del index[name]
+        for name in names - set(index):
+            try:
+                stat = os.stat(self.path / name)
+            except FileNotFoundError:
+                continue
+            index[name] = {"size": stat.st_size, "last_used": stat.st_mtime, "verified": None}
+        return index
+
+    def entries(self):
+        """Return a list of ``(bitstream_id, size, last_used, verified)`` tuples for all cached
+        bitstreams, most recently used first."""
+        index = self._index.update(self._scan)
+        return [
+            (bytes.fromhex(name), entry["size"], entry["last_used"], entry["verified"] is not None)
+            for name, entry in sorted(index.items(), key=lambda item: -item[1]["last_used"])
+        ]
+
+    def total_size(self):
+        return sum(size for _, size, _, _ in self.entries())
+
+    def __contains__(self, bitstream_id):
+        return self.filename(bitstream_id).exists()
+
+    def get(self, bitstream_id):
+        """Return the cached bitstream data, or ``None`` if it is not cached or is corrupted."""
+        name = bitstream_id.hex()
+        filename = self.filename(bitstream_id)
+        try:
+            with filename.open("rb") as cache_file:
+                stat = os.fstat(cache_file.fileno())
+                bitstream_hash = cache_file.read(self._HASH_SIZE)
+                bitstream_data = cache_file.read()
+        except FileNotFoundError:
+            return None
+
+        verified = [bitstream_hash.hex(), stat.st_size, stat.st_mtime_ns]
+        index = self._index.load()
+        entry = index.get(name)
+        if entry is not None and entry.get("verified") == verified:
+            logger.trace(f"bitstream ID {name} was verified previously")
+        elif hashlib.blake2s(bitstream_data).digest() == bitstream_hash:
+            logger.trace(f"bitstream ID {name} was verified")
+        else:
+            logger.warning(f"cached bitstream ID {name} is corrupted, removing")
+            self.remove(bitstream_id)
+            return None
+
+        index[name] = {"size": stat.st_size, "last_used": time.time(), "verified": verified}
+        self._index.save(index)
+        return bitstream_data
+
+    def put(self, bitstream_id, bitstream_data):
+        """Add a bitstream to the cache, and evict least recently used bitstreams if the cache
+        would otherwise exceed its size limit."""
+        name = bitstream_id.hex()
+        bitstream_hash = hashlib.blake2s(bitstream_data).digest()
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Write the file atomically, so that concurrent builds of the same bitstream never result
+        # in a truncated file being observed (and then reported as corrupted).
+        fd, temp_filename = tempfile.mkstemp(dir=self.path, prefix=f".{name}.")
+        try:
+            with os.fdopen(fd, "wb") as cache_file:
+                cache_file.write(bitstream_hash)
+                cache_file.write(bitstream_data)
+            os.replace(temp_filename, self.filename(bitstream_id))
+        except:
+            os.unlink(temp_filename)
+            raise
+        stat = os.stat(self.filename(bitstream_id))
+
+        def update(index):
+            index[name] = {"size": stat.st_size, "last_used": time.time(),
+                           "verified": [bitstream_hash.hex(), stat.st_size, stat.st_mtime_ns]}
+            self._evict(self._scan(index), self.max_size, keep=name)
+        self._index.update(update)
+
+    def remove(self, bitstream_id):
+        name = bitstream_id.hex()
+        try:
+            self.filename(bitstream_id).unlink()
+        except FileNotFoundError:
+            pass
+        self._index.update(lambda index: index.pop(name, None))
+
+    def _evict(self, index, max_size, keep=None):
+        evicted = []
+        total_size = sum(entry["size"] for entry in index.values())
+        for name, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total_size <= max_size:
+                break
+            if name == keep:
+                continue
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+            del index[name]
+            total_size -= entry["size"]
+            evicted.append(bytes.fromhex(name))
+            logger.debug(f"evicted bitstream ID {name} ({entry['size']} bytes)")
+        return evicted
+
+    def prune(self, max_size=None):
+        """Evict least recently used bitstreams until the total size of the cache is at most
+        ``max_size`` bytes (or the configured limit, if not specified). Returns the list of
+        evicted bitstream IDs."""
+        if max_size is None:
+            max_size = self.max_size
+        evicted = []
+        self._index.update(lambda index: evicted.extend(self._evict(self._scan(index), max_size)))
+        return evicted
@@ -1,11 +1,15 @@
 import os
 import sys
+import json
+import time
 import tempfile
 import shutil
 import logging
 import hashlib
 import pathlib
-import platformdirs
+import functools
+import concurrent.futures
+import amaranth
 from amaranth import *
 from amaranth.lib import io
 from amaranth.build import ResourceError
@@ -14,17 +18,95 @@ from ..gateware.i2c import I2CTarget
 from ..gateware.registers import I2CRegisters
 from ..gateware.fx2_crossbar import FX2Crossbar
 from .analyzer import GlasgowAnalyzer
+from .. import __version__
+from ..support.json_cache import JSONCache, cache_path
 from .toolchain import find_toolchain
+from .cache import BitstreamCache
 
 
-__all__ = ["GlasgowHardwareTarget"]
+__all__ = ["GlasgowHardwareTarget", "GlasgowBuildPlan", "build_bitstreams"]
 
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def _tree_fingerprint(root):
+    # The Python code in use cannot change while the process runs (other than by reloading it,
+    # which is not supported), so each tree is only walked once per process.
+    hasher = hashlib.blake2s()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            hasher.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return hasher.hexdigest()
+
+
+def _source_fingerprint(*modules):
+    # Elaboration is only skipped if none of the Python code that could have been involved in it
+    # has changed. Hashing the sources would take about as long as elaborating a small applet, so
+    # only the file metadata is used; any edit, reinstall, or checkout changes the mtime.
+    roots = set()
+    for module_name in modules:
+        module = sys.modules.get(module_name)
+        if module is None or getattr(module, "__file__", None) is None:
+            continue
+        roots.add(pathlib.Path(module.__file__).parent)
+    for root in list(roots):
+        if any(parent in roots for parent in root.parents):
+            roots.remove(root)
+
+    hasher = hashlib.blake2s()
+    for root in sorted(roots):
+        hasher.update(f"{root}\0{_tree_fingerprint(root)}\0".encode())
+    return hasher.hexdigest()
+
+
+class _BitstreamIndex:
+    """Persistent mapping from build inputs to bitstream IDs.
+
+    Computing a bitstream ID requires elaborating and lowering the entire design to RTLIL, which
+    takes a significant fraction of applet startup time even when the bitstream itself is cached
+    or already loaded. The index remembers which bitstream ID a given set of build inputs resulted
+    in the last time, so that elaboration can be skipped entirely.
+    """
+
+    def __init__(self):
+        self._cache = JSONCache(cache_path() / "bitstream-index.json")
+
+    @staticmethod
+    def key_digest(key):
+        def default(obj):
+            if isinstance(obj, (set, frozenset)):
+                return sorted(obj)
+            raise TypeError(f"{type(obj).__name__} cannot be used in a bitstream index key")
+        try:
+            encoded = json.dumps(key, sort_keys=True, default=default)
+        except (TypeError, ValueError) as error:
+            logger.trace("bitstream index not used: %s", error)
+            return None
+        return hashlib.blake2s(encoded.encode("utf-8")).hexdigest()
+
+    def lookup(self, key_digest):
+        bitstream_id_hex = self._cache.load().get(key_digest)
+        if bitstream_id_hex is None:
+            return None
+        try:
+            return bytes.fromhex(bitstream_id_hex)
+        except (TypeError, ValueError):
+            return None
+
+    def insert(self, key_digest, bitstream_id):
+        self._cache.update(lambda data: data.__setitem__(key_digest, bitstream_id.hex()))
+
+
 class GlasgowHardwareTarget(Elaboratable):
     def __init__(self, revision, multiplexer_cls=None, with_analyzer=False):
+        self.revision = revision
         if revision in ("A0", "B0"):
             from ..platform.rev_ab import GlasgowRevABPlatform
             self.platform = GlasgowRevABPlatform()
@@ -103,35 +185,96 @@ class GlasgowHardwareTarget(Elaboratable):
     def add_submodule(self, sub):
         self._submodules.append(sub)
 
-    def build_plan(self, **kwargs):
+    def build_plan(self, *, applet=None, build_args=None, **kwargs):
+        """Prepare the design for building.
+
+        If ``applet`` and ``build_args`` (a mapping of the values of all of the arguments that
+        were used to build ``applet``) are provided, and the same applet was built with the same
+        arguments by the same version of the software before, the bitstream ID is taken from
+        the bitstream index and elaboration is deferred until it is actually needed (that is,
+        until the bitstream is not found in the cache, or RTLIL is requested).
+        """
         overrides = {
             "emit_src": False,
             "synth_opts": "-abc9",
             "nextpnr_opts": "--placer heap",
         }
         overrides.update(kwargs)
-        return GlasgowBuildPlan(find_toolchain(), self.platform.prepare(self, **overrides))
+        toolchain = find_toolchain()
+
+        index_key = None
+        if applet is not None and build_args is not None:
+            applet_cls = type(applet)
+            index_key = {
+                "glasgow": __version__,
+                "amaranth": amaranth.__version__,
+                "sources": _source_fingerprint(__name__.split(".")[0], applet_cls.__module__),
+                "applet": f"{applet_cls.__module__}.{applet_cls.__qualname__}",
+                "build_args": dict(build_args),
+                "revision": self.revision,
+                "platform": type(self.platform).__qualname__,
+                "analyzer": self.analyzer is not None,
+                "overrides": overrides,
+                "toolchain": toolchain.identifier.hex(),
+            }
+
+        return GlasgowBuildPlan(toolchain, lambda: self.platform.prepare(self, **overrides),
+                                index_key=index_key)
 
 
 class GlasgowBuildPlan:
-    def __init__(self, toolchain, lower):
+    def __init__(self, toolchain, prepare, *, index_key=None):
         self.toolchain = toolchain
-        self.lower = lower
+        self._prepare = prepare
+        self._lower = None
         self._bitstream_id = None
+        self._cache = BitstreamCache()
+
+        self._index = None
+        self._index_digest = None
+        if index_key is not None:
+            self._index_digest = _BitstreamIndex.key_digest(index_key)
+            if self._index_digest is not None:
+                self._index = _BitstreamIndex()
+
+    @property
+    def lower(self):
+        if self._lower is None:
+            self._lower = self._prepare()
+        return self._lower
 
     @property
     def rtlil(self):
         return self.lower.files["top.il"]
 
+    def _elaborated_bitstream_id(self):
+        hasher = hashlib.blake2s()
+        hasher.update(self.toolchain.identifier)
+        hasher.update(self.lower.digest())
+        bitstream_id = hasher.digest()[:16]
+        if self._index is not None:
+            self._index.insert(self._index_digest, bitstream_id)
+        return bitstream_id
+
     @property
     def bitstream_id(self):
+        if self._bitstream_id is None and self._index is not None:
+            bitstream_id = self._index.lookup(self._index_digest)
+            # An indexed bitstream ID is only useful if either the device already has it
+            # loaded or the bitstream can be read from the cache; otherwise elaboration
+            # cannot be avoided anyway.
+            if bitstream_id is not None and bitstream_id in self._cache:
+                logger.debug(f"bitstream ID {bitstream_id.hex()} found in index, "
+                             f"skipping elaboration")
+                self._bitstream_id = bitstream_id
         if self._bitstream_id is None:
-            hasher = hashlib.blake2s()
-            hasher.update(self.toolchain.identifier)
-            hasher.update(self.lower.digest())
-            self._bitstream_id = hasher.digest()[:16]
+            self._bitstream_id = self._elaborated_bitstream_id()
         return self._bitstream_id
 
+    @property
+    def cached(self):
+        return self.bitstream_id in self._cache
+
     def archive(self, filename):
         self.lower.archive(filename)
 
@@ -157,25 +300,82 @@ class GlasgowBuildPlan:
         return bitstream
 
     def get_bitstream(self, *, debug=False):
-        cache_path = platformdirs.user_cache_path("GlasgowEmbedded", appauthor=False)
-        cache_filename = cache_path / "bitstreams" / self.bitstream_id.hex()
-        cache_exists = False
-        if cache_filename.exists():
-            with cache_filename.open("rb") as cache_file:
-                bitstream_hash = cache_file.read(hashlib.blake2s().digest_size)
-                bitstream_data = cache_file.read()
-                if hashlib.blake2s(bitstream_data).digest() == bitstream_hash:
-                    cache_exists = True
-        if cache_exists:
+        bitstream_data = self._cache.get(self.bitstream_id)
+        if bitstream_data is None and self._lower is None:
+            # The bitstream ID was taken from the index, but the cached bitstream has disappeared
+            # or is corrupted since. Elaborate the design after all, and make sure the ID was
+            # right; if it was not, the cache may still have the bitstream with the correct ID.
+            bitstream_id = self._elaborated_bitstream_id()
+            if bitstream_id != self._bitstream_id:
+                logger.debug(f"bitstream ID {self._bitstream_id.hex()} from index is stale, "
+                             f"actual bitstream ID is {bitstream_id.hex()}")
+                self._bitstream_id = bitstream_id
+                bitstream_data = self._cache.get(self.bitstream_id)
+        cache_filename = self._cache.filename(self.bitstream_id)
+        if bitstream_data is not None:
             logger.debug(f"bitstream ID {self.bitstream_id.hex()} is cached")
             logger.trace(f"bitstream was read from {str(cache_filename)!r}")
         else:
             logger.debug(f"bitstream ID {self.bitstream_id.hex()} is not cached, executing build")
             bitstream_data = self.execute(debug=debug)
-            bitstream_hash = hashlib.blake2s(bitstream_data).digest()
-            cache_filename.parent.mkdir(parents=True, exist_ok=True)
-            with cache_filename.open("wb") as cache_file:
-                cache_file.write(bitstream_hash)
-                cache_file.write(bitstream_data)
-            logger.trace(f"bitstream was written to {str(cache_filename)!r}")
+            self._store_bitstream(bitstream_data)
         return bitstream_data
+
+    def _store_bitstream(self, bitstream_data):
+        self._cache.put(self.bitstream_id, bitstream_data)
+        logger.trace(f"bitstream was written to {str(self._cache.filename(self.bitstream_id))!r}")
+
+
+def build_bitstreams(plans, *, jobs=None, debug=False):
+    """Build bitstreams for several designs in parallel.
+
+    ``plans`` is an iterable of ``(name, plan)`` pairs. Designs are elaborated one at a time in
+    the calling thread, since elaboration is not thread-safe; designs whose bitstream is already
+    cached are not built again. The rest are built by up to ``jobs`` concurrently running
+    toolchains (by default, one per CPU core), and their bitstreams are stored in the cache.
+    The toolchain always runs in child processes, so a thread is enough to wait for each. The
+    bitstreams are stored in the cache by the calling thread as well, since concurrent updates
+    of the cache index would overwrite each other.
+
+    Yields ``(name, plan, result, elaborate_time, build_time)`` tuples as builds complete, where
+    ``result`` is ``"cached"``, ``"built"``, or the exception that caused the build to fail.
+    """
+    def build(plan):
+        started_at = time.perf_counter()
+        bitstream_data = plan.execute(debug=debug)
+        return bitstream_data, time.perf_counter() - started_at
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = {}
+        pending = {} # bitstream ID → future; identical designs are only built once
+        for name, plan in plans:
+            started_at = time.perf_counter()
+            try:
+                cached = plan.cached
+                if not cached:
+                    plan.lower # elaborate now, if the bitstream ID was taken from the index
+            except Exception as exn:
+                yield name, plan, exn, time.perf_counter() - started_at, 0.0
+                continue
+            elaborate_time = time.perf_counter() - started_at
+            if cached:
+                yield name, plan, "cached", elaborate_time, 0.0
+            elif plan.bitstream_id in pending:
+                futures[pending[plan.bitstream_id]].append((name, plan, elaborate_time))
+            else:
+                logger.debug(f"building bitstream ID {plan.bitstream_id.hex()} for {name}")
+                future = executor.submit(build, plan)
+                pending[plan.bitstream_id] = future
+                futures[future] = [(name, plan, elaborate_time)]
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                bitstream_data, build_time = future.result()
+                _, plan, _ = futures[future][0]
+                plan._store_bitstream(bitstream_data)
+            except Exception as exn:
+                for name, plan, elaborate_time in futures[future]:
+                    yield name, plan, exn, elaborate_time, 0.0
+            else:
+                for name, plan, elaborate_time in futures[future]:
+                    yield name, plan, "built", elaborate_time, build_time
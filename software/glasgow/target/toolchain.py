@@ -8,7 +8,9 @@ import sysconfig
 import logging
 import subprocess
 import re
+import time
 from ..support.lazy import lazy
+from ..support.json_cache import JSONCache, cache_path
 
 
 __all__ = ["ToolchainNotFound", "find_toolchain"]
@@ -173,6 +175,9 @@ class SystemTool(Tool):
     def _iter_data_files(self):
         def iter_files(start):
             for root, dirs, files in os.walk(start):
+                # Directories are included so that adding or removing a data file invalidates
+                # the persistent identifier cache; they are skipped when hashing.
+                yield root
                 for file in files:
                     yield os.path.join(root, file)
 
@@ -193,18 +198,59 @@ class SystemTool(Tool):
 
     _identifier_cache = None
 
+    # Hashing the binary and its data files can involve hundreds of megabytes of I/O, so
+    # the identifier is also kept in a persistent cache, keyed on the path, size, modification
+    # time, and inode of each of the files involved. These are collected without running
+    # the tool, so a cache hit costs only a few `stat()` calls.
+    _persistent_identifier_cache = JSONCache(cache_path() / "toolchain.json")
+
+    @staticmethod
+    def _file_stamp(filename):
+        stat = os.stat(filename)
+        return [filename, stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def _cached_identifier(self):
+        entry = self._persistent_identifier_cache.load().get(f"{self.name}:{self.command}")
+        if entry is None:
+            return None
+        try:
+            if all(self._file_stamp(stamp[0]) == stamp for stamp in entry["stamps"]):
+                return bytes.fromhex(entry["identifier"])
+        except (OSError, KeyError, TypeError, ValueError):
+            pass
+        return None
+
+    def _compute_identifier(self):
+        hasher = hashlib.blake2s()
+        stamps = [self._file_stamp(self.command)]
+        with open(self.command, "rb") as file:
+            hasher.update(file.read())
+        for data_filename in self._iter_data_files():
+            stamps.append(self._file_stamp(data_filename))
+            if os.path.isdir(data_filename):
+                continue
+            with open(data_filename, "rb") as file:
+                hasher.update(file.read())
+        identifier = hasher.digest()[:16]
+        self._persistent_identifier_cache.update(lambda cache:
+            cache.__setitem__(f"{self.name}:{self.command}",
+                              {"stamps": stamps, "identifier": identifier.hex()}))
+        return identifier
+
     # To the Nix person who replaces this with something more sensible: please message @whitequark
     @property
     def identifier(self):
         if self.available:
             if self._identifier_cache is None:
-                hasher = hashlib.blake2s()
-                with open(self.command, "rb") as file:
-                    hasher.update(file.read())
-                for data_filename in self._iter_data_files():
-                    with open(data_filename, "rb") as file:
-                        hasher.update(file.read())
-                self._identifier_cache = hasher.digest()[:16]
+                started_at = time.perf_counter()
+                self._identifier_cache = self._cached_identifier()
+                if self._identifier_cache is not None:
+                    logger.debug(f"tool {self.name!r} identifier was validated from cache "
+                                 f"in {time.perf_counter() - started_at:.3f} s")
+                else:
+                    self._identifier_cache = self._compute_identifier()
+                    logger.debug(f"tool {self.name!r} identifier was computed "
+                                 f"in {time.perf_counter() - started_at:.3f} s")
             return self._identifier_cache
 
 
@@ -0,0 +1,72 @@
+import unittest
+
+from glasgow.access.direct.demultiplexer import _TransferSizing, _max_packets_per_ep
+
+
+class TransferSizingTestCase(unittest.TestCase):
+    def observe_many(self, sizing, count, interval, *, full, backlog, start=0.0):
+        # Transfers that are all in flight at once, completing one after another.
+        for index in range(count):
+            sizing.observe(start, start + (index + 1) * interval, full=full, backlog=backlog)
+        return start + count * interval
+
+    def test_disabled(self):
+        sizing = _TransferSizing(512, 8, 4)
+        self.observe_many(sizing, 100, 0.001, full=True, backlog=True)
+        self.assertEqual((sizing.packets_per_xfer, sizing.xfers_per_queue), (8, 4))
+        self.assertEqual(sizing.grow_count, 0)
+
+    def test_grow_to_budget(self):
+        sizing = _TransferSizing(512, 3, 4, auto_tune=True)
+        self.observe_many(sizing, 100, 0.001, full=True, backlog=True)
+        # Transfers grow as large as the budget allows first, and then the queue deepens.
+        self.assertEqual((sizing.packets_per_xfer, sizing.xfers_per_queue), (192, 5))
+        self.assertLessEqual(sizing.packets_per_xfer * sizing.xfers_per_queue,
+                             _max_packets_per_ep)
+        self.assertEqual(sizing.grow_count, 7)
+
+    def test_queueing_not_counted(self):
+        sizing = _TransferSizing(512, 8, 4, auto_tune=True)
+        # Each transfer is serviced in 2 ms, but the last of them completes 20 ms after it was
+        # submitted; only the service time counts.
+        self.observe_many(sizing, 10, 0.002, full=True, backlog=True)
+        self.assertEqual(sizing.shrink_count, 0)
+        self.assertGreater(sizing.packets_per_xfer, 8)
+
+    def test_idle_gap_not_counted(self):
+        sizing = _TransferSizing(512, 8, 4, auto_tune=True)
+        sizing.observe(0.0, 0.001, full=True, backlog=True)
+        # A transfer submitted long after the previous one completed is measured from submission.
+        sizing.observe(1.0, 1.001, full=True, backlog=True)
+        self.assertEqual(sizing.packets_per_xfer, 32)
+        self.assertEqual(sizing.shrink_count, 0)
+
+    def test_shrink_queue_then_transfers(self):
+        sizing = _TransferSizing(512, 3, 4, auto_tune=True)
+        now = self.observe_many(sizing, 100, 0.001, full=True, backlog=True)
+        self.assertEqual((sizing.packets_per_xfer, sizing.xfers_per_queue), (192, 5))
+        sizing.observe(now, now + 0.050, full=True, backlog=False)
+        # The queue shrinks back to its initial depth before the transfers get smaller.
+        self.assertEqual((sizing.packets_per_xfer, sizing.xfers_per_queue), (192, 4))
+        self.observe_many(sizing, 100, 0.050, full=True, backlog=False, start=now + 0.050)
+        self.assertEqual((sizing.packets_per_xfer, sizing.xfers_per_queue), (1, 4))
+
+    def test_shrink_queue_when_idle(self):
+        sizing = _TransferSizing(512, 3, 4, auto_tune=True)
+        now = self.observe_many(sizing, 100, 0.001, full=True, backlog=True)
+        self.observe_many(sizing, 10, 0.001, full=False, backlog=False, start=now)
+        self.assertEqual((sizing.packets_per_xfer, sizing.xfers_per_queue), (192, 4))
+
+    def test_converge(self):
+        sizing = _TransferSizing(512, 32, 4, auto_tune=True)
+        # A device that produces one packet every 100 us: a transfer of 32 packets takes 3.2 ms,
+        # which is cheap, and one of 64 packets takes 6.4 ms, which is neither cheap nor too long.
+        now = 0.0
+        history = []
+        for _ in range(50):
+            service_time = sizing.packets_per_xfer * 0.0001
+            sizing.observe(now, now + service_time, full=True, backlog=True)
+            now += service_time
+            history.append(sizing.packets_per_xfer)
+        self.assertEqual(history[-10:], [64] * 10)
+        self.assertEqual(sizing.xfers_per_queue, 4)
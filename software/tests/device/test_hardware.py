@@ -0,0 +1,549 @@
+import usb1
+import asyncio
+import pathlib
+import tempfile
+import unittest
+import threading
+from unittest import mock
+
+from glasgow.support.json_cache import JSONCache
+from glasgow.device import GlasgowDeviceError
+from glasgow.device.config import GlasgowConfig
+from glasgow.device.hardware import GlasgowHardwareDevice, VID_QIHW, PID_GLASGOW, \
+    CUR_API_LEVEL, REQ_REGISTER, REQ_FPGA_CFG, REQ_BITSTREAM_ID, ST_FPGA_RDY, \
+    _PollerThread, _TransferPool
+
+
+class MockRegisterDevice(GlasgowHardwareDevice):
+    # Register requests are handled by a dictionary instead of the USB device; every control
+    # transfer yields to the event loop once so that several of them can be in flight at once.
+    def __init__(self, registers, *, missing=()):
+        self._register_shadow = {}
+        self.registers = registers
+        self.missing   = set(missing)
+        self.requests  = []
+        self.inflight  = 0
+        self.max_inflight = 0
+
+    async def _transfer(self, kind, addr):
+        self.requests.append((kind, addr))
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            await asyncio.sleep(0)
+        finally:
+            self.inflight -= 1
+        if addr in self.missing:
+            raise usb1.USBErrorPipe()
+
+    async def control_read(self, request_type, request, value, index, length):
+        assert request == REQ_REGISTER
+        await self._transfer("read", value)
+        return self.registers[value].to_bytes(length, byteorder="little")
+
+    async def control_write(self, request_type, request, value, index, data):
+        assert request == REQ_REGISTER
+        await self._transfer("write", value)
+        self.registers[value] = int.from_bytes(data, byteorder="big")
+
+    async def _status(self):
+        return ST_FPGA_RDY
+
+
+class RegisterPipeliningTestCase(unittest.TestCase):
+    def run_async(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def test_read_registers(self):
+        device = MockRegisterDevice({addr: addr * 3 for addr in range(40)})
+        values = self.run_async(device.read_registers(range(40)))
+        self.assertEqual(values, [addr * 3 for addr in range(40)])
+        self.assertEqual(device.requests, [("read", addr) for addr in range(40)])
+        self.assertEqual(device.max_inflight, device._max_register_requests)
+
+    def test_read_registers_width(self):
+        device = MockRegisterDevice({1: 0x12, 2: 0x3456})
+        values = self.run_async(device.read_registers([1, (2, 2)]))
+        self.assertEqual(values, [0x12, 0x3456])
+
+    def test_write_registers(self):
+        device = MockRegisterDevice({})
+        self.run_async(device.write_registers({addr: addr + 1 for addr in range(20)}))
+        self.assertEqual(device.registers, {addr: addr + 1 for addr in range(20)})
+        self.assertEqual(device.requests, [("write", addr) for addr in range(20)])
+        self.assertEqual(device.max_inflight, device._max_register_requests)
+
+    def test_write_registers_shadow(self):
+        device = MockRegisterDevice({1: 0, 2: 0})
+        self.run_async(device.write_registers({1: 10, 2: 20}))
+        device.requests.clear()
+        self.run_async(device.write_registers({1: 10, 2: 21, 3: (0x1234, 2)}))
+        self.assertEqual(device.requests, [("write", 2), ("write", 3)])
+        self.assertEqual(device.registers, {1: 10, 2: 21, 3: 0x1234})
+        device.requests.clear()
+        self.run_async(device.write_registers({1: 10}, force=True))
+        self.assertEqual(device.requests, [("write", 1)])
+
+    def test_read_does_not_update_shadow(self):
+        device = MockRegisterDevice({1: 5})
+        self.run_async(device.read_registers([1]))
+        self.assertEqual(device._register_shadow, {})
+        device.requests.clear()
+        self.run_async(device.write_registers({1: 5}))
+        self.assertEqual(device.requests, [("write", 1)])
+
+    def test_forget_registers(self):
+        device = MockRegisterDevice({1: 0})
+        self.run_async(device.write_registers({1: 10}))
+        device.forget_registers()
+        device.requests.clear()
+        self.run_async(device.write_registers({1: 10}))
+        self.assertEqual(device.requests, [("write", 1)])
+
+    def test_error_stops_pipeline(self):
+        device = MockRegisterDevice({addr: 0 for addr in range(40)}, missing={3})
+        with self.assertRaisesRegex(GlasgowDeviceError, r"register 0x03 does not exist"):
+            self.run_async(device.read_registers(range(40)))
+        # Only the first batch was started.
+        self.assertEqual(device.requests,
+                         [("read", addr) for addr in range(device._max_register_requests)])
+
+    def test_error_invalidates_shadow(self):
+        device = MockRegisterDevice({1: 0, 2: 0}, missing={2})
+        with self.assertRaises(GlasgowDeviceError):
+            self.run_async(device.write_registers({1: 10, 2: 20}))
+        self.assertEqual(device._register_shadow, {1: 10})
+
+
+class MockBitstreamDevice(GlasgowHardwareDevice):
+    # Records bitstream chunks in the order they are submitted; every control transfer yields to
+    # the event loop a few times so that the download pipeline fills up.
+    def __init__(self, *, fail_chunk=None, fail_id=False):
+        self._register_shadow = {}
+        self.fail_chunk = fail_chunk
+        self.fail_id    = fail_id
+        self.chunks     = []
+        self.completed  = []
+        self.bitstream_id = None
+        self.inflight   = 0
+        self.max_inflight = 0
+
+    async def control_write(self, request_type, request, value, index, data):
+        if request == REQ_BITSTREAM_ID:
+            if self.fail_id:
+                raise usb1.USBErrorPipe()
+            self.bitstream_id = bytes(data)
+            return
+        assert request == REQ_FPGA_CFG
+        self.chunks.append((index, bytes(data)))
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            for _ in range(3):
+                await asyncio.sleep(0)
+            if index == self.fail_chunk:
+                raise usb1.USBErrorPipe()
+            self.completed.append(index)
+        finally:
+            self.inflight -= 1
+
+
+class BitstreamDownloadTestCase(unittest.TestCase):
+    def run_async(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def test_chunk_order(self):
+        bitstream = bytes(range(256)) * 41 # 10 full chunks and a partial one
+        device = MockBitstreamDevice()
+        self.run_async(device.download_bitstream(bitstream, b"\x5a" * 16))
+        self.assertEqual([index for index, _ in device.chunks], list(range(11)))
+        self.assertEqual(device.completed, list(range(11)))
+        self.assertEqual(b"".join(chunk for _, chunk in device.chunks), bitstream)
+        self.assertEqual(device.max_inflight, device._max_bitstream_requests)
+        self.assertEqual(device.bitstream_id, b"\x5a" * 16)
+
+    def test_chunk_error(self):
+        device = MockBitstreamDevice(fail_chunk=2)
+        with self.assertRaises(usb1.USBErrorPipe):
+            self.run_async(device.download_bitstream(bytes(1024 * 20)))
+        # No chunk is submitted after the failed one completes, the chunks that were already in
+        # flight are cancelled and waited for, and the FPGA is not started.
+        self.assertEqual([index for index, _ in device.chunks], list(range(len(device.chunks))))
+        self.assertLessEqual(len(device.chunks), 2 + device._max_bitstream_requests)
+        self.assertEqual(device.completed[:2], [0, 1])
+        self.assertNotIn(2, device.completed)
+        self.assertEqual(device.inflight, 0)
+        self.assertIsNone(device.bitstream_id)
+
+    def test_bitstream_id_error(self):
+        device = MockBitstreamDevice(fail_id=True)
+        with self.assertRaisesRegex(GlasgowDeviceError, r"FPGA configuration failed"):
+            self.run_async(device.download_bitstream(bytes(1024)))
+
+
+class _MockUSBDevice:
+    # Implements the subset of `usb1.USBDevice` used to look up a device at a cached location.
+    def __init__(self, serial, bus, ports, *, revision="C3"):
+        self.serial   = serial
+        self.bus      = bus
+        self.ports    = ports
+        self.revision = revision
+        self.handles  = []
+
+    def getVendorID(self):
+        return VID_QIHW
+
+    def getProductID(self):
+        return PID_GLASGOW
+
+    def getbcdDevice(self):
+        return (CUR_API_LEVEL << 8) | GlasgowConfig.encode_revision(self.revision)
+
+    def getBusNumber(self):
+        return self.bus
+
+    def getPortNumberList(self):
+        return self.ports
+
+    def getManufacturerDescriptor(self):
+        return 1
+
+    def getProductDescriptor(self):
+        return 2
+
+    def getSerialNumberDescriptor(self):
+        return 3
+
+    def open(self):
+        self.handles.append(_MockUSBDeviceHandle(self))
+        return self.handles[-1]
+
+
+class _MockUSBDeviceHandle:
+    def __init__(self, device):
+        self.device = device
+        self.closed = False
+
+    def setAutoDetachKernelDriver(self, enable):
+        pass
+
+    def getASCIIStringDescriptor(self, index):
+        return {
+            1: "1BitSquared",
+            2: "Glasgow Interface Explorer",
+            3: self.device.serial,
+        }[index]
+
+    def close(self):
+        self.closed = True
+
+
+class _MockUSBContext:
+    def __init__(self, devices=()):
+        self.devices = devices
+        self.closed  = 0
+        self._interrupted = threading.Event()
+
+    def getDeviceIterator(self, skip_on_error=False):
+        return iter(self.devices)
+
+    def handleEvents(self):
+        self._interrupted.wait()
+
+    def interruptEventHandler(self):
+        self._interrupted.set()
+
+    def close(self):
+        self.closed += 1
+
+
+class CachedLocationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = JSONCache(pathlib.Path(self.tempdir.name) / "devices.json")
+        self.cache.save({"C3-20230101T000000Z": [1, 2, 3]})
+        self.patch = mock.patch.object(GlasgowHardwareDevice, "_location_cache", self.cache)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tempdir.cleanup()
+
+    def test_hit(self):
+        other  = _MockUSBDevice("C3-20230202T000000Z", 1, [2, 4])
+        device = _MockUSBDevice("C3-20230101T000000Z", 1, [2, 3])
+        context = _MockUSBContext([other, device])
+        self.assertEqual(
+            GlasgowHardwareDevice._find_cached_device(context, "C3-20230101T000000Z"),
+            ("C3", device))
+        # Only the device at the cached location is opened.
+        self.assertEqual((len(other.handles), len(device.handles)), (0, 1))
+
+    def test_miss_not_cached(self):
+        device = _MockUSBDevice("C3-20230202T000000Z", 1, [2, 3])
+        context = _MockUSBContext([device])
+        self.assertIsNone(
+            GlasgowHardwareDevice._find_cached_device(context, "C3-20230202T000000Z"))
+        self.assertEqual(device.handles, [])
+
+    def test_miss_serial_changed(self):
+        # A different device was plugged into the port the requested one used to be in.
+        device = _MockUSBDevice("C3-20230202T000000Z", 1, [2, 3])
+        context = _MockUSBContext([device])
+        self.assertIsNone(
+            GlasgowHardwareDevice._find_cached_device(context, "C3-20230101T000000Z"))
+
+    def test_miss_enumerates(self):
+        device = _MockUSBDevice("C3-20230202T000000Z", 1, [2, 3])
+        context = _MockUSBContext([device])
+        enumerated = {"C3-20230101T000000Z": ("C3", object())}
+        with mock.patch.object(GlasgowHardwareDevice, "_enumerate_devices",
+                               return_value=enumerated) as enumerate_devices:
+            self.assertEqual(
+                GlasgowHardwareDevice._select_devices(context, ["C3-20230101T000000Z"]),
+                [enumerated["C3-20230101T000000Z"]])
+        enumerate_devices.assert_called_once_with(context)
+
+
+class OpenManyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.usb_devices = [
+            _MockUSBDevice("C3-20230101T000000Z", 1, [1]),
+            _MockUSBDevice("C3-20230202T000000Z", 1, [2]),
+            _MockUSBDevice("C3-20230303T000000Z", 1, [3]),
+        ]
+        self.context = _MockUSBContext()
+
+    def open_many(self, usb_devices):
+        with mock.patch.object(usb1, "USBContext", return_value=self.context), \
+                mock.patch.object(GlasgowHardwareDevice, "_select_devices",
+                                  return_value=[("C3", device) for device in usb_devices]):
+            return GlasgowHardwareDevice.open_many()
+
+    def test_shared_poller(self):
+        devices = self.open_many(self.usb_devices)
+        self.assertEqual([device.serial for device in devices],
+                         [usb_device.serial for usb_device in self.usb_devices])
+        poller = devices[0].usb_poller
+        self.assertTrue(all(device.usb_poller is poller for device in devices))
+        self.assertEqual(poller.users, 3)
+        self.assertTrue(poller.is_alive())
+        # The poller and context are kept until the last device is closed, in any order.
+        for device, users in zip([devices[1], devices[0], devices[2]], [2, 1, 0]):
+            device.close()
+            self.assertTrue(device.usb_handle.closed)
+            self.assertEqual(poller.users, users)
+            self.assertEqual(poller.is_alive(), users > 0)
+            self.assertEqual(self.context.closed, int(users == 0))
+
+    def pollers(self):
+        return [thread for thread in threading.enumerate() if isinstance(thread, _PollerThread)]
+
+    def test_open_error(self):
+        self.usb_devices[1].open = mock.Mock(side_effect=usb1.USBErrorAccess())
+        with self.assertRaises(usb1.USBErrorAccess):
+            self.open_many(self.usb_devices)
+        # The device that was opened is closed again, which releases the poller and context.
+        self.assertTrue(all(handle.closed for handle in self.usb_devices[0].handles))
+        self.assertEqual(self.pollers(), [])
+        self.assertEqual(self.context.closed, 1)
+
+    def test_open_first_error(self):
+        self.usb_devices[0].open = mock.Mock(side_effect=usb1.USBErrorAccess())
+        with self.assertRaises(usb1.USBErrorAccess):
+            self.open_many(self.usb_devices)
+        self.assertEqual(self.pollers(), [])
+        self.assertEqual(self.context.closed, 1)
+
+
+class _MockTransfer:
+    # Implements the subset of `usb1.USBTransfer` used by `GlasgowHardwareDevice`. Transfers
+    # stay submitted until the test completes them with `finish`.
+    def __init__(self):
+        self.submitted = False
+        self.status    = None
+        self.buffer    = None
+        self.callback  = None
+
+    def setBulk(self, endpoint, buffer):
+        self.endpoint, self.buffer = endpoint, buffer
+
+    def setBuffer(self, buffer):
+        self.buffer = None
+
+    def setCallback(self, callback):
+        self.callback = callback
+
+    def submit(self):
+        assert not self.submitted
+        self.submitted = True
+
+    def cancel(self):
+        if not self.submitted:
+            raise usb1.USBErrorNotFound()
+        self.finish(usb1.TRANSFER_CANCELLED)
+
+    def finish(self, status, data=b""):
+        assert self.submitted
+        self.buffer[:len(data)] = data
+        self.length    = len(data)
+        self.submitted = False
+        self.status    = status
+        self.callback(self)
+
+    def isSubmitted(self):
+        return self.submitted
+
+    def getStatus(self):
+        return self.status
+
+    def getType(self):
+        return usb1.TRANSFER_TYPE_BULK
+
+    def getEndpoint(self):
+        return self.endpoint
+
+    def getActualLength(self):
+        return self.length
+
+
+class _MockUSBHandle:
+    def __init__(self):
+        self.transfers = []
+
+    def getTransfer(self):
+        self.transfers.append(_MockTransfer())
+        return self.transfers[-1]
+
+
+class _MockPoller:
+    # Delivers completions on the next iteration of the event loop, like `_PollerThread`.
+    done = False
+
+    def complete(self, loop, callback, transfer):
+        loop.call_soon(callback, transfer)
+
+
+class MockTransferDevice(GlasgowHardwareDevice):
+    def __init__(self):
+        self.usb_handle     = _MockUSBHandle()
+        self.usb_poller     = _MockPoller()
+        self._transfer_pool = _TransferPool(self.usb_handle)
+
+
+class TransferPoolingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop   = asyncio.new_event_loop()
+        self.device = MockTransferDevice()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    async def step(self):
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    def test_reuse(self):
+        async def test():
+            for data in (b"abc", b"de"):
+                task = asyncio.ensure_future(self.device.bulk_read(1, 4))
+                await self.step()
+                self.device.usb_handle.transfers[-1].finish(usb1.TRANSFER_COMPLETED, data)
+                self.assertEqual(bytes(await task), data)
+            self.assertEqual(len(self.device.usb_handle.transfers), 1)
+        self.run_async(test())
+
+    def test_cancel_before_reuse(self):
+        async def test():
+            task_a = asyncio.ensure_future(self.device.bulk_read(1, 4))
+            await self.step()
+            transfer_a, = self.device.usb_handle.transfers
+            # The transfer completes, another request is made, and the first request is cancelled,
+            # all before any of them runs. The completed transfer must not be reused by the second
+            # request while the first one can still try to cancel it.
+            transfer_a.finish(usb1.TRANSFER_COMPLETED, b"ab")
+            task_b = asyncio.ensure_future(self.device.bulk_read(1, 4))
+            task_a.cancel()
+            await self.step()
+            transfer_b = self.device.usb_handle.transfers[-1]
+            self.assertIsNot(transfer_b, transfer_a)
+            self.assertTrue(transfer_b.submitted)
+            with self.assertRaises(asyncio.CancelledError):
+                await task_a
+            transfer_b.finish(usb1.TRANSFER_COMPLETED, b"xy")
+            self.assertEqual(bytes(await task_b), b"xy")
+            self.assertEqual(self.device._transfer_pool._transfers, [transfer_a, transfer_b])
+        self.run_async(test())
+
+    def test_cancel_in_flight(self):
+        async def test():
+            task = asyncio.ensure_future(self.device.bulk_read(1, 4))
+            await self.step()
+            transfer, = self.device.usb_handle.transfers
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(transfer.status, usb1.TRANSFER_CANCELLED)
+            self.assertEqual(self.device._transfer_pool._transfers, [transfer])
+            # The buffer of the cancelled read was returned to the pool too.
+            self.assertEqual(len(self.device._transfer_pool._released), 1)
+        self.run_async(test())
+
+
+class PollerBatchingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop   = asyncio.new_event_loop()
+        self.poller = _PollerThread(context=None)
+        self.errors = []
+        self.loop.set_exception_handler(lambda loop, context: self.errors.append(context))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_pending(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_batch(self):
+        calls = []
+        for index in range(3):
+            self.poller.complete(self.loop, calls.append, index)
+        self.poller._deliver()
+        self.run_pending()
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(self.poller.completion_count, 3)
+        self.assertEqual(self.poller.wakeup_count, 1)
+        self.assertEqual(self.poller.coalesced_count, 2)
+
+    def test_batch_per_loop(self):
+        other_loop = asyncio.new_event_loop()
+        try:
+            calls = []
+            self.poller.complete(self.loop, calls.append, 0)
+            self.poller.complete(other_loop, calls.append, 1)
+            self.poller.complete(self.loop, calls.append, 2)
+            self.poller._deliver()
+            self.run_pending()
+            self.assertEqual(calls, [0, 2])
+            other_loop.run_until_complete(asyncio.sleep(0))
+            self.assertEqual(calls, [0, 2, 1])
+            self.assertEqual(self.poller.wakeup_count, 2)
+        finally:
+            other_loop.close()
+
+    def test_callback_error(self):
+        calls = []
+        def fail(transfer):
+            raise asyncio.InvalidStateError("invalid state")
+        self.poller.complete(self.loop, calls.append, 0)
+        self.poller.complete(self.loop, fail, 1)
+        self.poller.complete(self.loop, calls.append, 2)
+        self.poller._deliver()
+        self.run_pending()
+        # The error is reported, and the callbacks after the failed one still run.
+        self.assertEqual(calls, [0, 2])
+        error, = self.errors
+        self.assertIsInstance(error["exception"], asyncio.InvalidStateError)
+        self.assertEqual(error["transfer"], 1)
@@ -1,9 +1,10 @@
 import unittest
+from collections import namedtuple
 from amaranth import *
 from amaranth.lib.fifo import SyncFIFOBuffered
 
 from glasgow.gateware import simulation_test
-from glasgow.gateware.analyzer import EventAnalyzer, TraceDecoder, REPORT_DELAY, REPORT_EVENT, REPORT_SPECIAL, SPECIAL_DONE, SPECIAL_OVERRUN
+from glasgow.gateware.analyzer import EventAnalyzer, TraceDecoder, TraceDecodingError, REPORT_DELAY, REPORT_EVENT, REPORT_SPECIAL, SPECIAL_DONE, SPECIAL_OVERRUN, SPECIAL_THROTTLE
 
 
 class EventAnalyzerTestbench(Elaboratable):
@@ -378,3 +379,123 @@ class EventAnalyzerTestCase(unittest.TestCase):
         ], [
             (0x10000, "overrun"),
         ], flush_pending=False)
+
+
+# The decoder only needs the description of the event sources, not the gateware.
+_EventSource = namedtuple("_EventSource", ("name", "kind", "width", "fields"))
+
+
+class TraceDecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.event_sources = [
+            _EventSource("a", "change", 12, ()),
+            _EventSource("b", "strobe", 8, (("x", 3), ("y", 5))),
+            _EventSource("c", "strobe", 0, ()),
+        ]
+        self.trace = bytes([
+            REPORT_DELAY|2,
+            REPORT_EVENT|0, 0x0a, 0xbc,
+            REPORT_EVENT|2,
+            REPORT_DELAY|1, REPORT_DELAY|0,
+            REPORT_EVENT|1, 0b10110_101,
+            REPORT_DELAY|3,
+            REPORT_SPECIAL|SPECIAL_DONE,
+        ])
+
+    def test_columns(self):
+        decoder = TraceDecoder(self.event_sources)
+        decoder.process(self.trace)
+        self.assertTrue(decoder.is_done())
+        trace = decoder.flush_columns()
+        self.assertEqual(list(trace.timestamps), [2, 130, 133])
+        self.assertEqual({name: (list(rows), values if values is None else list(values))
+                          for name, (rows, values) in trace.columns.items()}, {
+            "throttle": ([], []),
+            "a":        ([0], [0xabc]),
+            "x-b":      ([1], [0b101]),
+            "y-b":      ([1], [0b10110]),
+            "c":        ([0], None),
+        })
+        self.assertIsNone(trace.overrun)
+
+    def test_rows(self):
+        decoder = TraceDecoder(self.event_sources)
+        decoder.process(self.trace)
+        self.assertEqual(decoder.flush(), [
+            (2,   {"a": 0xabc, "c": None}),
+            (130, {"x-b": 0b101, "y-b": 0b10110}),
+            (133, {}),
+        ])
+
+    def test_split(self):
+        decoder = TraceDecoder(self.event_sources)
+        timeline = []
+        for octet in self.trace:
+            decoder.process([octet])
+            timeline += decoder.flush()
+        self.assertEqual(timeline, [
+            (2,   {"a": 0xabc, "c": None}),
+            (130, {"x-b": 0b101, "y-b": 0b10110}),
+            (133, {}),
+        ])
+
+    def test_split_chunks(self):
+        for split in range(len(self.trace) + 1):
+            decoder = TraceDecoder(self.event_sources)
+            decoder.process(self.trace[:split])
+            decoder.process(memoryview(self.trace)[split:])
+            self.assertTrue(decoder.is_done())
+            self.assertEqual(decoder.flush(), [
+                (2,   {"a": 0xabc, "c": None}),
+                (130, {"x-b": 0b101, "y-b": 0b10110}),
+                (133, {}),
+            ])
+
+    def test_skip(self):
+        for split in range(len(self.trace) + 1):
+            decoder = TraceDecoder(self.event_sources)
+            decoder.skip(self.trace[:split])
+            self.assertEqual(decoder.is_done(), split == len(self.trace))
+            decoder.skip(memoryview(self.trace)[split:])
+            self.assertTrue(decoder.is_done())
+            self.assertFalse(decoder.is_overrun())
+            self.assertEqual(decoder.flush(), [])
+
+    def test_skip_overrun(self):
+        decoder = TraceDecoder(self.event_sources)
+        decoder.skip([REPORT_EVENT|1, 0x80, REPORT_DELAY|1, REPORT_SPECIAL|SPECIAL_OVERRUN])
+        self.assertTrue(decoder.is_done())
+        self.assertTrue(decoder.is_overrun())
+
+    def test_skip_invalid(self):
+        decoder = TraceDecoder(self.event_sources)
+        with self.assertRaisesRegex(TraceDecodingError,
+                r"^at byte offset 1: invalid byte 0x02 for state IDLE$"):
+            decoder.skip([REPORT_EVENT|2, REPORT_SPECIAL|SPECIAL_THROTTLE])
+
+    def test_invalid_split(self):
+        decoder = TraceDecoder(self.event_sources)
+        decoder.process([REPORT_EVENT|0, 0x0a])
+        with self.assertRaisesRegex(TraceDecodingError,
+                r"^at byte offset 3: invalid byte 0x02 for state IDLE$"):
+            decoder.process([0xbc, REPORT_SPECIAL|SPECIAL_THROTTLE])
+
+    def test_wide(self):
+        decoder = TraceDecoder([_EventSource("w", "strobe", 72, ())])
+        decoder.process(bytes([REPORT_EVENT|0, *range(1, 10)]))
+        trace = decoder.flush_columns(pending=True)
+        rows, values = trace.columns["w"]
+        self.assertEqual(list(rows), [0])
+        self.assertEqual(values, [0x010203040506070809])
+
+    def test_invalid(self):
+        decoder = TraceDecoder(self.event_sources)
+        with self.assertRaisesRegex(TraceDecodingError,
+                r"^at byte offset 1: invalid byte 0x02 for state IDLE$"):
+            decoder.process([REPORT_EVENT|2, REPORT_SPECIAL|SPECIAL_THROTTLE])
+
+    def test_out_of_bounds(self):
+        decoder = TraceDecoder(self.event_sources)
+        with self.assertRaisesRegex(TraceDecodingError,
+                r"^at byte offset 0: event source out of bounds$"):
+            decoder.process([REPORT_EVENT|3])
@@ -1,8 +1,9 @@
 import re
+import asyncio
 import unittest
 
 from glasgow.support.bits import *
-from glasgow.protocol.jtag_svf import SVFLexer, SVFParser, SVFParsingError
+from glasgow.protocol.jtag_svf import SVFLexer, SVFParser, SVFParsingError, SVFProgram, parse_svf
 
 
 class SVFLexerTestCase(unittest.TestCase):
@@ -62,6 +63,28 @@ class SVFLexerTestCase(unittest.TestCase):
     def test_error(self):
         with self.assertRaises(SVFParsingError):
             SVFLexer("XXX").next()
+        with self.assertRaisesRegex(SVFParsingError,
+                r"^unrecognized SVF data at line 2, column 3 \(\$\$\.\.\.\)$"):
+            lexer = SVFLexer("TRST\n  $$")
+            lexer.next()
+            lexer.next()
+
+    def test_bytes(self):
+        self.assertLexes(b"SIR 8 TDI (a\r\n5) ! comment\n;",
+                         ["SIR", 8, "TDI", bits("10100101"), ";"])
+        self.assertLexes(b"RUNTEST 1E-3 SEC; PIO (HZ);",
+                         ["RUNTEST", 1e-3, "SEC", ";", "PIO", ("HZ",), ";"])
+
+    def test_lowercase(self):
+        self.assertLexes("trst off;",
+                         ["TRST", "OFF", ";"])
+
+    def test_peek(self):
+        lexer = SVFLexer("TRST OFF;")
+        self.assertEqual(lexer.peek(), "TRST")
+        self.assertEqual(lexer.next(), "TRST")
+        self.assertEqual(lexer.next(), "OFF")
+        self.assertEqual((lexer.token_position, lexer.position), (5, 8))
 
 
 class SVFMockEventHandler:
@@ -361,6 +384,60 @@ class SVFParserTestCase(unittest.TestCase):
         parser.parse_command()
         self.assertEqual(parser.last_command(), " SIR 8 TDI (aa);")
 
+    def test_last_command_line(self):
+        handler = SVFMockEventHandler()
+        parser = SVFParser("! comment\nTRST OFF;\n\n  SIR 8\nTDI (aa); STATE IDLE;", handler)
+        lines = []
+        while parser.parse_command():
+            lines.append(parser.last_command_line())
+        self.assertEqual(lines, [2, 4, 5])
+
+
+class SVFProgramTestCase(unittest.TestCase):
+    source = """
+        FREQUENCY 1E6 HZ;
+        TRST ABSENT;
+        STATE IRUPDATE IDLE;
+        SIR 8 TDI (a) TDO (3) MASK (f);
+        SDR 12 TDI (abc);
+        RUNTEST 100 TCK 1E-3 SEC ENDSTATE IDLE;
+        PIOMAP (IN FOO);
+    """
+
+    def test_compile(self):
+        handler = SVFMockEventHandler()
+        SVFParser(self.source, handler).parse_file()
+        program = SVFProgram.compile(self.source)
+        self.assertEqual([(name, kwargs) for _, name, kwargs in program], handler.events)
+        self.assertEqual([line for line, _, _ in program], [2, 3, 4, 5, 6, 7, 8])
+
+    def test_parse_svf(self):
+        commands = parse_svf(self.source.encode("ascii"))
+        self.assertEqual(next(commands), (2, "svf_frequency", {"frequency": 1e6}))
+        self.assertEqual(list(commands), SVFProgram.compile(self.source).commands[1:])
+
+    def test_roundtrip(self):
+        program = SVFProgram.compile(self.source)
+        self.assertEqual(SVFProgram.from_bytes(program.to_bytes()).commands, program.commands)
+
+    def test_play(self):
+        handler = SVFMockEventHandler()
+        async def svf_event(**kwargs):
+            handler.events.append(kwargs)
+        handler.svf_trst = svf_event
+        program = SVFProgram.compile("TRST ON; TRST OFF;")
+        asyncio.get_event_loop().run_until_complete(program.play(handler))
+        self.assertEqual(handler.events, [{"mode": "ON"}, {"mode": "OFF"}])
+
+    def test_invalid(self):
+        data = SVFProgram.compile(self.source).to_bytes()
+        with self.assertRaisesRegex(ValueError, r"^not a compiled SVF program$"):
+            SVFProgram.from_bytes(b"SVF")
+        with self.assertRaisesRegex(ValueError, r"^truncated compiled SVF program$"):
+            SVFProgram.from_bytes(data[:-1])
+        with self.assertRaisesRegex(ValueError, r"^trailing data after compiled SVF program$"):
+            SVFProgram.from_bytes(data + b"\x00")
+
 # -------------------------------------------------------------------------------------------------
 
 class SVFPrintingEventHandler:
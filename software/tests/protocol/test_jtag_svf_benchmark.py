@@ -0,0 +1,58 @@
+import os
+import mmap
+import time
+import random
+import tempfile
+import unittest
+
+from glasgow.protocol.jtag_svf import parse_svf
+
+
+# Run with `GLASGOW_BENCHMARK=1 python -m unittest tests.protocol.test_jtag_svf_benchmark -v`.
+@unittest.skipUnless(os.environ.get("GLASGOW_BENCHMARK"), "benchmarks are not enabled")
+class SVFParserBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def scan_data(self, length, *, line_length=64):
+        data = f"{self.rng.getrandbits(length):0{(length + 3) // 4}x}"
+        return "\n\t".join(data[i:i + line_length] for i in range(0, len(data), line_length))
+
+    def cpld_svf(self, count):
+        # Many small commands, like a CPLD programming file.
+        parts = ["TRST OFF;\nENDIR IDLE;\nENDDR IDLE;\nSTATE RESET;\nSTATE IDLE;\n"]
+        for _ in range(count):
+            parts.append("SIR 8 TDI (01) SMASK (ff);\n")
+            parts.append(f"SDR 2048 TDI ({self.scan_data(2048)}) SMASK (ff);\n")
+            parts.append("RUNTEST 100 TCK 1.00E-03 SEC;\n")
+            parts.append(f"SDR 32 TDI (00000000) TDO ({self.scan_data(32)}) MASK (ffffffff);\n")
+        return "".join(parts), 5 + 4 * count
+
+    def fpga_svf(self, length):
+        # A few huge commands, like an FPGA configuration file.
+        return (f"STATE RESET;\nSIR 8 TDI (05);\nSDR {length} TDI ({self.scan_data(length)});\n"
+                f"SDR {length} TDI ({self.scan_data(length)}) TDO ({self.scan_data(length)});\n",
+                4)
+
+    def measure(self, name, source, count):
+        with tempfile.TemporaryFile() as file:
+            file.write(source.encode("ascii"))
+            file.flush()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for kind, buffer in (("str", source), ("mmap", data)):
+                    started = time.perf_counter()
+                    commands = sum(1 for _ in parse_svf(buffer))
+                    elapsed = time.perf_counter() - started
+                    self.assertEqual(commands, count)
+                    print(f"{name} ({kind}): {len(source) / elapsed / 1e6:.1f} MB/s, "
+                          f"{commands / elapsed:.0f} commands/s")
+
+    def test_cpld(self):
+        self.measure("many small commands", *self.cpld_svf(5000))
+
+    def test_fpga(self):
+        self.measure("few large commands", *self.fpga_svf(32 << 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
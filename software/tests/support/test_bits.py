@@ -146,6 +146,8 @@ class BitsTestCase(unittest.TestCase):
         self.assertBits(some[8:24], 16, 0b0101010110011001)
         self.assertBits(some[23:7:-1], 16, 0b1001100110101010)
         self.assertBits(some[::-1], 32, 0b01010101100110011010101001100110)
+        self.assertBits(some[3:29], 26, 0b00110010101011001100110101)
+        self.assertBits(some[28:2:-1], 26, 0b10101100110011010101001100)
 
     def test_getitem_wrong(self):
         with self.assertRaisesRegex(TypeError,
@@ -169,11 +171,18 @@ class BitsTestCase(unittest.TestCase):
         self.assertBits((0,1,1,1) + bits("1010"), 8, 0b10101110)
         self.assertEqual(bits(b"\x10\x32") + bits(b"\x54\x06", 12), bits(b"\x10\x32\x54\x06", 28))
         self.assertEqual("01010101" + bits("1010"), bits("101001010101"))
+        self.assertEqual(bits(b"\x10\x32\x05", 19) + bits(b"\xff\x01", 9),
+                         bits(b"\x10\x32\xfd\x0f", 28))
+        self.assertEqual(bits("101") + bitarray("0111"), bits("0111101"))
+        self.assertEqual(bits("101").__radd__(bits("0111")), bits("1010111"))
 
     def test_mul(self):
         self.assertBits(bits("1011") * 4, 16, 0b1011101110111011)
         self.assertBits(4 * bits("1011"), 16, 0b1011101110111011)
         self.assertEqual(bits(b"\x55\xaa") * 4, bits(b"\x55\xaa" * 4))
+        self.assertEqual(bits("101") * 7, bits("101" * 7))
+        self.assertEqual(bits("101") * 0, bits())
+        self.assertEqual(bits("101") * -1, bits())
 
     def test_and(self):
         self.assertBits(bits("1010") & bits("1100"), 4, 0b1000)
@@ -204,6 +213,7 @@ class BitsTestCase(unittest.TestCase):
         self.assertBits(bits("1010").reversed(), 4, 0b0101)
         self.assertBits(bits("10101100").reversed(), 8, 0b00110101)
         self.assertEqual(bits(b"\x99\x55").reversed(), bits(b"\xaa\x99"))
+        self.assertBits(bits("1101010011").reversed(), 10, 0b1100101011)
 
     def test_byte_reversed(self):
         self.assertBits(bits("10101100").byte_reversed(), 8, 0b00110101)
@@ -228,6 +238,14 @@ class BitsTestCase(unittest.TestCase):
         self.assertEqual(bits("1011").find((1,0)), 1)
         self.assertEqual(bits("1011").find("01"), 1)
 
+        self.assertEqual(bits("1011").find(bits()), 0)
+        self.assertEqual(bits("1011").find(bits(), 3), 3)
+        self.assertEqual(bits("1011").find(bits("11011")), -1)
+        haystack = bits(0, 1000) + bits("1011001") + bits(0, 13) + bits("1011001")
+        self.assertEqual(haystack.find(bits("1011001")), 1000)
+        self.assertEqual(haystack.find(bits("1011001"), 1001), 1020)
+        self.assertEqual(haystack.find(bits("1011001"), 0, 1000), -1)
+
     def test_index(self):
         self.assertEqual(bits("1011").index(bits("11")), 0)
         self.assertEqual(bits("1011").index(bits("10")), 2)
@@ -321,6 +339,14 @@ class BitarrayTestCase(unittest.TestCase):
         some[2:6] = 2
         self.assertBitarray(some, 8, 0b11001011)
 
+        some = bitarray(b"\xaa\x99\x55\x66")
+        some[3:21] = bits(0x2ffff, 18)
+        self.assertBitarray(some, 32, 0x6657fffa)
+
+        some = bitarray("0101010101")
+        some[3:] = bits("110011001")
+        self.assertBitarray(some, 12, 0b110011001101)
+
         some = bitarray("0000")
         some[::-1] = bits("1010")
         self.assertBitarray(some, 4, 0b0101)
@@ -0,0 +1,97 @@
+import os
+import random
+import timeit
+import unittest
+
+from glasgow.support.bits import bits, bitarray
+
+
+# Run with `GLASGOW_BENCHMARK=1 python -m unittest tests.support.test_bits_benchmark -v`.
+@unittest.skipUnless(os.environ.get("GLASGOW_BENCHMARK"), "benchmarks are not enabled")
+class BitsBenchmark(unittest.TestCase):
+    # Each operation is measured for a byte-aligned, an unaligned, and a short unaligned length.
+    lengths = (("aligned", 4096), ("unaligned", 4099), ("short", 35))
+
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def random_bits(self, length, cls=bits):
+        return cls(self.rng.getrandbits(length), length)
+
+    def measure(self, name, make_stmt):
+        for kind, length in self.lengths:
+            stmt = make_stmt(length)
+            count, _ = timeit.Timer(stmt).autorange()
+            elapsed = min(timeit.repeat(stmt, number=count, repeat=3))
+            print(f"{name} ({kind}, {length} bits): {elapsed / count * 1e6:.2f} us")
+
+    def test_add(self):
+        def make_stmt(length):
+            a, b = self.random_bits(length), self.random_bits(length)
+            return lambda: a + b
+        self.measure("bits + bits", make_stmt)
+
+    def test_radd(self):
+        def make_stmt(length):
+            a, b = self.random_bits(length, bitarray), self.random_bits(length)
+            return lambda: a.__radd__(b)
+        self.measure("bits + bitarray", make_stmt)
+
+    def test_mul(self):
+        def make_stmt(length):
+            a = self.random_bits(length)
+            return lambda: a * 16
+        self.measure("bits * 16", make_stmt)
+
+    def test_slice(self):
+        def make_stmt(length):
+            a = self.random_bits(length)
+            return lambda: a[3:length - 2]
+        self.measure("bits[3:-2]", make_stmt)
+
+    def test_slice_reversed(self):
+        def make_stmt(length):
+            a = self.random_bits(length)
+            return lambda: a[::-1]
+        self.measure("bits[::-1]", make_stmt)
+
+    def test_reversed(self):
+        def make_stmt(length):
+            a = self.random_bits(length)
+            return lambda: a.reversed()
+        self.measure("bits.reversed()", make_stmt)
+
+    def test_find(self):
+        def make_stmt(length):
+            a = bits(0, length - 13) + bits("1011001110001")
+            return lambda: a.find(bits("1011001110001"))
+        self.measure("bits.find() (13-bit needle at the end)", make_stmt)
+
+    def test_bitop(self):
+        def make_stmt(length):
+            a, b = self.random_bits(length), self.random_bits(length)
+            return lambda: a & b
+        self.measure("bits & bits", make_stmt)
+
+    def test_extend(self):
+        def make_stmt(length):
+            a = self.random_bits(length)
+            def stmt():
+                b = bitarray()
+                for _ in range(16):
+                    b += a
+            return stmt
+        self.measure("bitarray += bits (16 times)", make_stmt)
+
+    def test_setitem_slice(self):
+        def make_stmt(length):
+            a = self.random_bits(length, bitarray)
+            b = self.random_bits(length // 2)
+            def stmt():
+                a[3:3 + len(b)] = b
+            return stmt
+        self.measure("bitarray[3:3 + n] = bits", make_stmt)
+
+
+if __name__ == "__main__":
+    unittest.main()
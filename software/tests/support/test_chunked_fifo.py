@@ -74,3 +74,40 @@ class ChunkedFIFOTestCase(unittest.TestCase):
         self.fifo.write(bits("1010"))
         self.assertEqual(len(self.fifo), 1)
         self.assertEqual(self.fifo.read(1), b"\x0a")
+
+    def test_release(self):
+        released = []
+        self.fifo.write(b"ABCD", release=released.append)
+        self.fifo.write(b"EF", release=released.append)
+        self.assertEqual(self.fifo.read(2), b"AB")
+        self.assertEqual(released, [])
+        self.assertEqual(self.fifo.read(2), b"CD")
+        self.assertEqual(released, [b"ABCD"])
+        self.assertEqual(self.fifo.read(), b"EF")
+        self.assertEqual(released, [b"ABCD", b"EF"])
+
+    def test_release_clear(self):
+        released = []
+        self.fifo.write(b"ABCD", release=released.append)
+        self.fifo.write(b"EF", release=released.append)
+        self.fifo.read(1)
+        self.fifo.clear()
+        self.assertEqual(released, [b"ABCD", b"EF"])
+
+    def test_readinto(self):
+        self.fifo.write(b"ABCD")
+        self.fifo.write(b"EF")
+        buffer = bytearray(5)
+        self.assertEqual(self.fifo.readinto(buffer), 5)
+        self.assertEqual(buffer, b"ABCDE")
+        self.assertEqual(self.fifo.readinto(buffer), 1)
+        self.assertEqual(buffer, b"FBCDE")
+        self.assertEqual(self.fifo.readinto(buffer), 0)
+        self.assertEqual(len(self.fifo), 0)
+
+    def test_readinto_view(self):
+        self.fifo.write(b"ABCD")
+        buffer = bytearray(b"....")
+        self.assertEqual(self.fifo.readinto(memoryview(buffer)[1:3]), 2)
+        self.assertEqual(buffer, b".AB.")
+        self.assertEqual(self.fifo.read(), b"CD")
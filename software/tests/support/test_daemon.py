@@ -0,0 +1,161 @@
+import io
+import os
+import stat
+import socket
+import asyncio
+import argparse
+import contextlib
+import logging
+import tempfile
+import unittest
+
+from glasgow.support.daemon import daemon_endpoint, DaemonServer, daemon_run_script, \
+    daemon_forward
+
+
+class DaemonEndpointTestCase(unittest.TestCase):
+    def test_unix(self):
+        self.assertEqual(daemon_endpoint("unix:/foo/bar"), ("unix", "/foo/bar"))
+
+    def test_tcp(self):
+        with self.assertRaisesRegex(argparse.ArgumentTypeError, r"only use a UNIX socket"):
+            daemon_endpoint("tcp::1234")
+
+
+class _LoopbackInterface:
+    def __init__(self):
+        self.queue   = asyncio.Queue()
+        self.flushes = 0
+
+    async def write(self, data):
+        await self.queue.put(bytes(data))
+
+    async def read(self):
+        return await self.queue.get()
+
+    async def flush(self):
+        self.flushes += 1
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.sock_addr = ("unix", os.path.join(self.tempdir.name, "daemon.sock"))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def run_with_daemon(self, case):
+        async def run():
+            iface = _LoopbackInterface()
+            server = DaemonServer(logging.getLogger(__name__), self.sock_addr, iface=iface,
+                make_globals=lambda args: {"iface": iface, "script_args": args})
+            server_task = asyncio.ensure_future(server.serve())
+            while server._server is None:
+                await asyncio.sleep(0)
+            try:
+                await case(iface)
+            finally:
+                server_task.cancel()
+                await asyncio.wait([server_task])
+            self.assertFalse(os.path.exists(self.sock_addr[1]))
+        asyncio.get_event_loop().run_until_complete(run())
+
+    def test_script(self):
+        async def case(iface):
+            response = await daemon_run_script(self.sock_addr,
+                "print(script_args)\nawait iface.write(b'x')", args=["a", "b"])
+            self.assertEqual(response, {"status": "ok", "output": "['a', 'b']\n"})
+            self.assertEqual(await iface.read(), b"x")
+            self.assertEqual(iface.flushes, 1)
+        self.run_with_daemon(case)
+
+    def test_script_output_isolated(self):
+        async def case(iface):
+            stdout = io.StringIO()
+            started = asyncio.Event()
+            iface.started = started
+            with contextlib.redirect_stdout(stdout):
+                script = asyncio.ensure_future(daemon_run_script(self.sock_addr,
+                    "import asyncio\nprint('a')\niface.started.set()\n"
+                    "await asyncio.sleep(0.01)\nprint('b')"))
+                # Output of the rest of the process while the script is running is unaffected.
+                await started.wait()
+                print("c")
+                response = await script
+            self.assertEqual(response, {"status": "ok", "output": "a\nb\n"})
+            self.assertEqual(stdout.getvalue(), "c\n")
+        self.run_with_daemon(case)
+
+    def test_socket_permissions(self):
+        async def case(iface):
+            self.assertEqual(stat.S_IMODE(os.stat(self.sock_addr[1]).st_mode), 0o600)
+        umask = os.umask(0)
+        try:
+            self.run_with_daemon(case)
+        finally:
+            os.umask(umask)
+
+    def test_stale_socket(self):
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(self.sock_addr[1])
+        async def case(iface):
+            response = await daemon_run_script(self.sock_addr, "print(1)")
+            self.assertEqual(response["output"], "1\n")
+        self.run_with_daemon(case)
+
+    def test_script_error(self):
+        async def case(iface):
+            response = await daemon_run_script(self.sock_addr, "print(1)\n1/0")
+            self.assertEqual(response["status"], "error")
+            self.assertEqual(response["output"], "1\n")
+            self.assertIn("ZeroDivisionError", response["error"])
+        self.run_with_daemon(case)
+
+    def test_script_serialized(self):
+        async def case(iface):
+            results = await asyncio.gather(*[
+                daemon_run_script(self.sock_addr,
+                    f"import asyncio\nprint({n})\nawait asyncio.sleep(0.01)\nprint({n})")
+                for n in range(3)
+            ])
+            self.assertEqual([result["output"] for result in results],
+                             ["0\n0\n", "1\n1\n", "2\n2\n"])
+        self.run_with_daemon(case)
+
+    def test_forward(self):
+        async def case(iface):
+            chunks = [b"abc", b"def"]
+            received = bytearray()
+            echoed = asyncio.Event()
+            async def read_input():
+                if chunks:
+                    return chunks.pop(0)
+                await echoed.wait()
+                return b""
+            async def write_output(data):
+                received.extend(data)
+                if received == b"abcdef":
+                    echoed.set()
+            response = await daemon_forward(self.sock_addr, read_input, write_output)
+            self.assertEqual(response, {"status": "ok"})
+            self.assertEqual(received, b"abcdef")
+        self.run_with_daemon(case)
+
+    def test_tcp_refused(self):
+        async def run():
+            server = DaemonServer(logging.getLogger(__name__), ("tcp", "localhost", 0),
+                iface=_LoopbackInterface(), make_globals=lambda args: {})
+            with self.assertRaisesRegex(OSError, r"only listen at a UNIX socket"):
+                await server.serve()
+            with self.assertRaisesRegex(OSError, r"only be reached at a UNIX socket"):
+                await daemon_run_script(("tcp", "localhost", 1), "pass")
+        asyncio.get_event_loop().run_until_complete(run())
+
+    def test_invalid(self):
+        async def case(iface):
+            reader, writer = await asyncio.open_unix_connection(self.sock_addr[1])
+            writer.write(b"[]\n")
+            self.assertIn(b"\"error\"", await reader.readline())
+            writer.close()
+        self.run_with_daemon(case)
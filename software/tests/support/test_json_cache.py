@@ -0,0 +1,43 @@
+import os
+import json
+import tempfile
+import unittest
+
+from glasgow.support.json_cache import JSONCache
+
+
+class JSONCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, "subdir", "cache.json")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_missing(self):
+        cache = JSONCache(self.filename)
+        self.assertEqual(cache.load(), {})
+
+    def test_roundtrip(self):
+        cache = JSONCache(self.filename)
+        cache.save({"a": [1, 2], "b": "c"})
+        self.assertEqual(cache.load(), {"a": [1, 2], "b": "c"})
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ["cache.json"])
+
+    def test_update(self):
+        cache = JSONCache(self.filename)
+        cache.save({"a": 1})
+        cache.update(lambda data: data.update(b=2))
+        self.assertEqual(cache.load(), {"a": 1, "b": 2})
+
+    def test_corrupt(self):
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, "w") as f:
+            f.write("{\"version\": 1, \"da")
+        self.assertEqual(JSONCache(self.filename).load(), {})
+
+    def test_version(self):
+        JSONCache(self.filename, version=1).save({"a": 1})
+        self.assertEqual(JSONCache(self.filename, version=2).load(), {})
+        with open(self.filename) as f:
+            self.assertEqual(json.load(f)["version"], 1)
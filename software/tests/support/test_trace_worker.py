@@ -0,0 +1,58 @@
+import io
+import asyncio
+import logging
+import unittest
+from collections import namedtuple
+from vcd import VCDWriter
+
+from glasgow.gateware.analyzer import TraceDecoder, REPORT_DELAY, REPORT_EVENT, REPORT_SPECIAL, SPECIAL_DONE
+from glasgow.support.trace_worker import TraceWorker
+
+
+_EventSource = namedtuple("_EventSource", ("name", "kind", "width", "fields"))
+
+
+class TraceWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.event_sources = [
+            _EventSource("a", "change", 12, ()),
+            _EventSource("c", "strobe", 0, ()),
+        ]
+        self.trace = bytes([
+            REPORT_DELAY|2,
+            REPORT_EVENT|0, 0x0a, 0xbc,
+            REPORT_EVENT|1,
+            REPORT_DELAY|5,
+            REPORT_EVENT|0, 0x01, 0x23,
+        ])
+        self.logger = logging.getLogger(__name__)
+
+    def run_worker(self, case, **kwargs):
+        async def run():
+            output = io.StringIO()
+            vcd_writer = VCDWriter(output, timescale="10 ns", check_values=False)
+            worker = TraceWorker(TraceDecoder(self.event_sources), vcd_writer,
+                                 sys_clk_freq=100_000_000, logger=self.logger, **kwargs)
+            await case(worker)
+            return output.getvalue()
+        return asyncio.get_event_loop().run_until_complete(run())
+
+    def test_done(self):
+        async def case(worker):
+            for byte in self.trace + bytes([REPORT_DELAY|1, REPORT_SPECIAL|SPECIAL_DONE]):
+                await worker.put(bytes([byte]))
+            await worker.wait()
+            with self.assertLogs(self.logger, level="INFO") as logs:
+                await worker.close()
+            self.assertIn("high-water mark", logs.output[0])
+        output = self.run_worker(case, max_chunks=2)
+        self.assertIn("b101010111100 \"", output)
+        self.assertIn("#7\nb100100011 \"", output)
+
+    def test_close_pending(self):
+        async def case(worker):
+            await worker.put(self.trace)
+            with self.assertLogs(self.logger, level="INFO"):
+                await worker.close()
+        output = self.run_worker(case)
+        self.assertIn("#7\nb100100011 \"", output)
@@ -0,0 +1,127 @@
+import os
+import time
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from glasgow.target.cache import BitstreamCache, parse_size
+from glasgow.target.hardware import GlasgowBuildPlan, build_bitstreams
+
+
+class ParseSizeTestCase(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_size("123"), 123)
+        self.assertEqual(parse_size(4096), 4096)
+        self.assertEqual(parse_size("512K"), 512 << 10)
+        self.assertEqual(parse_size("256MiB"), 256 << 20)
+        self.assertEqual(parse_size("1g"), 1 << 30)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_size("1T")
+        with self.assertRaises(ValueError):
+            parse_size("-1")
+
+
+class BitstreamCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = BitstreamCache(pathlib.Path(self.tempdir.name), max_size=1000)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get(b"\x01" * 16))
+        self.cache.put(b"\x01" * 16, b"bitstream")
+        self.assertIn(b"\x01" * 16, self.cache)
+        self.assertEqual(self.cache.get(b"\x01" * 16), b"bitstream")
+        (bitstream_id, size, last_used, verified), = self.cache.entries()
+        self.assertEqual(bitstream_id, b"\x01" * 16)
+        self.assertEqual(size, 32 + len(b"bitstream"))
+        self.assertTrue(verified)
+
+    def test_corrupted(self):
+        self.cache.put(b"\x01" * 16, b"bitstream")
+        filename = self.cache.filename(b"\x01" * 16)
+        with open(filename, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        self.assertIsNone(self.cache.get(b"\x01" * 16))
+        self.assertFalse(filename.exists())
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_adopt(self):
+        self.cache.path.mkdir(parents=True, exist_ok=True)
+        with open(self.cache.filename(b"\x02" * 16), "wb") as f:
+            f.write(b"\x00" * 32 + b"data")
+        (bitstream_id, size, last_used, verified), = self.cache.entries()
+        self.assertEqual(bitstream_id, b"\x02" * 16)
+        self.assertFalse(verified)
+        self.assertIsNone(self.cache.get(b"\x02" * 16))
+
+    def test_evict_lru(self):
+        self.cache.put(b"\x01" * 16, b"a" * 400)
+        self.cache.put(b"\x02" * 16, b"b" * 400)
+        time.sleep(0.01)
+        self.cache.get(b"\x01" * 16)
+        self.cache.put(b"\x03" * 16, b"c" * 400)
+        self.assertIn(b"\x01" * 16, self.cache)
+        self.assertNotIn(b"\x02" * 16, self.cache)
+        self.assertIn(b"\x03" * 16, self.cache)
+
+    def test_prune(self):
+        self.cache.put(b"\x01" * 16, b"a" * 100)
+        time.sleep(0.01)
+        self.cache.put(b"\x02" * 16, b"b" * 100)
+        self.assertEqual(self.cache.prune(200), [b"\x01" * 16])
+        self.assertEqual(self.cache.prune(0), [b"\x02" * 16])
+        self.assertEqual(self.cache.entries(), [])
+
+
+class _ThreadCheckingCache(BitstreamCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_threads = set()
+
+    def put(self, bitstream_id, bitstream_data):
+        self.put_threads.add(threading.get_ident())
+        super().put(bitstream_id, bitstream_data)
+
+
+class _FakeBuildPlan(GlasgowBuildPlan):
+    # A plan that is already elaborated, and whose "toolchain" returns fixed data.
+    def __init__(self, cache, bitstream_id, bitstream_data):
+        self._cache          = cache
+        self._index          = None
+        self._lower          = object()
+        self._bitstream_id   = bitstream_id
+        self._bitstream_data = bitstream_data
+
+    def execute(self, build_dir=None, *, debug=False):
+        time.sleep(0.01)
+        return self._bitstream_data
+
+
+class BuildBitstreamsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = _ThreadCheckingCache(pathlib.Path(self.tempdir.name), max_size=1 << 20)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_parallel(self):
+        plans = [(f"plan{index}", _FakeBuildPlan(self.cache, bytes([index]) * 16, b"bitstream"))
+                 for index in range(1, 9)]
+        plans.append(("plan1-copy", _FakeBuildPlan(self.cache, b"\x01" * 16, b"bitstream")))
+        results = {name: result for name, _, result, _, _ in build_bitstreams(plans, jobs=8)}
+        self.assertEqual(results, {name: "built" for name, _ in plans})
+        # The cache index is only updated by the calling thread, so no update of it is lost, and
+        # every bitstream is recorded in it as verified (rather than adopted by a later scan).
+        self.assertEqual(self.cache.put_threads, {threading.get_ident()})
+        entries = self.cache.entries()
+        self.assertEqual(sorted(bitstream_id for bitstream_id, *_ in entries),
+                         [bytes([index]) * 16 for index in range(1, 9)])
+        self.assertTrue(all(verified for *_, verified in entries))
@@ -0,0 +1,46 @@
+import os
+import sys
+import types
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from glasgow.target.hardware import _source_fingerprint, _tree_fingerprint
+
+
+class SourceFingerprintTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tempdir.name)
+        (self.root / "applet").mkdir()
+        (self.root / "__init__.py").write_text("")
+        (self.root / "applet" / "__init__.py").write_text("x = 1\n")
+        self.modules = {
+            "_fingerprint_pkg":        types.ModuleType("_fingerprint_pkg"),
+            "_fingerprint_pkg.applet": types.ModuleType("_fingerprint_pkg.applet"),
+        }
+        self.modules["_fingerprint_pkg"].__file__ = str(self.root / "__init__.py")
+        self.modules["_fingerprint_pkg.applet"].__file__ = str(self.root / "applet" / "__init__.py")
+        _tree_fingerprint.cache_clear()
+
+    def tearDown(self):
+        _tree_fingerprint.cache_clear()
+        self.tempdir.cleanup()
+
+    def fingerprint(self):
+        with mock.patch.dict(sys.modules, self.modules):
+            return _source_fingerprint("_fingerprint_pkg", "_fingerprint_pkg.applet")
+
+    def test_memoized(self):
+        with mock.patch("os.walk", wraps=os.walk) as walk:
+            first = self.fingerprint()
+            self.assertEqual(self.fingerprint(), first)
+        # The applet is inside the package, so only the package tree is walked, and only once.
+        walk.assert_called_once_with(self.root)
+
+    def test_changed(self):
+        first = self.fingerprint()
+        (self.root / "applet" / "__init__.py").write_text("x = 22\n")
+        _tree_fingerprint.cache_clear()
+        self.assertNotEqual(self.fingerprint(), first)
@@ -0,0 +1,72 @@
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from glasgow.support.json_cache import JSONCache
+from glasgow.target.toolchain import SystemTool
+
+
+class SystemToolIdentifierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tempdir.name)
+        # `icepack` has no data files, so only the binary itself contributes to the identifier.
+        self.binary = self.path / "icepack"
+        self.write_binary(b"#!/bin/sh\n# version 1\n")
+        self.patches = [
+            mock.patch.dict(os.environ, {"ICEPACK": str(self.binary)}),
+            mock.patch.object(SystemTool, "_persistent_identifier_cache",
+                              JSONCache(self.path / "toolchain.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.tempdir.cleanup()
+
+    def write_binary(self, contents):
+        self.binary.write_bytes(contents)
+        self.binary.chmod(0o755)
+
+    def identifier(self):
+        # A new instance is used every time, since each one memoizes its identifier.
+        return SystemTool("icepack").identifier
+
+    def test_cache_hit(self):
+        identifier = self.identifier()
+        with mock.patch.object(SystemTool, "_compute_identifier") as compute:
+            self.assertEqual(self.identifier(), identifier)
+        compute.assert_not_called()
+
+    def test_binary_changed(self):
+        identifier = self.identifier()
+        self.write_binary(b"#!/bin/sh\n# version 2, which is longer\n")
+        self.assertNotEqual(self.identifier(), identifier)
+        # The new identifier replaces the old one in the cache.
+        with mock.patch.object(SystemTool, "_compute_identifier") as compute:
+            self.assertNotEqual(self.identifier(), identifier)
+        compute.assert_not_called()
+
+    def test_binary_touched(self):
+        identifier = self.identifier()
+        stat = self.binary.stat()
+        os.utime(self.binary, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        with mock.patch.object(SystemTool, "_compute_identifier",
+                               wraps=lambda: identifier) as compute:
+            self.identifier()
+        compute.assert_called_once()
+
+    def test_binary_replaced(self):
+        identifier = self.identifier()
+        # Same size and modification time, but a different file (as if reinstalled).
+        stat = self.binary.stat()
+        replacement = self.path / "icepack.new"
+        replacement.write_bytes(b"#!/bin/sh\n# version 3\n")
+        replacement.chmod(0o755)
+        os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(replacement, self.binary)
+        self.assertNotEqual(self.identifier(), identifier)